@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：提交任务的准入控制与完成时间预估。任务服务器记录最近完成任务的各阶段耗时，
+#           api 据此与执行槽位数模拟排队，超过队列长度或单个客户端在途任务上限时拒绝提交并给出重试等待时间
+import json
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from datetime import datetime
+
+import config
+import logs
+import task_store
+
+log = logs.get_log('admission')
+
+# 还没有完成过任务时使用的单任务耗时(秒)
+DEFAULT_TASK_SECONDS = 300
+# 超时仍未完成的任务，剩余耗时按单任务耗时的该比例估计，避免预估时间为 0
+MIN_REMAINING_RATIO = 0.1
+# Retry-After 的上下限(秒)
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 3600
+
+
+class Rejected(Exception):
+    # 拒绝提交，retry_after 为建议的重试等待时间(秒)
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def stats_file():
+    return getattr(config, 'stage_stats_file', 'stage_stats.json')
+
+
+def read_stats():
+    try:
+        with open(stats_file(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'tasks': []}
+
+
+def record(task_id, durations, total):
+    # 任务服务器在任务正常完成后调用，只保留最近 admission_stats_window 个任务；失败只记录日志
+    window = getattr(config, 'admission_stats_window', 50)
+    try:
+        with task_store.file_lock(stats_file()):
+            stats = read_stats()
+            stats['tasks'].append({
+                'taskId': task_id,
+                'finishedAt': datetime.now().isoformat(),
+                'total': round(total, 3),
+                'stages': {name: round(seconds, 3) for name, seconds in durations.items()},
+            })
+            del stats['tasks'][:-window]
+            task_store.atomic_write_json(stats_file(), stats, indent=4)
+    except OSError as e:
+        log(f"记录任务 {task_id} 阶段耗时失败: {str(e)}", logging.ERROR, taskId=task_id)
+
+
+_cache = {'key': None, 'stats': {'tasks': []}}
+_cache_lock = threading.Lock()
+
+
+def read_stats_cached():
+    # 耗时统计文件只在任务完成时变化，未变化时直接使用缓存
+    try:
+        stat = os.stat(stats_file())
+    except FileNotFoundError:
+        return {'tasks': []}
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with _cache_lock:
+        if _cache['key'] == key:
+            return _cache['stats']
+    stats = read_stats()
+    with _cache_lock:
+        _cache['key'] = key
+        _cache['stats'] = stats
+    return stats
+
+
+def task_seconds(stats):
+    # 单任务耗时取最近完成任务总耗时的中位数，不受个别超长任务影响
+    totals = [item['total'] for item in stats['tasks'] if item.get('total')]
+    if not totals:
+        return getattr(config, 'admission_default_task_seconds', DEFAULT_TASK_SECONDS)
+    return statistics.median(totals)
+
+
+def stage_seconds(stats):
+    # 各阶段耗时的中位数，随提交结果返回，便于客户端展示
+    stages = {}
+    for item in stats['tasks']:
+        for name, seconds in item.get('stages', {}).items():
+            stages.setdefault(name, []).append(seconds)
+    return {name: round(statistics.median(values), 1) for name, values in stages.items()}
+
+
+def elapsed(task, now):
+    started = task.get('startedAt') or task.get('updatedAt') or task.get('createdAt')
+    try:
+        return max(0.0, now - datetime.fromisoformat(started).timestamp())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def schedule(tasks, seconds, now):
+    """
+    按执行槽位数模拟排队，返回 {taskId: (预计开始, 预计完成)}（相对现在的秒数）与下一个空闲槽位的时间。
+    执行中的任务按已运行时间估计剩余耗时，等待中的任务按任务列表顺序依次占用最早空闲的槽位
+    """
+    running = [t for t in tasks if t.get('status') == 'processing']
+    pending = [t for t in tasks if t.get('status') == 'pending']
+    capacity = getattr(config, 'max_concurrent_tasks', 0) or len(running) + len(pending) + 1
+    plan = {}
+    free = []
+    for task in running:
+        remaining = max(seconds - elapsed(task, now), seconds * MIN_REMAINING_RATIO)
+        plan[task['taskId']] = (0.0, remaining)
+        free.append(remaining)
+    free.sort()
+    # 超出槽位数的执行中任务（例如刚调小了配置）同样要等前面的任务结束
+    slots = free[:capacity] + [0.0] * max(0, capacity - len(free))
+    for remaining in free[capacity:]:
+        slots.sort()
+        slots[0] += remaining
+    for task in pending:
+        slots.sort()
+        start = slots[0]
+        slots[0] = start + seconds
+        plan[task['taskId']] = (start, start + seconds)
+    return plan, min(slots)
+
+
+def clamp_retry(seconds):
+    return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(seconds))))
+
+
+def admit(tasks, client, now=None):
+    """
+    在任务列表事务内调用，检查能否再加入一个等待中的任务。
+    超出限制时抛出 Rejected，否则返回新任务的排队位置与预计开始、完成时间
+    """
+    now = now or time.time()
+    stats = read_stats_cached()
+    seconds = task_seconds(stats)
+    plan, next_free = schedule(tasks, seconds, now)
+    pending = [t for t in tasks if t.get('status') == 'pending']
+
+    max_queue = getattr(config, 'admission_max_queue', 0)
+    if max_queue and len(pending) >= max_queue:
+        # 排在最前的等待任务开始执行后队列才会空出位置
+        retry = plan[pending[0]['taskId']][0] if pending else next_free
+        raise Rejected(f'等待中的任务已达上限 {max_queue}', clamp_retry(retry))
+
+    max_per_client = getattr(config, 'admission_max_per_client', 0)
+    if max_per_client and client:
+        inflight = [t['taskId'] for t in tasks
+                    if t.get('client') == client and t.get('status') in ('pending', 'processing')]
+        if len(inflight) >= max_per_client:
+            # 该客户端最早完成的任务结束后才能再提交
+            retry = min(plan[task_id][1] for task_id in inflight)
+            raise Rejected(f'该客户端未完成的任务已达上限 {max_per_client}', clamp_retry(retry))
+
+    start = next_free
+    finish = start + seconds
+    max_eta = getattr(config, 'admission_max_eta_seconds', 0)
+    if max_eta and finish > max_eta:
+        raise Rejected(f'预计完成时间超过 {max_eta} 秒', clamp_retry(finish - max_eta))
+
+    return {
+        'queuePosition': len(pending) + 1,
+        'etaSeconds': round(finish),
+        'estimatedStartAt': datetime.fromtimestamp(now + start).isoformat(timespec='seconds'),
+        'estimatedCompletionAt': datetime.fromtimestamp(now + finish).isoformat(timespec='seconds'),
+        'stageSeconds': stage_seconds(stats),
+    }
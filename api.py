@@ -1,15 +1,27 @@
 import uuid
 import json
+import logging
 import os
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from pydantic import BaseModel
 from typing import Optional, List
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from fastapi.concurrency import run_in_threadpool
 import shutil
 
+import admission
 import config
+import dedup
+import feed
+import logs
+import delivery
+import manifest
+import search_index
+import storage
+import task_store
+from static_assets import FileAsset, StaticAssets
 
 app = FastAPI()
 
@@ -24,169 +36,290 @@ class Task(BaseModel):
     createdAt: str
     updatedAt: str
     audioUrl: Optional[str] = None
+    audioFormats: Optional[dict] = None
     title: Optional[str] = None
     dialogue: Optional[List[dict]] = None
     status_details: Optional[dict] = None
+    duration: Optional[float] = None
+    chapters: Optional[List[dict]] = None
+    peaksUrl: Optional[str] = None
+    retries: Optional[int] = None
 
-def log(message):
-    print(f"[{datetime.now().isoformat()}] [API] {message}")
+class DialogueEdit(BaseModel):
+    index: int
+    content: str
+    role: Optional[str] = None
+
+class DialoguePatch(BaseModel):
+    lines: List[DialogueEdit]
+
+log = logs.get_log('api')
 
 def read_tasks():
+    # 任务列表按文件 mtime 缓存，返回的任务需复制后再修改
     try:
-        with open(config.task_list_file, 'r') as f:
-            content = f.read()
-            if not content:
-                return []
-            return json.loads(content)
-    except FileNotFoundError:
-        return []
+        return task_store.read_tasks_cached()
     except json.JSONDecodeError:
-        log(f"{config.task_list_file} 文件格式错误，重置为空列表")
+        log(f"{config.task_list_file} 文件格式错误，返回空列表")
         return []
 
-def write_tasks(tasks):
-    with open(config.task_list_file, 'w') as f:
-        json.dump(tasks, f, indent=4)
+# 任务标题、对话、进度与产物都从 manifest.json 读取，文件未变化时直接使用缓存
+manifests = manifest.ManifestCache()
 
-@app.post("/post_task")
-async def post_task(task: TaskCreate):
-    log(f"收到新任务请求: {task.url}")
+def apply_manifest(task):
+    task_id = task['taskId']
+    data = manifests.get(task_id)
+    task['title'] = data.get('title')
+    task['dialogue'] = data.get('dialogue')
+    task['status_details'] = data.get('progress')
+    # 时长、每条对话的起始时间与波形峰值在合并音频时生成，客户端无需下载音频即可展示和跳转
+    task['duration'] = data.get('duration')
+    task['chapters'] = data.get('chapters')
+    artifacts = data.get('artifacts') or {}
+    task['peaksUrl'] = f"/audio/{task_id}/{manifest.PEAKS_FILE}" if manifest.PEAKS_FILE in artifacts else None
+    if manifest.merged_audio(task_id, artifacts):
+        task['audioUrl'] = f"/audio/{task_id}/{task_id}.wav"
+        task['audioFormats'] = {
+            ext: f"/audio/{task_id}/{task_id}.{ext}"
+            for ext in delivery.FORMATS
+            if f"{task_id}.{ext}" in artifacts
+        }
+    else:
+        task['audioUrl'] = None
+        task['audioFormats'] = None
+
+def create_task(url, client=None):
     task_id = str(uuid.uuid4())
     log(f"生成任务ID: {task_id}")
     
     # 添加任务
     new_task = Task(
         taskId=task_id,
-        url=task.url,
+        url=url,
         status="pending",
         progress="等待处理",
         createdAt=datetime.now().isoformat(),
         updatedAt=datetime.now().isoformat()
     )
+    record = new_task.dict()
+    # 提交来源只用于在途任务计数，不在接口中返回
+    record['client'] = client
     
-    tasks = read_tasks()
-    tasks.append(new_task.dict())
-    write_tasks(tasks)
+    # 准入检查与写入在同一个文件锁内，多个 worker 并发提交时不会超出限制
+    with task_store.transaction() as txn:
+        estimate = admission.admit(txn.tasks, client)
+        txn.tasks.append(record)
+        txn.changed = True
     log(f"成功将新任务添加到 {config.task_list_file}")
+    return task_id, estimate
+
+def client_id(request):
+    # 部署在反向代理之后时按 X-Forwarded-For 的第一个地址区分客户端
+    if getattr(config, 'admission_trust_forwarded', False):
+        forwarded = request.headers.get('x-forwarded-for')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else None
+
+def load_task(taskId):
+    task = task_store.find_task(read_tasks(), taskId)
+    if not task:
+        return None
+    task = dict(task)
+    apply_manifest(task)
+    if task['audioUrl']:
+        log(f"音频文件已存在，任务ID: {taskId}", logging.DEBUG)
+        task['status'] = 'completed'
+    else:
+        log(f"音频文件不存在，任务ID: {taskId}", logging.DEBUG)
+    return task
+
+def load_completed_tasks():
+    # 列表只用于展示与播放，不返回对话内容（需要时通过 get_task 获取），响应体积不随对话长度增长
+    completed_tasks = []
+    for task in reversed(read_tasks()):
+        if task['status'] == 'completed':
+            task = dict(task)
+            apply_manifest(task)
+            task['dialogue'] = None
+            completed_tasks.append(Task(**task).dict())
+    return completed_tasks
+
+def render_completed_tasks():
+    # 任务很多时序列化同样耗时，在线程池中编码好，事件循环只负责发送
+    completed_tasks = load_completed_tasks()
+    return len(completed_tasks), json.dumps(completed_tasks, ensure_ascii=False).encode('utf-8')
+
+def cancel_task_in_store(taskId):
+    # 返回 None 表示任务不存在，否则返回取消前的状态
+    with task_store.transaction() as txn:
+        task = txn.find(taskId)
+        if not task:
+            return None
+        previous = task['status']
+        if previous not in ['completed', 'failed', 'cancelled']:
+            # 标记为已取消，执行线程会在下一个检查点中止并释放槽位
+            task['status'] = 'cancelled'
+            task['progress'] = '任务已取消'
+            task['updatedAt'] = datetime.now().isoformat()
+            txn.changed = True
+        return previous
+
+def edit_dialogue_in_store(taskId, lines):
+    """
+    修改已完成或失败任务的对话，保存后放回等待队列重新合成。
+    任务服务器只重新合成内容变化的片段，其余片段从 tts_cache/ 复用
+    """
+    with task_store.transaction() as txn:
+        task = txn.find(taskId)
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        if task['status'] not in ['completed', 'failed']:
+            raise HTTPException(status_code=409, detail=f"任务状态为 {task['status']}，只能修改已完成或失败的任务")
+        dialogue = manifest.read(taskId).get('dialogue') or []
+        if not dialogue:
+            raise HTTPException(status_code=409, detail="任务没有可修改的对话")
+        roles = {item.get('role') for item in dialogue}
+        changed = []
+        for edit in lines:
+            if not 0 <= edit.index < len(dialogue):
+                raise HTTPException(status_code=422, detail=f"对话序号 {edit.index} 超出范围 0-{len(dialogue) - 1}")
+            content = edit.content.strip()
+            if not content:
+                raise HTTPException(status_code=422, detail=f"第 {edit.index} 条对话内容为空")
+            role = edit.role or dialogue[edit.index].get('role')
+            if role not in roles:
+                raise HTTPException(status_code=422, detail=f"未知的角色: {role}")
+            if dialogue[edit.index].get('content') != content or dialogue[edit.index].get('role') != role:
+                dialogue[edit.index] = {**dialogue[edit.index], 'role': role, 'content': content}
+                changed.append(edit.index)
+        if not changed:
+            return {"taskId": taskId, "changedLines": [], "status": task['status']}
+
+        # 修改后的对话只写入 manifest，旧任务的 dialogue.json 此后不再读取
+        manifest.ManifestWriter(taskId).update(dialogue=dialogue)
+
+        task['status'] = 'pending'
+        task['progress'] = '等待重新合成'
+        task['resynthesize'] = True
+        task['updatedAt'] = datetime.now().isoformat()
+        for key in ('retries', 'retryAt', 'startedAt'):
+            task.pop(key, None)
+        txn.changed = True
+    return {"taskId": taskId, "changedLines": sorted(set(changed)), "status": 'pending'}
+
+def remove_task(taskId):
+    # 从任务列表中删除任务，正在执行的任务线程检测到任务不存在后会自行中止并清理目录
+    with task_store.transaction() as txn:
+        txn.tasks = [t for t in txn.tasks if t['taskId'] != taskId]
+        txn.changed = True
+    dedup.unregister(taskId)
+    search_index.remove_task(taskId)
+    feed.remove_episode(taskId)
+    manifests.forget(taskId)
     
-    log(f"任务创建成功，返回任务ID: {task_id}")
-    return {"taskId": task_id}
+    # 删除任务目录
+    task_dir = config.get_task_file(taskId)
+    if os.path.exists(task_dir):
+        shutil.rmtree(task_dir)
+        log(f"已删除任务目录: {task_dir}")
+
+# 以下接口中的文件读写都放到线程池执行，避免阻塞事件循环
+@app.post("/post_task")
+async def post_task(task: TaskCreate, request: Request):
+    log(f"收到新任务请求: {task.url}")
+    client = client_id(request)
+    try:
+        task_id, estimate = await run_in_threadpool(create_task, task.url, client)
+    except admission.Rejected as e:
+        # 过载时直接拒绝，客户端按 Retry-After 稍后重试，已排队的任务不受影响
+        log(f"拒绝新任务: {e.reason}，建议 {e.retry_after} 秒后重试", logging.WARNING, client=client)
+        raise HTTPException(status_code=429, detail=e.reason, headers={'Retry-After': str(e.retry_after)})
+    log(f"任务创建成功，返回任务ID: {task_id}，预计 {estimate['etaSeconds']} 秒后完成")
+    return {"taskId": task_id, **estimate}
 
 @app.get("/get_task")
 async def get_task(taskId: str):
-    log(f"收到获取任务状态请求，任务ID: {taskId}")
-    tasks = read_tasks()
-    
-    task = next((t for t in tasks if t['taskId'] == taskId), None)
-    
+    log(f"收到获取任务状态请求，任务ID: {taskId}", logging.DEBUG)
+    task = await run_in_threadpool(load_task, taskId)
     if not task:
         log(f"未找到任务，任务ID: {taskId}")
         raise HTTPException(status_code=404, detail="Task not found")
     
-    log(f"找到任务，任务ID: {taskId}")
-    wav_file = config.get_task_file(taskId, f"{taskId}.wav")
-    if os.path.exists(wav_file):
-        log(f"音频文件已存在，任务ID: {taskId}")
-        task['status'] = 'completed'
-        task['audioUrl'] = f"/audio/{taskId}/{taskId}.wav"
-    else:
-        log(f"音频文件不存在，任务ID: {taskId}")
-    
-    # 检查并读取title.txt文件
-    title_file = config.get_task_file(taskId, "title.txt")
-    if os.path.exists(title_file):
-        with open(title_file, 'r', encoding='utf-8') as f:
-            task['title'] = f.read().strip()
-    else:
-        task['title'] = None
-    
-    # 检查并读取dialogue.json文件
-    dialogue_file = config.get_task_file(taskId, "dialogue.json")
-    if os.path.exists(dialogue_file):
-        with open(dialogue_file, 'r', encoding='utf-8') as f:
-            task['dialogue'] = json.load(f)
-    else:
-        task['dialogue'] = None
-    
-    # 检查并读取status.json文件
-    status_file = config.get_task_file(taskId, "status.json")
-    if os.path.exists(status_file):
-        with open(status_file, 'r', encoding='utf-8') as f:
-            task['status_details'] = json.load(f)
-    else:
-        task['status_details'] = None
-    
-    log(f"返回任务信息，任务ID: {taskId}")
+    log(f"返回任务信息，任务ID: {taskId}", logging.DEBUG)
     return Task(**task)
 
 @app.get("/get_list")
 async def get_list():
     log("收到获取已完成任务列表请求")
-    tasks = read_tasks()
-    
-    completed_tasks = []
-    for task in reversed(tasks):
-        if task['status'] == 'completed':
-            # 检查并读取title.txt文件
-            title_file = config.get_task_file(task['taskId'], "title.txt")
-            if os.path.exists(title_file):
-                with open(title_file, 'r', encoding='utf-8') as f:
-                    task['title'] = f.read().strip()
-            else:
-                task['title'] = None
-            
-            # 检查并读取dialogue.json文件
-            dialogue_file = config.get_task_file(task['taskId'], "dialogue.json")
-            if os.path.exists(dialogue_file):
-                with open(dialogue_file, 'r', encoding='utf-8') as f:
-                    task['dialogue'] = json.load(f)
-            else:
-                task['dialogue'] = None
-            
-            # 检查音频文件是否存在
-            wav_file = config.get_task_file(task['taskId'], f"{task['taskId']}.wav")
-            if os.path.exists(wav_file):
-                task['audioUrl'] = f"/audio/{task['taskId']}/{task['taskId']}.wav"
-            else:
-                task['audioUrl'] = None
-            
-            completed_tasks.append(Task(**task))
-    
-    log(f"返回已完成任务列表，共 {len(completed_tasks)} 个任务")
-    return completed_tasks
+    count, body = await run_in_threadpool(render_completed_tasks)
+    log(f"返回已完成任务列表，共 {count} 个任务")
+    return Response(content=body, media_type='application/json')
+
+@app.get("/search")
+async def search_tasks(q: str = Query(..., min_length=1), page: int = Query(1, ge=1), size: int = Query(10, ge=1, le=50)):
+    # 按标题与对话内容检索已完成的节目，返回分页的命中结果、匹配片段与创建时间
+    result = await run_in_threadpool(search_index.search, q, page, size)
+    log(f"检索 {q!r} 命中 {result['total']} 个节目，耗时 {result['tookMs']} ms", logging.DEBUG)
+    return result
 
 @app.get("/audio/{taskId}/{filename}")
-async def get_audio(taskId: str, filename: str):
-    log(f"收到获取音频文件请求，任务ID: {taskId}，文件名: {filename}")
+async def get_audio(taskId: str, filename: str, request: Request, format: Optional[str] = None):
+    log(f"收到获取音频文件请求，任务ID: {taskId}，文件名: {filename}", logging.DEBUG)
+    # 先确认任务目录存在，按任务ID拼路径的函数会创建目录，不能让任意请求在 output 下建目录
+    if not await run_in_threadpool(storage.task_dir, taskId):
+        log(f"任务目录不存在，任务ID: {taskId}")
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    if filename == f"{taskId}.wav":
+        # 请求合并后的音频时，按 format 参数或 Accept 头协商返回已生成的压缩格式
+        renditions = await run_in_threadpool(delivery.list_renditions, taskId)
+        ext = delivery.negotiate(request.headers.get('accept'), renditions, format)
+        if ext:
+            log(f"协商返回压缩格式音频: {ext}", logging.DEBUG)
+            await run_in_threadpool(storage.touch, taskId)
+            return FileResponse(delivery.rendition_file(taskId, ext), media_type=delivery.FORMATS[ext]['media_type'], headers={'Vary': 'Accept'})
+        # 已归档为 flac 的音频先还原
+        await run_in_threadpool(storage.ensure_wav, taskId)
     file_path = config.get_task_file(taskId, filename)
-    if not os.path.exists(file_path):
+    if not await run_in_threadpool(os.path.exists, file_path):
         log(f"音频文件不存在，路径: {file_path}")
         raise HTTPException(status_code=404, detail="Audio file not found")
-    return FileResponse(file_path)
+    if filename != manifest.PEAKS_FILE:
+        # 记录访问时间，最近播放过的任务不会被归档或清理；播放器直接请求压缩格式时同样记录，波形数据不算播放
+        await run_in_threadpool(storage.touch, taskId)
+    return FileResponse(file_path, headers={'Vary': 'Accept'})
+
+# 页面与静态资源在启动时加载到内存并预压缩，请求时不再读取磁盘
+static_assets = StaticAssets({
+    "/": "index.html",
+    "/list.html": "list.html",
+    "/del.html": "del.html",
+})
+log(f"已加载 {static_assets.load()} 个静态资源")
 
 @app.get("/")
-async def root():
-    log("收到根路由请求，返回 index.html")
-    return FileResponse("index.html")
+async def root(request: Request):
+    return static_assets.response("/", request)
 
 @app.get("/list.html")
-async def list_html():
-    log("收到 list.html 请求，返回 list.html")
-    return FileResponse("list.html")
+async def list_html(request: Request):
+    return static_assets.response("/list.html", request)
+
+# 订阅源由任务服务器在节目完成时更新，这里只在文件变化后重新加载，轮询请求通常直接返回 304
+feed_asset = FileAsset(feed.feed_file(), 'application/rss+xml; charset=utf-8', prepare=feed.ensure_built)
+
+@app.get("/feed.xml")
+async def get_feed(request: Request):
+    await run_in_threadpool(feed_asset.refresh)
+    return feed_asset.response(request)
 
 @app.get("/resources/{file_path:path}")
-async def serve_static(file_path: str):
-    log(f"收到静态资源请求，文件路径: {file_path}")
-    static_dir = "resources"
-    full_path = os.path.join(static_dir, file_path)
-    if not os.path.exists(full_path):
-        log(f"静态资源文件不存在，路径: {full_path}")
+async def serve_static(file_path: str, request: Request):
+    response = static_assets.response(f"/resources/{file_path}", request)
+    if response is None:
+        log(f"静态资源文件不存在，路径: {file_path}")
         raise HTTPException(status_code=404, detail="静态资源文件未找到")
-    return FileResponse(full_path)
-
-from fastapi.staticfiles import StaticFiles
-# 将静态资源目录挂载到应用
-app.mount("/resources", StaticFiles(directory="resources"), name="resources")
+    return response
 
 
 app.add_middleware(
@@ -200,27 +333,38 @@ app.add_middleware(
 @app.delete("/delete_task/{taskId}")
 async def delete_task(taskId: str):
     log(f"收到删除任务请求，任务ID: {taskId}")
-    tasks = read_tasks()
-    
-    # 从任务列表中删除任务
-    tasks = [t for t in tasks if t['taskId'] != taskId]
-    write_tasks(tasks)
-    
-    # 删除任务目录
-    task_dir = config.get_task_file(taskId)
-    if os.path.exists(task_dir):
-        shutil.rmtree(task_dir)
-        log(f"已删除任务目录: {task_dir}")
-    
+    await run_in_threadpool(remove_task, taskId)
     log(f"成功删除任务，任务ID: {taskId}")
     return {"message": "任务已成功删除"}
 
+@app.post("/cancel_task/{taskId}")
+async def cancel_task(taskId: str):
+    log(f"收到取消任务请求，任务ID: {taskId}")
+    previous = await run_in_threadpool(cancel_task_in_store, taskId)
+    if previous is None:
+        log(f"未找到任务，任务ID: {taskId}")
+        raise HTTPException(status_code=404, detail="Task not found")
+    if previous in ['completed', 'failed', 'cancelled']:
+        log(f"任务已结束，无需取消，任务ID: {taskId}，状态: {previous}")
+        return {"message": "任务已结束，无需取消", "status": previous}
+    
+    log(f"成功取消任务，任务ID: {taskId}")
+    return {"message": "任务已取消", "status": "cancelled"}
+
+@app.patch("/edit_dialogue/{taskId}")
+async def edit_dialogue(taskId: str, patch: DialoguePatch):
+    log(f"收到修改对话请求，任务ID: {taskId}，修改 {len(patch.lines)} 条")
+    result = await run_in_threadpool(edit_dialogue_in_store, taskId, patch.lines)
+    if result['changedLines']:
+        log(f"对话已修改，等待重新合成，任务ID: {taskId}，修改的对话: {result['changedLines']}")
+    return result
+
 @app.get("/del.html")
-async def manage_html():
-    log("收到 del.html 请求，返回 del.html")
-    return FileResponse("del.html")
+async def manage_html(request: Request):
+    return static_assets.response("/del.html", request)
 
 if __name__ == '__main__':
     import uvicorn
     log("启动 API 服务器...")
-    uvicorn.run(app, host="0.0.0.0", port=8811)
+    # 任务列表读写带有跨进程文件锁，可以开启多个 worker
+    uvicorn.run("api:app", host="0.0.0.0", port=8811, workers=getattr(config, 'api_workers', 1))
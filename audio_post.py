@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：音频后处理，对 TTS 生成的 PCM 片段做响度归一化、首尾静音裁剪、轮次间停顿与交叉淡化，逐段流式写出合并结果；
+#           写出的同时统计波形峰值、总时长与每个片段在合并结果中的起始时间
+import json
+import os
+import wave
+import numpy as np
+
+# 默认后处理参数，可在 config.audio_post_options 中覆盖
+DEFAULT_OPTIONS = {
+    'target_loudness_db': -20,      # 目标响度（dBFS，按有声帧的平均能量计算）
+    'max_gain_db': 12,              # 单段最大增益/衰减
+    'peak_db': -1,                  # 峰值上限，防止放大后削波
+    'silence_threshold_db': -45,    # 低于该能量的帧视为静音
+    'keep_silence_ms': 80,          # 裁剪首尾静音时保留的余量
+    'pause_ms': 350,                # 不同角色之间的停顿
+    'same_speaker_pause_ms': 150,   # 同一角色连续片段之间的停顿
+    'crossfade_ms': 15,             # 交叉淡化/淡入淡出时长
+    'frame_ms': 10,                 # 能量分析帧长
+    'peaks_per_second': 20,         # 波形峰值数据每秒的点数
+}
+
+_DTYPES = {1: 'u1', 2: '<i2', 4: '<i4'}
+
+
+class UnsupportedAudio(Exception):
+    # 片段不是可直接处理的 PCM WAV，或各片段的采样参数不一致
+    pass
+
+
+def read_segment(path):
+    try:
+        with wave.open(path, 'rb') as w:
+            params = (w.getnchannels(), w.getsampwidth(), w.getframerate())
+            raw = w.readframes(w.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise UnsupportedAudio(f"{path}: {e}")
+    channels, width, _ = params
+    if width not in _DTYPES:
+        raise UnsupportedAudio(f"{path}: 不支持的采样位宽 {width * 8}bit")
+    data = np.frombuffer(raw, dtype=_DTYPES[width])
+    data = data[:len(data) - len(data) % channels]
+    if width == 1:
+        samples = (data.astype(np.float32) - 128) / 128
+    else:
+        samples = data.astype(np.float32) / float(2 ** (8 * width - 1))
+    return samples.reshape(-1, channels), params
+
+
+def to_pcm(samples, width):
+    full = float(2 ** (8 * width - 1))
+    clipped = np.clip(samples, -1.0, 1.0 - 1.0 / full)
+    if width == 1:
+        return (clipped * 128 + 128).astype(_DTYPES[width]).tobytes()
+    return (clipped * full).astype(_DTYPES[width]).tobytes()
+
+
+def ms_to_frames(ms, rate):
+    return int(rate * ms / 1000)
+
+
+def frame_levels(samples, rate, frame_ms):
+    # 按帧计算能量（dB），多声道取平均，返回 (每帧能量, 帧长)
+    size = max(1, ms_to_frames(frame_ms, rate))
+    power = np.square(samples).mean(axis=1)
+    count = -(-len(power) // size)
+    padded = np.zeros(count * size, dtype=power.dtype)
+    padded[:len(power)] = power
+    levels = 10 * np.log10(padded.reshape(count, size).mean(axis=1) + 1e-12)
+    return levels, size
+
+
+def trim_silence(samples, rate, options):
+    if not len(samples):
+        return samples
+    levels, size = frame_levels(samples, rate, options['frame_ms'])
+    active = np.flatnonzero(levels > options['silence_threshold_db'])
+    if not len(active):
+        return samples[:0]
+    keep = ms_to_frames(options['keep_silence_ms'], rate)
+    start = max(0, active[0] * size - keep)
+    end = min(len(samples), (active[-1] + 1) * size + keep)
+    return samples[start:end]
+
+
+def normalize_loudness(samples, rate, options):
+    if not len(samples):
+        return samples
+    levels, _ = frame_levels(samples, rate, options['frame_ms'])
+    active = levels[levels > options['silence_threshold_db']]
+    if not len(active):
+        return samples
+    loudness = 10 * np.log10(np.mean(np.power(10, active / 10)))
+    gain_db = np.clip(options['target_loudness_db'] - loudness, -options['max_gain_db'], options['max_gain_db'])
+    gain = 10 ** (gain_db / 20)
+    peak = float(np.abs(samples).max()) * gain
+    limit = 10 ** (options['peak_db'] / 20)
+    if peak > limit:
+        gain *= limit / peak
+    return samples * np.float32(gain)
+
+
+def fade_curve(length):
+    # 等功率淡入曲线，淡出取其反向
+    return np.sin(np.linspace(0, np.pi / 2, length, dtype=np.float32))[:, None]
+
+
+def fade_in(samples, length):
+    length = min(length, len(samples))
+    if length:
+        samples = samples.copy()
+        samples[:length] *= fade_curve(length)
+    return samples
+
+
+def fade_out(samples, length):
+    length = min(length, len(samples))
+    if length:
+        samples = samples.copy()
+        samples[-length:] *= fade_curve(length)[::-1]
+    return samples
+
+
+class Peaks:
+    """按固定采样数分桶记录写出音频的最小/最大值（8 位），格式与 audiowaveform 的 JSON 输出一致，前端可直接绘制波形"""
+
+    def __init__(self, rate, per_second):
+        self.rate = rate
+        self.bucket = max(1, rate // max(1, per_second))
+        self.data = []
+        self._pending = np.zeros(0, dtype=np.float32)
+
+    def add(self, samples):
+        # 多声道取平均，凑满整桶的部分立即计算，余下的留到下次
+        mono = np.concatenate([self._pending, samples.mean(axis=1)])
+        count = len(mono) // self.bucket
+        if count:
+            buckets = mono[:count * self.bucket].reshape(count, self.bucket)
+            pairs = np.stack([buckets.min(axis=1), buckets.max(axis=1)], axis=1)
+            self.data.extend(np.clip(np.round(pairs * 127), -128, 127).astype(int).ravel().tolist())
+        self._pending = mono[count * self.bucket:]
+
+    def to_dict(self):
+        if len(self._pending):
+            self.data.extend([int(round(float(self._pending.min()) * 127)), int(round(float(self._pending.max()) * 127))])
+            self._pending = self._pending[:0]
+        return {
+            'version': 2,
+            'channels': 1,
+            'sample_rate': self.rate,
+            'samples_per_pixel': self.bucket,
+            'bits': 8,
+            'length': len(self.data) // 2,
+            'data': self.data,
+        }
+
+
+def merge_segments(audio_files, output_file, roles=None, options=None, token=None):
+    """
+    逐段读取、处理并写出，内存中只保留当前片段和上一片段末尾用于交叉淡化的少量采样。
+    返回 {'duration': 总时长（秒）, 'starts': 每个片段的起始时间（秒，整段静音被丢弃时为 None）, 'peaks': 波形峰值}
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    # 先写临时文件，全部写完再替换，中途出错或取消不会留下被当作有效音频的不完整文件
+    temp_file = output_file + '.tmp'
+    writer = None
+    params = None
+    tail = None
+    prev_role = None
+    peaks = None
+    written = 0
+    starts = [None] * len(audio_files)
+
+    def write(samples):
+        nonlocal written
+        writer.writeframes(to_pcm(samples, params[1]))
+        peaks.add(samples)
+        written += len(samples)
+
+    try:
+        for i, path in enumerate(audio_files):
+            if token:
+                token.check()
+            samples, seg_params = read_segment(path)
+            if params is None:
+                params = seg_params
+                writer = wave.open(temp_file, 'wb')
+                writer.setnchannels(params[0])
+                writer.setsampwidth(params[1])
+                writer.setframerate(params[2])
+                peaks = Peaks(params[2], options['peaks_per_second'])
+            elif seg_params != params:
+                raise UnsupportedAudio(f"{path}: 采样参数 {seg_params} 与首个片段 {params} 不一致")
+            channels, width, rate = params
+
+            samples = trim_silence(samples, rate, options)
+            if not len(samples):
+                continue
+            samples = normalize_loudness(samples, rate, options)
+            role = roles[i] if roles else None
+            fade = ms_to_frames(options['crossfade_ms'], rate)
+
+            if tail is None:
+                pending = fade_in(samples, fade)
+            else:
+                pause = options['pause_ms'] if role != prev_role else options['same_speaker_pause_ms']
+                if pause > 0:
+                    # 有停顿时上一段淡出、当前段淡入，中间插入静音
+                    write(fade_out(tail, fade))
+                    write(np.zeros((ms_to_frames(pause, rate), channels), dtype=np.float32))
+                    pending = fade_in(samples, fade)
+                else:
+                    # 无停顿时两段首尾重叠做交叉淡化
+                    n = min(fade, len(tail), len(samples))
+                    curve = fade_curve(n)
+                    overlap = tail[len(tail) - n:] * curve[::-1] + samples[:n] * curve
+                    write(tail[:len(tail) - n])
+                    pending = np.concatenate([overlap, samples[n:]])
+
+            # 当前片段（交叉淡化时为重叠部分）从这里开始
+            starts[i] = round(written / rate, 3)
+            # 留下末尾一小段，等下一片段确定停顿或交叉淡化方式后再写出
+            keep = min(fade, len(pending))
+            write(pending[:len(pending) - keep])
+            tail = pending[len(pending) - keep:]
+            prev_role = role
+
+        if tail is not None:
+            write(fade_out(tail, len(tail)))
+    except BaseException:
+        if writer:
+            writer.close()
+            os.remove(temp_file)
+        raise
+    if writer:
+        writer.close()
+        os.replace(temp_file, output_file)
+    return {
+        'duration': round(written / params[2], 3) if params else 0,
+        'starts': starts,
+        'peaks': peaks.to_dict() if peaks else None,
+    }
+
+
+def merge_to_files(audio_files, output_file, peaks_file, roles=None, options=None):
+    """
+    供 cpu_pool 在子进程中调用：合并结果写入 output_file，波形峰值写入 peaks_file，
+    只返回时长与各片段起始时间，不跨进程传递音频或峰值数据
+    """
+    result = merge_segments(audio_files, output_file, roles, options)
+    peaks = result.pop('peaks')
+    if peaks:
+        temp = peaks_file + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(peaks, f)
+        os.replace(temp, peaks_file)
+    return result
@@ -18,6 +18,106 @@ truncate_dialogue_count = 0
 task_list_file = "task_list.json"
 # 合并音频后是否删除原始音频
 delete_original_audio = True
+# 同时执行的最大任务数，超出的任务保持等待状态，0 表示不限制
+max_concurrent_tasks = 0
+# 【可选】页面解析、音频后处理与合并使用的进程数，不配置时为 CPU 核数，0 表示在任务线程中直接执行
+cpu_pool_workers = 2
+# 看门狗检查间隔(秒)，0 表示不启用：执行中的任务超过 watchdog_heartbeat_timeout 秒没有心跳或某个阶段超过时限时中止并放回等待队列，
+# 执行线程异常退出的任务同样放回；每次放回重试次数加一并按 watchdog_retry_backoff 秒指数退避，超过 watchdog_max_retries 次后标记为失败
+watchdog_interval = 30
+watchdog_heartbeat_timeout = 600
+watchdog_retry_backoff = 60
+watchdog_max_retries = 2
+# 【可选】各阶段的时限(秒)，未配置的阶段使用 task_watchdog.DEFAULT_STAGE_DEADLINES
+watchdog_stage_deadlines = {
+    'tts': 7200,
+    'merge': 1800,
+}
+# 提交任务的准入控制：等待中的任务数上限、单个客户端（按IP）未完成的任务数上限，超出时 /post_task 返回 429 与 Retry-After，0 表示不限制
+admission_max_queue = 20
+admission_max_per_client = 5
+# 【可选】预计完成时间超过该秒数时拒绝提交，0 表示不限制
+admission_max_eta_seconds = 0
+# 【可选】api 部署在反向代理之后时按 X-Forwarded-For 区分客户端，直接对外时不要开启，否则可被伪造
+admission_trust_forwarded = False
+# 预计完成时间根据最近完成的任务耗时计算，统计文件与保留的任务数；还没有完成过任务时按 admission_default_task_seconds 估计
+stage_stats_file = "stage_stats.json"
+admission_stats_window = 50
+admission_default_task_seconds = 300
+# api.py 启动的 uvicorn worker 数，任务列表读写带跨进程文件锁，可按CPU核数调整
+api_workers = 1
+# 合并前是否对音频片段做后处理（响度归一化、首尾静音裁剪、轮次间停顿与交叉淡化），需要TTS返回PCM WAV，否则自动回退为直接拼接
+audio_post_process = True
+# 【可选】音频后处理参数，未配置的项使用 audio_post.DEFAULT_OPTIONS 中的默认值
+audio_post_options = {
+    'target_loudness_db': -20,  # 目标响度(dBFS)
+    'pause_ms': 350,  # 不同角色之间的停顿(毫秒)
+    'same_speaker_pause_ms': 150,  # 同一角色连续片段之间的停顿(毫秒)
+    'crossfade_ms': 15,  # 交叉淡化时长(毫秒)
+    'peaks_per_second': 20,  # 波形峰值数据每秒的点数(peaks.json)
+}
+# 合并音频时额外生成的压缩格式及码率（mp3/m4a/opus），用于网页播放与上传小宇宙，留空则只生成wav
+delivery_formats = {
+    'mp3': '96k',
+    'opus': '48k',
+}
+
+# 内容去重：不同URL抓取到的正文（忽略空白与标点）相同或足够相似时，直接复用已完成任务的对话和音频
+dedup_enabled = True
+# 近似重复阈值，正文 SimHash 的汉明距离（0-64），0 表示只复用完全相同的内容
+dedup_max_distance = 3
+# 已完成任务的正文指纹索引文件
+dedup_index_file = "dedup_index.json"
+# 全文检索索引文件（SQLite），首次查询时根据已完成的任务自动建立
+search_index_file = "search_index.db"
+# 播客 RSS 订阅源（/feed.xml），节目完成或删除时增量更新；修改以下频道信息后执行 python feed.py rebuild 重新生成
+feed_dir = "feed"
+# 对外访问地址，用于生成音频文件的完整地址
+feed_base_url = "http://localhost:8811"
+feed_title = "播客"
+feed_description = "由网页内容自动生成的播客节目"
+feed_author = "播客"
+# 【可选】频道封面图片地址
+feed_image = ""
+# 订阅源中保留的最近节目数
+feed_max_items = 100
+# 已结束任务的产物保留天数，超过天数后删除，0 表示永久保留（合并后的音频、对话与标题始终保留）
+storage_retention_days = {
+    'old.html': 7,  # 原始网页
+    'segments': 3,  # TTS片段音频（delete_original_audio 为 False 时保留的）
+    'status.json': 7,  # TTS合成进度
+    'tts_cache': 30,  # TTS片段缓存，删除后修改对话需要重新合成全部片段
+}
+# 超过该天数未被访问的已完成任务归档：wav 无损压缩为 flac，文本 gzip 压缩，访问时自动还原，0 表示不归档
+storage_archive_days = 30
+# output 目录总大小上限(字节)，超出时按最近访问时间从旧到新清理可再生的产物，0 表示不限制
+storage_quota_bytes = 0
+# 任务服务器中后台整理的间隔(秒)，0 表示不自动整理，可执行 python storage.py compact 手动整理
+storage_compact_interval = 3600
+# 抓取页面的总超时时间(秒)与最大字节数，超出时任务失败，避免异常页面占满内存
+fetch_timeout = 30
+fetch_max_bytes = 10 * 1024 * 1024
+
+# 性能分析：按该比例抽样分析任务（0-1），0 表示不分析，环境变量 PROFILE_SAMPLE_RATE 优先；结果写入任务目录的 profile/ 下，
+# 执行 python profiling.py summary 汇总。同一时间只分析一个任务，被抽样的任务会变慢，生产环境建议不超过 0.05；
+# 内存统计是整个进程的，有其他任务同时执行的阶段只记录占用，不做快照对比
+profile_sample_rate = 0
+# 【可选】调用栈采样间隔(秒)与 tracemalloc 记录的调用栈层数
+profile_interval = 0.01
+profile_trace_frames = 1
+
+# 日志级别：DEBUG/INFO/WARNING/ERROR，DEBUG 级别会输出 LLM 返回的原始内容等详细信息
+log_level = 'INFO'
+# 【可选】按模块单独设置日志级别，模块名为 server/server_pro/api/publisher/tts/llm/dedup/storage/search/feed/cpu_pool/admission/watchdog/profiling
+log_module_levels = {
+    'api': 'INFO',
+}
+# 日志格式：text 为普通文本，json 为每行一个JSON对象（附带 taskId/stage 字段，便于日志系统采集）
+log_format = 'text'
+# 【可选】日志额外写入的文件，为空则只输出到控制台
+log_file = None
+# 单条日志最大长度，超出部分截断，0 表示不截断
+log_max_length = 2000
 
 # 模型请求地址，这里默认配置了智谱（https://open.bigmodel.cn/）的API，可替换为OpenAI或其他供应商的API
 api_url = 'https://open.bigmodel.cn/api/paas/v4/chat/completions'
@@ -25,6 +125,18 @@ api_url = 'https://open.bigmodel.cn/api/paas/v4/chat/completions'
 api_key = 'your_api_key'
 # 模型名称
 model = 'glm-4-plus'
+# 【可选】多个 OpenAI 兼容的模型供应商，对话、标题、大纲请求按观测到的延迟与错误率选择供应商，失败时自动切换到下一个；为空时使用上面的 api_url/api_key/model
+llm_providers = [
+    # {'name': 'zhipu', 'api_url': 'https://open.bigmodel.cn/api/paas/v4/chat/completions', 'api_key': 'your_api_key', 'model': 'glm-4-plus', 'weight': 2},
+    # {'name': 'deepseek', 'api_url': 'https://api.deepseek.com/chat/completions', 'api_key': 'your_api_key', 'model': 'deepseek-chat', 'weight': 1},
+]
+# 供应商选择方式：adaptive 按延迟、错误率与权重选择，ordered 按列表顺序优先
+llm_routing = 'adaptive'
+# LLM请求超时(秒)
+llm_timeout = 300
+# 供应商连续失败多少次后熔断，熔断时长(秒)，到期后放行一个探测请求，成功则恢复
+llm_breaker_failures = 3
+llm_breaker_cooldown = 60
     
 # 【必选】获取TTS服务地址 - GET请求 - 请替换为您的TTS服务地址，例如 GPT-SoVITS、F5 TTS、其他在线TTS
 def get_tts_url(text, anchor_type):
@@ -40,10 +152,60 @@ tts_headers = {
 def get_tts_headers():
     return tts_headers
 
+# 【可选】单次TTS请求的最大字数，超长的对话按句子切分为多次请求，0 表示不切分
+tts_max_chars = 200
+# 【可选】同一角色连续的短句（少于 tts_min_chars 字）合并为一次TTS请求
+tts_coalesce_short_turns = True
+tts_min_chars = 12
+# 【可选】合成的片段按说话人与文本缓存在任务目录的 tts_cache/ 下（与片段文件硬链接，不受 delete_original_audio 影响），
+# 通过 /edit_dialogue 修改对话后只重新合成内容变化的片段；更换TTS音色后需删除 tts_cache/ 才会按新音色合成
+tts_segment_cache = True
+# 【可选】TTS请求超时(秒)与重试次数
+tts_timeout = 120
+tts_retries = 3
+# 【可选】对冲请求：请求耗时超过该后端最近延迟的 P{tts_hedge_percentile} 仍未返回时，再发出一个相同请求，先返回的结果胜出
+tts_hedge = False
+tts_hedge_percentile = 95
+# 对冲请求数最多为总请求数的比例，限制额外负载
+tts_hedge_budget = 0.1
+# 后端至少积累多少次成功请求的耗时后才开始对冲
+tts_hedge_min_samples = 20
+
+# 【可选】TTS后端池，配置后不再使用 get_tts_url，url 中的 {text} {anchor_type} 会替换为URL编码后的值
+# weight 为权重，max_concurrency 为该后端同时处理的最大请求数（0 表示不限制），health_url 默认为后端根路径
+tts_backends = [
+    # {'url': 'http://192.168.1.10:9880/tts?text={text}&language=中英混合&anchor_type={anchor_type}', 'weight': 2, 'max_concurrency': 2},
+    # {'url': 'http://192.168.1.11:9880/tts?text={text}&language=中英混合&anchor_type={anchor_type}', 'weight': 1, 'max_concurrency': 1},
+]
+# 单个任务同时发出的TTS请求数，配置多个后端时可设为各后端 max_concurrency 之和
+tts_parallel_requests = 1
+# 后端连续失败多少次后摘除，摘除时长(秒)，再次摘除时翻倍
+tts_eject_failures = 3
+tts_eject_seconds = 30
+# 主动健康检查间隔(秒)，0 表示只根据请求结果被动检查
+tts_health_check_interval = 10
+
+
+# 【server_pro】小宇宙单集管理页面地址，可替换为本地测试页 file:///.../tools/xiaoyuzhou_standin.html 验证发布流程
+xiaoyuzhou_episodes_url = 'https://podcaster.xiaoyuzhoufm.com/podcasts/66fef2c7f03810fc2f505b0d/contents-management/episodes'
+# 【server_pro】已登录小宇宙的Edge用户数据目录
+xiaoyuzhou_profile_dir = 'C:\\edge'
+# 【server_pro】常驻浏览器会话数，大于1时第i个会话使用 {xiaoyuzhou_profile_dir}-{i} 目录，需分别登录
+xiaoyuzhou_browser_count = 1
+# 【server_pro】是否以无头模式运行浏览器
+xiaoyuzhou_headless = False
+# 【server_pro】【可选】Edge驱动路径，为空时启动时自动下载一次
+xiaoyuzhou_driver_path = None
+# 【server_pro】等待后台页面加载的超时时间(秒)
+xiaoyuzhou_page_timeout = 60
+# 【server_pro】发布失败的最大尝试次数，失败后按指数退避重试
+xiaoyuzhou_publish_retries = 3
 
-# 获取任务输出的文件路径
+# 获取任务输出的文件路径，目录按任务ID前两位分片（output/ab/abcd.../），旧版本的 output/<taskId>/ 目录仍然可用，可执行 python storage.py migrate 迁移
 def get_task_file(task_id, sub_file = None):
     _dir = os.path.join("output", task_id)
+    if not os.path.isdir(_dir):
+        _dir = os.path.join("output", task_id[:2], task_id)
     os.makedirs(_dir, exist_ok=True)
     _path = os.path.join(_dir, sub_file) if sub_file else _dir
     return _path
\ No newline at end of file
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：CPU 密集型工作（页面解析、音频后处理与合并）的进程池。任务线程只传递文件路径与少量参数，
+#           结果由子进程直接写入任务目录，避免大块数据跨进程序列化；网络请求等 I/O 仍在任务线程中执行
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+import logs
+import profiling
+
+log = logs.get_log('cpu_pool')
+
+# 等待子进程结果期间检查任务是否被取消的间隔（秒）
+POLL_INTERVAL = 0.2
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def workers():
+    # cpu_pool_workers 为 0 时不启用进程池，直接在任务线程中执行
+    value = getattr(config, 'cpu_pool_workers', None)
+    if value is not None:
+        return value
+    # 容器中按实际可用的 CPU 计算
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None and workers() > 0:
+            # 任务服务器是多线程进程，fork 可能复制到其他线程持有的锁，子进程使用 spawn 启动
+            _pool = ProcessPoolExecutor(max_workers=workers(), mp_context=multiprocessing.get_context('spawn'))
+            log(f"CPU 进程池已启动，进程数 {workers()}")
+        return _pool
+
+
+def _reset(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def staged(path):
+    # 子进程写入的临时路径，run 在调用成功返回后才改名为 path
+    return path + '.part'
+
+
+def _publish(outputs):
+    # 子进程不一定写出全部文件（例如没有波形峰值），只改名已生成的
+    for path in outputs:
+        if os.path.exists(staged(path)):
+            os.replace(staged(path), path)
+
+
+def _discard(outputs):
+    for path in outputs:
+        try:
+            os.remove(staged(path))
+        except FileNotFoundError:
+            pass
+
+
+def run(func, *args, token=None, outputs=(), **kwargs):
+    """
+    在进程池中执行模块级函数 func 并返回结果，参数与返回值需可序列化（文件路径、数字等）。
+    outputs 为 func 写出的正式文件路径，调用方传给 func 的是对应的 staged(path)，成功返回后才改名为正式文件。
+    等待期间任务被取消时不再等待结果并抛出 TaskCancelled；正在执行的子进程无法中断，会继续完成当前调用，
+    结束后删除它写出的临时文件，正式文件保持取消前的内容
+    """
+    if token:
+        token.check()
+    pool = get_pool()
+    if pool is None:
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            _discard(outputs)
+            raise
+        _publish(outputs)
+        return result
+    profiler = profiling.current()
+    if profiler:
+        # 被抽样分析的任务在子进程中用 cProfile 执行，结果写入任务的分析目录
+        future = pool.submit(profiling.profiled_call, profiler.cpu_profile_path(func), func, *args, **kwargs)
+    else:
+        future = pool.submit(func, *args, **kwargs)
+    try:
+        while True:
+            try:
+                result = future.result(timeout=POLL_INTERVAL)
+            except TimeoutError:
+                if token and token.is_cancelled():
+                    if not future.cancel():
+                        future.add_done_callback(lambda f: _discard(outputs))
+                    token.check()
+                continue
+            _publish(outputs)
+            return result
+    except BrokenProcessPool:
+        # 子进程异常退出（例如内存不足被杀掉）后进程池不可再用，下次调用时重新创建
+        log(f"CPU 进程池异常，已重建: {getattr(func, '__name__', func)}", logging.ERROR)
+        _discard(outputs)
+        _reset(pool)
+        raise
+    except Exception:
+        _discard(outputs)
+        raise
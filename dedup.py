@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：内容去重，不同URL抓取到的正文归一化后完全相同或足够相似（SimHash）时，直接复用已完成任务的对话和音频
+import hashlib
+import json
+import os
+import re
+import shutil
+import unicodedata
+from collections import Counter
+from datetime import datetime
+
+import config
+import logs
+import segment_cache
+import storage
+import task_store
+
+log = logs.get_log('dedup')
+
+# 只保留文字和数字，忽略空白、标点等排版差异
+NON_WORD = re.compile(r'[\W_]+')
+SHINGLE_SIZE = 3
+# 新任务自己的抓取结果，不从已有任务复制
+OWN_FILES = {'content.txt', 'content.txt.gz', 'old.html', 'status.json', 'manifest.json'}
+
+
+class DuplicateContent(Exception):
+    # 内容与已完成的任务重复，产物已复用
+    def __init__(self, source_id, distance):
+        super().__init__(source_id)
+        self.source_id = source_id
+        self.distance = distance
+
+
+def normalize(text):
+    return NON_WORD.sub('', unicodedata.normalize('NFKC', text).lower())
+
+
+def content_hash(normalized):
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def simhash(normalized):
+    # 基于字符 n-gram 的 64 位 SimHash，中文无需分词
+    shingles = Counter(normalized[i:i + SHINGLE_SIZE] for i in range(max(1, len(normalized) - SHINGLE_SIZE + 1)))
+    weights = [0] * 64
+    for shingle, count in shingles.items():
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def index_file():
+    return getattr(config, 'dedup_index_file', 'dedup_index.json')
+
+
+def read_index():
+    try:
+        with open(index_file(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def fingerprint(text):
+    normalized = normalize(text)
+    return {'hash': content_hash(normalized), 'simhash': f"{simhash(normalized):016x}", 'length': len(normalized)}
+
+
+def is_available(task_id):
+    # 被匹配的任务必须仍然存在、已完成且音频文件还在
+    task = task_store.get_task(task_id)
+    if not task or task.get('status') != 'completed':
+        return False
+    return storage.has_audio(task_id)
+
+
+def find_duplicate(text, task_id):
+    # 返回 (已完成的任务ID, 汉明距离)，没有匹配时返回 (None, None)
+    max_distance = getattr(config, 'dedup_max_distance', 3)
+    current = fingerprint(text)
+    current_simhash = int(current['simhash'], 16)
+    candidates = []
+    for entry in read_index():
+        if entry['taskId'] == task_id:
+            continue
+        if entry['hash'] == current['hash']:
+            candidates.append((0, entry['taskId']))
+        elif max_distance > 0 and 0.8 <= entry['length'] / max(1, current['length']) <= 1.25:
+            distance = hamming(current_simhash, int(entry['simhash'], 16))
+            if distance <= max_distance:
+                candidates.append((distance, entry['taskId']))
+    for distance, source_id in sorted(candidates):
+        if is_available(source_id):
+            return source_id, distance
+    return None, None
+
+
+def register(task_id, text):
+    # 任务完成后登记到去重索引，同一任务重复登记时覆盖
+    entry = {'taskId': task_id, **fingerprint(text), 'createdAt': datetime.now().isoformat()}
+    with task_store.file_lock(index_file()):
+        entries = [e for e in read_index() if e['taskId'] != task_id]
+        entries.append(entry)
+        task_store.atomic_write_json(index_file(), entries, indent=4)
+
+
+def unregister(task_id):
+    with task_store.file_lock(index_file()):
+        entries = read_index()
+        remaining = [e for e in entries if e['taskId'] != task_id]
+        if len(remaining) != len(entries):
+            task_store.atomic_write_json(index_file(), remaining, indent=4)
+
+
+def link_artifacts(source_id, task_id):
+    # 复用已有任务的对话、标题和音频；以任务ID命名的文件改为新任务ID，能硬链接时不额外占用磁盘
+    source_dir = config.get_task_file(source_id)
+    for name in os.listdir(source_dir):
+        if name in OWN_FILES or name.startswith('.'):
+            continue
+        source = os.path.join(source_dir, name)
+        if not os.path.isfile(source):
+            continue
+        target_name = task_id + name[len(source_id):] if name.startswith(f"{source_id}.") else name
+        target = config.get_task_file(task_id, target_name)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+    segment_cache.link_all(source_id, task_id)
+    log(f"已复用任务 {source_id} 的对话与音频", sourceTaskId=source_id)
+
+
+def detach(paths):
+    # 复用的产物与被复用的任务共享同一个文件，原地重写前先删除本任务的链接，避免改动另一个任务的文件
+    for path in paths:
+        try:
+            if os.stat(path).st_nlink > 1:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def check(text, task_id):
+    # 在抓取完成后调用，内容重复时复用产物并抛出 DuplicateContent
+    if not getattr(config, 'dedup_enabled', True):
+        return
+    source_id, distance = find_duplicate(text, task_id)
+    if source_id is None:
+        return
+    log(f"内容与已完成的任务 {source_id} 重复（SimHash 距离 {distance}），跳过生成", sourceTaskId=source_id)
+    link_artifacts(source_id, task_id)
+    raise DuplicateContent(source_id, distance)
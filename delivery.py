@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：音频交付格式，合并时一次性转码生成压缩格式，并供 api 按请求协商返回
+import os
+import time
+import ffmpeg
+
+import config
+
+# 支持的压缩格式：文件扩展名 -> 编码器与媒体类型
+# 输出先写入 .tmp 临时文件，无法按扩展名判断格式，需指定 ffmpeg 的封装格式
+FORMATS = {
+    'mp3': {'codec': 'libmp3lame', 'media_type': 'audio/mpeg', 'format': 'mp3'},
+    'm4a': {'codec': 'aac', 'media_type': 'audio/mp4', 'format': 'ipod'},
+    'opus': {'codec': 'libopus', 'media_type': 'audio/ogg', 'format': 'ogg'},
+}
+WAV_MEDIA_TYPES = ['audio/wav', 'audio/x-wav', 'audio/wave']
+
+
+def get_delivery_formats():
+    # 配置的压缩格式及码率，忽略不支持的格式
+    formats = getattr(config, 'delivery_formats', None) or {}
+    return {ext: bitrate for ext, bitrate in formats.items() if ext in FORMATS}
+
+
+def temp_file(path):
+    return path + '.tmp'
+
+
+def rendition_files(task_id):
+    return [rendition_file(task_id, ext) for ext in get_delivery_formats()]
+
+
+def rendition_outputs(stream, task_id):
+    # 基于同一个输入流生成各压缩格式的输出节点，与 wav 输出合并到同一条 ffmpeg 命令中，只解码一次
+    outputs = []
+    for ext, bitrate in get_delivery_formats().items():
+        output_file = temp_file(rendition_file(task_id, ext))
+        outputs.append(stream.output(output_file, format=FORMATS[ext]['format'], acodec=FORMATS[ext]['codec'],
+                                     audio_bitrate=bitrate, vn=None))
+    return outputs
+
+
+def run_ffmpeg(stream_spec, token=None, files=()):
+    """
+    files 为输出的正式文件，ffmpeg 写入各自的临时文件（temp_file），成功后再替换；
+    失败或取消时删除临时文件，不会留下不完整的正式文件
+    """
+    try:
+        process = stream_spec.overwrite_output().run_async()
+        # 等待 ffmpeg 完成，期间任务被取消则直接结束进程
+        while process.poll() is None:
+            if token and token.is_cancelled():
+                process.kill()
+                process.wait()
+                token.check()
+            time.sleep(0.2)
+        if process.returncode != 0:
+            raise ffmpeg.Error('ffmpeg', None, None)
+    except BaseException:
+        for path in files:
+            if os.path.exists(temp_file(path)):
+                os.remove(temp_file(path))
+        raise
+    for path in files:
+        os.replace(temp_file(path), path)
+
+
+def encode_renditions(wav_file, task_id, token=None):
+    # 由已合并的 wav 一次性转码出所有配置的压缩格式
+    outputs = rendition_outputs(ffmpeg.input(wav_file).audio, task_id)
+    if outputs:
+        run_ffmpeg(ffmpeg.merge_outputs(*outputs), token, rendition_files(task_id))
+    return len(outputs)
+
+
+def rendition_file(task_id, ext):
+    return config.get_task_file(task_id, f"{task_id}.{ext}")
+
+
+def list_renditions(task_id):
+    # 已生成的压缩格式及其访问地址
+    return {
+        ext: f"/audio/{task_id}/{task_id}.{ext}"
+        for ext in FORMATS
+        if os.path.exists(rendition_file(task_id, ext))
+    }
+
+
+def preferred_upload_file(task_id, exts=('mp3', 'm4a')):
+    # 上传平台时优先使用体积更小的压缩格式，都不存在时使用 wav
+    for ext in exts:
+        path = rendition_file(task_id, ext)
+        if os.path.exists(path):
+            return path
+    return config.get_task_file(task_id, f"{task_id}.wav")
+
+
+def parse_accept(accept):
+    # 解析 Accept 头，返回 [(媒体类型, q值)]
+    result = []
+    for part in (accept or '').split(','):
+        fields = [f.strip() for f in part.split(';')]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for field in fields[1:]:
+            if field.startswith('q='):
+                try:
+                    q = float(field[2:])
+                except ValueError:
+                    q = 0.0
+        result.append((fields[0].lower(), q))
+    return result
+
+
+def negotiate(accept, available, fmt=None):
+    """
+    根据 format 参数或 Accept 头在已生成的压缩格式中选择返回格式，返回扩展名，None 表示返回原始 wav。
+    只有明确列出的媒体类型才会切换格式，*/* 等通配仍返回原文件，保证下载 wav 的行为不变
+    """
+    if fmt:
+        return fmt if fmt in available else None
+    best, best_q = None, 0.0
+    for media_type, q in parse_accept(accept):
+        if q <= best_q:
+            continue
+        if media_type in WAV_MEDIA_TYPES:
+            best, best_q = None, q
+            continue
+        ext = next((e for e in available if FORMATS[e]['media_type'] == media_type), None)
+        if ext:
+            best, best_q = ext, q
+    return best
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：播客 RSS 订阅源。每个节目完成时只生成一次它的 <item> 片段，与频道信息拼成 feed.xml 落盘；
+#           删除任务时移除对应片段。api 直接返回落盘的文件，订阅客户端轮询时通过 ETag/Last-Modified 协商
+import argparse
+import json
+import logging
+import os
+from datetime import datetime
+from email.utils import format_datetime
+from xml.sax.saxutils import escape, quoteattr
+
+import config
+import delivery
+import logs
+import manifest
+import storage
+import task_store
+
+log = logs.get_log('feed')
+
+ITUNES_NS = 'http://www.itunes.com/dtds/podcast-1.0.dtd'
+# 节目简介取对话开头的字数
+SUMMARY_CHARS = 300
+
+
+def feed_dir():
+    return getattr(config, 'feed_dir', 'feed')
+
+
+def feed_file():
+    return os.path.join(feed_dir(), 'feed.xml')
+
+
+def items_file():
+    return os.path.join(feed_dir(), 'items.json')
+
+
+def base_url():
+    return getattr(config, 'feed_base_url', 'http://localhost:8811').rstrip('/')
+
+
+def rfc2822(value):
+    return format_datetime(datetime.fromisoformat(value).astimezone())
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def enclosure(task_id, artifacts):
+    # 优先使用体积小的压缩格式，地址直接指向该文件，length 与实际返回的内容一致；
+    # 压缩格式被存储整理删除后 refresh_episode 会改为指向 wav
+    for ext in ('mp3', 'm4a', 'opus'):
+        name = f"{task_id}.{ext}"
+        if name in artifacts:
+            return f"/audio/{task_id}/{name}", artifacts[name]['size'], delivery.FORMATS[ext]['media_type']
+    name = manifest.merged_audio(task_id, artifacts)
+    if name:
+        # 已归档为 flac 时请求 wav 会先还原，length 只能取 flac 的大小
+        return f"/audio/{task_id}/{task_id}.wav", artifacts[name]['size'], 'audio/wav'
+    return None
+
+
+def render_item(task, published):
+    # 生成单个节目的 <item>，没有合并音频时返回 None
+    task_id = task['taskId']
+    data = manifest.read(task_id)
+    artifacts = data.get('artifacts') or {}
+    audio = enclosure(task_id, artifacts)
+    if audio is None:
+        return None
+    url, length, media_type = audio
+    title = data.get('title') or task.get('url') or task_id
+    summary = ''.join(item.get('content', '') for item in data.get('dialogue') or [] if isinstance(item, dict))
+    if len(summary) > SUMMARY_CHARS:
+        summary = summary[:SUMMARY_CHARS] + '…'
+    parts = [
+        '<item>',
+        f'<title>{escape(title)}</title>',
+        f'<guid isPermaLink="false">{escape(task_id)}</guid>',
+        f'<pubDate>{rfc2822(published)}</pubDate>',
+        f'<enclosure url={quoteattr(base_url() + url)} length="{length}" type="{media_type}"/>',
+    ]
+    if task.get('url'):
+        parts.append(f'<link>{escape(task["url"])}</link>')
+    if summary:
+        parts.append(f'<description>{escape(summary)}</description>')
+    if data.get('duration'):
+        parts.append(f'<itunes:duration>{format_duration(data["duration"])}</itunes:duration>')
+    parts.append('</item>')
+    return ''.join(parts)
+
+
+def render_channel(items):
+    title = getattr(config, 'feed_title', '播客')
+    description = getattr(config, 'feed_description', title)
+    link = getattr(config, 'feed_link', base_url() + '/list.html')
+    head = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<rss version="2.0" xmlns:itunes="{ITUNES_NS}">',
+        '<channel>',
+        f'<title>{escape(title)}</title>',
+        f'<link>{escape(link)}</link>',
+        f'<description>{escape(description)}</description>',
+        f'<language>{escape(getattr(config, "feed_language", "zh-cn"))}</language>',
+        f'<itunes:author>{escape(getattr(config, "feed_author", title))}</itunes:author>',
+    ]
+    if getattr(config, 'feed_image', None):
+        head.append(f'<itunes:image href={quoteattr(config.feed_image)}/>')
+    if items:
+        head.append(f'<lastBuildDate>{rfc2822(items[0]["published"])}</lastBuildDate>')
+    return '\n'.join(head + [item['xml'] for item in items] + ['</channel>', '</rss>', ''])
+
+
+def read_items():
+    try:
+        with open(items_file(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'built': False, 'items': []}
+
+
+def write(index):
+    # 调用方持有 items.json 的文件锁；先写片段索引，再用已生成的片段拼出 feed.xml
+    index['items'].sort(key=lambda item: item['published'], reverse=True)
+    del index['items'][getattr(config, 'feed_max_items', 100):]
+    task_store.atomic_write_json(items_file(), index, ensure_ascii=False)
+    temp = feed_file() + '.tmp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        f.write(render_channel(index['items']))
+    os.replace(temp, feed_file())
+
+
+def add_episode(task, published=None):
+    # 任务完成时调用，同一任务重复加入时（修改对话后重新合成）覆盖并保留原发布时间；失败只记录日志，不影响任务状态
+    try:
+        os.makedirs(feed_dir(), exist_ok=True)
+        with task_store.file_lock(items_file()):
+            index = read_items()
+            previous = next((item for item in index['items'] if item['taskId'] == task['taskId']), None)
+            published = published or (previous and previous['published']) or datetime.now().isoformat()
+            xml = render_item(task, published)
+            if xml is None:
+                return
+            index['items'] = [item for item in index['items'] if item['taskId'] != task['taskId']]
+            index['items'].append({'taskId': task['taskId'], 'published': published, 'xml': xml})
+            write(index)
+    except OSError as e:
+        log(f"任务 {task['taskId']} 加入订阅源失败: {str(e)}", logging.ERROR, taskId=task['taskId'])
+
+
+def remove_episode(task_id):
+    if not os.path.exists(items_file()):
+        return
+    with task_store.file_lock(items_file()):
+        index = read_items()
+        items = [item for item in index['items'] if item['taskId'] != task_id]
+        if len(items) != len(index['items']):
+            index['items'] = items
+            write(index)
+
+
+def refresh_episode(task_id):
+    # 产物变化后（例如存储整理删除了压缩格式）重新生成已在订阅源中的节目，保留原发布时间
+    if not os.path.exists(items_file()):
+        return
+    with task_store.file_lock(items_file()):
+        index = read_items()
+        item = next((item for item in index['items'] if item['taskId'] == task_id), None)
+        if item is None:
+            return
+        task = task_store.get_task(task_id) or {'taskId': task_id}
+        xml = render_item(task, item['published'])
+        if xml == item['xml']:
+            return
+        if xml is None:
+            index['items'].remove(item)
+        else:
+            item['xml'] = xml
+        write(index)
+
+
+def rebuild():
+    # 根据已完成的任务重新生成全部片段，首次启用或修改了频道配置后执行
+    os.makedirs(feed_dir(), exist_ok=True)
+    items = []
+    for task in task_store.read_tasks():
+        if task.get('status') != 'completed' or not storage.has_audio(task['taskId']):
+            continue
+        published = task.get('updatedAt') or task.get('createdAt')
+        xml = render_item(task, published)
+        if xml:
+            items.append({'taskId': task['taskId'], 'published': published, 'xml': xml})
+    with task_store.file_lock(items_file()):
+        write({'built': True, 'items': items})
+    log(f"订阅源重建完成，共 {len(items)} 个节目")
+    return len(items)
+
+
+def ensure_built():
+    # 订阅源从未根据已有任务生成过时先重建一次
+    if not read_items().get('built'):
+        rebuild()
+    return feed_file()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='播客 RSS 订阅源')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='根据已完成的任务重新生成订阅源')
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        rebuild()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：LLM 请求客户端，支持多个 OpenAI 兼容的供应商，按观测到的延迟与错误率选择，带熔断器，单次调用失败时自动切换到下一个供应商
+import logging
+import threading
+import time
+
+import requests
+
+import config
+import logs
+from task_control import http_request
+
+log = logs.get_log('llm')
+
+
+class LLMError(Exception):
+    # 所有供应商均请求失败
+    pass
+
+
+class Provider:
+    """单个供应商及其统计：延迟与错误率为指数加权移动平均，连续失败达到阈值后熔断一段时间"""
+
+    def __init__(self, name, api_url, api_key, model, weight=1, timeout=300):
+        self.name = name
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.weight = max(weight, 0.01)
+        self.timeout = timeout
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.open_until = 0
+        self.probing = False
+
+    def update(self, ok, seconds, alpha):
+        if ok:
+            self.latency = seconds if self.latency is None else alpha * seconds + (1 - alpha) * self.latency
+        self.error_rate = alpha * (0 if ok else 1) + (1 - alpha) * self.error_rate
+
+    def score(self):
+        # 越小越优先：没有延迟数据的供应商优先尝试一次
+        if self.latency is None:
+            return 0
+        return self.latency * (1 + 4 * self.error_rate) / self.weight
+
+
+class LLMClient:
+    def __init__(self, providers, routing='adaptive', breaker_failures=3, breaker_cooldown=60, alpha=0.3):
+        self.providers = providers
+        self.routing = routing
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def _candidates(self):
+        # 熔断中的供应商排除在外；冷却到期后只放行一个探测请求（半开状态）
+        # 返回 (候选列表, 本次标记为探测中的供应商)
+        now = time.time()
+        with self._lock:
+            available = []
+            probes = []
+            for provider in self.providers:
+                if provider.open_until == 0:
+                    available.append(provider)
+                elif now >= provider.open_until and not provider.probing:
+                    provider.probing = True
+                    available.append(provider)
+                    probes.append(provider)
+            if self.routing != 'ordered':
+                available.sort(key=Provider.score)
+            if not available:
+                # 全部熔断时仍然按恢复时间顺序尝试，避免整体不可用
+                available = sorted(self.providers, key=lambda p: p.open_until)
+        return available, probes
+
+    def _record(self, provider, ok, seconds):
+        with self._lock:
+            provider.update(ok, seconds, self.alpha)
+            provider.probing = False
+            if ok:
+                if provider.open_until:
+                    log(f"LLM供应商 {provider.name} 恢复，关闭熔断", provider=provider.name)
+                provider.failures = 0
+                provider.open_until = 0
+                return
+            provider.failures += 1
+            if provider.open_until or provider.failures >= self.breaker_failures:
+                provider.open_until = time.time() + self.breaker_cooldown
+                log(f"LLM供应商 {provider.name} 连续失败 {provider.failures} 次，熔断 {self.breaker_cooldown} 秒",
+                    logging.WARNING, provider=provider.name)
+
+    def _request(self, provider, messages, token):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {provider.api_key}'
+        }
+        data = {
+            'model': provider.model,
+            'messages': messages
+        }
+        response = http_request('POST', provider.api_url, token, headers=headers, json=data, timeout=provider.timeout)
+        if response.status_code != 200:
+            raise LLMError(f"状态码: {response.status_code}")
+        result = response.json()
+        if not ('choices' in result and len(result['choices']) > 0):
+            raise LLMError('API返回的数据格式不正确')
+        return result['choices'][0]['message']['content'] or ""
+
+    def chat(self, messages, token=None):
+        # 按优先级依次尝试各供应商，返回第一个成功的回复内容
+        errors = []
+        candidates, probes = self._candidates()
+        try:
+            for provider in candidates:
+                start = time.time()
+                try:
+                    content = self._request(provider, messages, token)
+                except (requests.RequestException, ValueError, LLMError) as e:
+                    self._record(provider, False, time.time() - start)
+                    log(f"LLM供应商 {provider.name} 请求失败: {str(e)}", logging.WARNING, provider=provider.name)
+                    errors.append(f"{provider.name}: {str(e)}")
+                    continue
+                seconds = time.time() - start
+                self._record(provider, True, seconds)
+                log(f"LLM供应商 {provider.name} 请求成功，耗时 {seconds:.1f}s", provider=provider.name)
+                return content
+        finally:
+            # 未轮到或被取消的探测名额释放给后续调用；任务取消不计入供应商的错误率
+            with self._lock:
+                for provider in probes:
+                    provider.probing = False
+        raise LLMError('所有LLM供应商均请求失败: ' + '; '.join(errors))
+
+    def stats(self):
+        with self._lock:
+            return [{
+                'name': p.name,
+                'latency': round(p.latency, 3) if p.latency is not None else None,
+                'errorRate': round(p.error_rate, 3),
+                'open': p.open_until > time.time(),
+            } for p in self.providers]
+
+
+def create_client():
+    timeout = getattr(config, 'llm_timeout', 300)
+    providers = [Provider(
+        name=item.get('name') or item['api_url'],
+        api_url=item['api_url'],
+        api_key=item.get('api_key', ''),
+        model=item['model'],
+        weight=item.get('weight', 1),
+        timeout=item.get('timeout', timeout),
+    ) for item in getattr(config, 'llm_providers', None) or []]
+    if not providers:
+        # 未配置供应商列表时使用 api_url/api_key/model
+        providers = [Provider('default', config.api_url, config.api_key, config.model, timeout=timeout)]
+    return LLMClient(
+        providers,
+        routing=getattr(config, 'llm_routing', 'adaptive'),
+        breaker_failures=getattr(config, 'llm_breaker_failures', 3),
+        breaker_cooldown=getattr(config, 'llm_breaker_cooldown', 60),
+    )
+
+
+client = create_client()
+
+
+def chat(messages, token=None):
+    return client.chat(messages, token)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：日志配置，基于队列的非阻塞输出，支持级别、按模块过滤、JSON 格式（附带 taskId/stage 字段）以及超长内容截断
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime
+
+import config
+
+# 当前线程（任务）的日志上下文，例如 taskId、stage
+_context = contextvars.ContextVar('log_context', default={})
+_listener = None
+
+
+def set_context(**fields):
+    context = dict(_context.get())
+    context.update({k: v for k, v in fields.items() if v is not None})
+    _context.set(context)
+
+
+def clear_context():
+    _context.set({})
+
+
+def get_context():
+    return dict(_context.get())
+
+
+class ContextFilter(logging.Filter):
+    # 在调用线程中把上下文挂到日志记录上，之后才进入队列由后台线程输出
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+
+class TruncateFilter(logging.Filter):
+    # 截断超长日志内容（例如 LLM 返回的原始内容），避免大量输出拖慢主流程
+    def __init__(self, max_length):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record):
+        if self.max_length > 0:
+            message = record.getMessage()
+            if len(message) > self.max_length:
+                record.msg = f"{message[:self.max_length]}...（已截断，共 {len(message)} 字符）"
+                record.args = None
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # 队列已满时直接丢弃日志，绝不阻塞业务线程
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'module': record.name.split('.', 1)[-1],
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'context', {}))
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = {**getattr(record, 'context', {}), **getattr(record, 'fields', {})}
+        prefix = ''.join(f"[{k}={v}] " for k, v in fields.items())
+        line = f"[{datetime.fromtimestamp(record.created).isoformat()}] [{record.name.split('.', 1)[-1]}] [{record.levelname}] {prefix}{record.getMessage()}"
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+    formatter = JsonFormatter() if getattr(config, 'log_format', 'text') == 'json' else TextFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    log_file = getattr(config, 'log_file', None)
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=50 * 1024 * 1024, backupCount=5, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(getattr(config, 'log_queue_size', 10000))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(TruncateFilter(getattr(config, 'log_max_length', 2000)))
+
+    root = logging.getLogger('podlm')
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(config, 'log_level', 'INFO'))
+    root.propagate = False
+    # 按模块单独设置级别，例如 {'api': 'WARNING'}
+    for name, level in (getattr(config, 'log_module_levels', None) or {}).items():
+        logging.getLogger(f"podlm.{name}").setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+    # 退出前把队列中剩余的日志输出完
+    atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(f"podlm.{name}")
+
+
+def get_log(name):
+    """
+    返回模块使用的 log(message, level=logging.INFO, **fields)：
+    日志经队列异步输出，fields 会作为结构化字段附加到日志中
+    """
+    logger = get_logger(name)
+
+    def log(message, level=logging.INFO, **fields):
+        logger.log(level, message, extra={'fields': fields})
+    return log
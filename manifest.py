@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：任务清单 manifest.json，汇总标题、对话、合成进度、章节时间与产物（大小、时长、校验和）；
+#           任务服务器原子写入且限制进度写入频率，api 按文件 mtime 校验缓存，查询任务状态只需一次 stat
+import hashlib
+import json
+import os
+import threading
+import time
+import wave
+from datetime import datetime
+
+import config
+import delivery
+import storage
+import task_store
+
+MANIFEST_FILE = 'manifest.json'
+# 合并时生成的波形峰值数据
+PEAKS_FILE = 'peaks.json'
+# 引入 manifest 之前的任务文件，新任务不再写入，只在读取旧任务时使用
+LEGACY_FILES = ('title.txt', 'dialogue.json', 'status.json')
+VERSION = 1
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def wav_duration(path):
+    # 只读取 wav 头，非 PCM wav 返回 None
+    try:
+        with wave.open(path, 'rb') as f:
+            return round(f.getnframes() / f.getframerate(), 3)
+    except (wave.Error, EOFError, OSError):
+        return None
+
+
+def audio_names(task_id):
+    # 合并后的音频（wav 或归档后的 flac）以及各压缩格式
+    return [f"{task_id}.wav", f"{task_id}.flac"] + [f"{task_id}.{ext}" for ext in delivery.FORMATS]
+
+
+def tracked_names(task_id):
+    return audio_names(task_id) + [PEAKS_FILE]
+
+
+def collect_artifacts(task_id, previous=None, checksums=True):
+    # 大小与修改时间都没变的产物沿用之前的记录，不重复计算校验和
+    previous = previous or {}
+    artifacts = {}
+    for name in tracked_names(task_id):
+        path = config.get_task_file(task_id, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        old = previous.get(name)
+        if (old and old.get('size') == stat.st_size and old.get('mtime') == stat.st_mtime
+                and (old.get('sha256') or not checksums)):
+            artifacts[name] = old
+            continue
+        artifacts[name] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': sha256_file(path) if checksums else None,
+            'duration': wav_duration(path) if name.endswith('.wav') else None,
+        }
+    return artifacts
+
+
+def merged_audio(task_id, artifacts):
+    for name in (f"{task_id}.wav", f"{task_id}.flac"):
+        if name in artifacts:
+            return name
+    return None
+
+
+def legacy_key(task_directory, task_id):
+    # build_legacy 读取的各文件（含归档的 .gz）的修改时间与大小，都没变化时拼出的结果相同
+    key = []
+    for name in LEGACY_FILES + tuple(f"{name}.gz" for name in LEGACY_FILES) + tuple(tracked_names(task_id)):
+        try:
+            stat = os.stat(os.path.join(task_directory, name))
+        except FileNotFoundError:
+            continue
+        key.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(key)
+
+
+def empty(task_id):
+    # 还没有任务目录（排队中）的任务
+    return {'version': VERSION, 'taskId': task_id, 'title': None, 'dialogue': None, 'progress': None,
+            'artifacts': {}, 'duration': None, 'updatedAt': datetime.now().isoformat()}
+
+
+def build_legacy(task_id, checksums=False):
+    # 没有 manifest.json 的旧任务：从 title.txt、dialogue.json、status.json 与音频文件拼出相同结构
+    title = storage.read_text(config.get_task_file(task_id, 'title.txt'))
+    dialogue = storage.read_text(config.get_task_file(task_id, 'dialogue.json'))
+    progress = storage.read_text(config.get_task_file(task_id, 'status.json'))
+    artifacts = collect_artifacts(task_id, checksums=checksums)
+    duration = next((a['duration'] for a in artifacts.values() if a.get('duration')), None)
+    return {
+        'version': VERSION,
+        'taskId': task_id,
+        'title': title.strip() if title is not None else None,
+        'dialogue': json.loads(dialogue) if dialogue else None,
+        'progress': json.loads(progress) if progress else None,
+        'artifacts': artifacts,
+        'duration': duration,
+        'updatedAt': datetime.now().isoformat(),
+    }
+
+
+def read(task_id):
+    # 不经过缓存直接读取，没有 manifest.json 的旧任务从原有文件拼出
+    try:
+        with open(config.get_task_file(task_id, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return build_legacy(task_id)
+
+
+class ManifestWriter:
+    """任务服务器中单个任务的 manifest，各阶段线程共享，修改后整体原子写入"""
+
+    def __init__(self, task_id, progress_interval=1.0):
+        self.task_id = task_id
+        self.path = config.get_task_file(task_id, MANIFEST_FILE)
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._last_progress = 0
+        self._progress_dirty = False
+        self.data = read(task_id)
+
+    def _save(self):
+        self.data['updatedAt'] = datetime.now().isoformat()
+        task_store.atomic_write_json(self.path, self.data, ensure_ascii=False)
+
+    def update(self, **fields):
+        with self._lock:
+            self.data.update(fields)
+            self._progress_dirty = False
+            self._save()
+
+    def set_progress(self, progress, force=False):
+        # 进度变化频繁，最多每 progress_interval 秒写一次文件
+        with self._lock:
+            self.data['progress'] = progress
+            now = time.time()
+            if not force and now - self._last_progress < self.progress_interval:
+                self._progress_dirty = True
+                return
+            self._last_progress = now
+            self._progress_dirty = False
+            self._save()
+
+    def flush(self):
+        with self._lock:
+            if self._progress_dirty:
+                self._progress_dirty = False
+                self._save()
+
+    def refresh_artifacts(self, checksums=True):
+        # 合并音频、归档、清理后重新统计产物
+        with self._lock:
+            artifacts = collect_artifacts(self.task_id, self.data.get('artifacts'), checksums)
+            self.data['artifacts'] = artifacts
+            self.data['duration'] = next((a['duration'] for a in artifacts.values() if a.get('duration')),
+                                         self.data.get('duration'))
+            self._save()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def writer(task_id):
+    # 同一任务的各阶段共用一个 writer
+    with _writers_lock:
+        if task_id not in _writers:
+            _writers[task_id] = ManifestWriter(task_id)
+        return _writers[task_id]
+
+
+def close(task_id):
+    with _writers_lock:
+        manifest = _writers.pop(task_id, None)
+    if manifest and os.path.isdir(os.path.dirname(manifest.path)):
+        manifest.flush()
+
+
+def refresh_artifacts(task_id):
+    # 不在执行中的任务（例如被存储整理归档后）更新产物记录，没有 manifest 的旧任务不处理
+    path = config.get_task_file(task_id, MANIFEST_FILE)
+    if os.path.exists(path):
+        ManifestWriter(task_id).refresh_artifacts()
+
+
+class ManifestCache:
+    """api 进程内的 manifest 缓存，文件 mtime 与大小不变时直接返回缓存内容"""
+
+    def __init__(self):
+        self._entries = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def _path(self, task_id):
+        # 任务目录存在后才记录 manifest 路径，查询排队中的任务不创建目录
+        path = self._paths.get(task_id)
+        if path is None:
+            task_directory = storage.task_dir(task_id)
+            if task_directory is None:
+                return None
+            path = os.path.join(task_directory, MANIFEST_FILE)
+            self._paths[task_id] = path
+        return path
+
+    def _cached(self, task_id, key, load):
+        with self._lock:
+            cached = self._entries.get(task_id)
+        if cached and cached[0] == key:
+            return cached[1]
+        data = load()
+        with self._lock:
+            self._entries[task_id] = (key, data)
+        return data
+
+    def _legacy(self, task_id, path):
+        # 旧任务每次查询都拼一遍要读取多个文件，这些文件都没变化时沿用上次的结果
+        key = ('legacy',) + legacy_key(os.path.dirname(path), task_id)
+        return self._cached(task_id, key, lambda: build_legacy(task_id))
+
+    def get(self, task_id):
+        path = self._path(task_id)
+        if path is None:
+            return empty(task_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return self._legacy(task_id, path)
+
+        def load():
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        try:
+            return self._cached(task_id, (stat.st_mtime_ns, stat.st_size, stat.st_ino), load)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return self._legacy(task_id, path)
+
+    def forget(self, task_id):
+        with self._lock:
+            self._entries.pop(task_id, None)
+            self._paths.pop(task_id, None)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：页面抓取，响应体流式写入磁盘（限制大小与总耗时），再从文件增量解析出纯文本与<head>中的标题，单个任务的内存占用不随页面大小增长
+import codecs
+import os
+import re
+import time
+from html.parser import HTMLParser
+
+from task_control import http_request
+
+CHUNK_SIZE = 64 * 1024
+# 在响应开头查找 <meta charset> 的字节数
+SNIFF_SIZE = 4096
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w-]+)', re.IGNORECASE)
+HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w-]+)', re.IGNORECASE)
+
+
+class PageTooLarge(Exception):
+    pass
+
+
+class TextExtractor(HTMLParser):
+    """增量提取页面文本（跳过 script/style），以及 <body> 之前的第一个 <title>"""
+
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+
+    def __init__(self, write):
+        super().__init__(convert_charrefs=True)
+        self.write = write
+        self.title = None
+        self._title_parts = None
+        self._skip = 0
+        self._in_body = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag == 'body':
+            self._in_body = True
+        elif tag == 'title' and self.title is None and not self._in_body:
+            self._title_parts = []
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag == 'title' and self._title_parts is not None:
+            self.title = ''.join(self._title_parts).strip()
+            self._title_parts = None
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+        # 与原来一致：去掉换行符
+        self.write(data.replace('\n', ' ').replace('\r', ''))
+
+
+def detect_encoding(content_type, head):
+    # 优先使用响应头中的编码，其次是页面 <meta> 中声明的编码，都没有时按 utf-8 处理
+    for match in (HEADER_CHARSET.search(content_type or ''), META_CHARSET.search(head)):
+        if match:
+            name = match.group(1)
+            name = name.decode('ascii', 'ignore') if isinstance(name, bytes) else name
+            try:
+                return codecs.lookup(name).name
+            except LookupError:
+                continue
+    return 'utf-8'
+
+
+def download(url, html_file, token=None, timeout=30, max_bytes=10 * 1024 * 1024):
+    # 流式下载到 html_file，返回响应头中的 Content-Type；超过 max_bytes 或总耗时超过 timeout 时抛出异常
+    started = time.time()
+    response = http_request('GET', url, token, stream=True, timeout=timeout)
+    try:
+        response.raise_for_status()
+        size = 0
+        with open(html_file, 'wb') as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise PageTooLarge(f"页面超过 {max_bytes} 字节")
+                if time.time() - started > timeout:
+                    raise TimeoutError(f"页面下载超过 {timeout} 秒")
+                if token:
+                    token.check()
+                f.write(chunk)
+        return response.headers.get('Content-Type', '')
+    finally:
+        response.close()
+
+
+def extract(html_file, text_file, content_type=''):
+    # 从 html_file 增量解析，纯文本写入 text_file，返回页面标题（没有时为空字符串）
+    # 先写临时文件，解析完成后再替换，避免中途失败留下不完整的 content.txt 被下次直接复用
+    temp_file = text_file + '.tmp'
+    with open(html_file, 'rb') as f:
+        encoding = detect_encoding(content_type, f.read(SNIFF_SIZE))
+        f.seek(0)
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        with open(temp_file, 'w', encoding='utf-8') as out:
+            parser = TextExtractor(out.write)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+    os.replace(temp_file, text_file)
+    return parser.title or ''
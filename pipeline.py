@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：任务阶段依赖图，互不依赖的阶段并发执行，依赖就绪的阶段立即开始
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import logs
+
+
+class StageFailed(Exception):
+    # 阶段主动终止整个任务，progress 为展示给用户的失败原因
+    def __init__(self, progress):
+        super().__init__(progress)
+        self.progress = progress
+
+
+class Stage:
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        # func(results) -> 阶段结果，results 为已完成阶段的结果字典
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class Pipeline:
+    """
+    pipeline = Pipeline(token)
+    pipeline.add('fetch', fetch)
+    pipeline.add('title', make_title, deps=['fetch'])
+    pipeline.add('dialogue', make_dialogue, deps=['fetch'])
+    results = pipeline.run()
+    任一阶段抛出异常时不再启动新阶段，并通过 token.abort() 让仍在运行的阶段在下一次检查时退出，
+    等待它们结束、恢复 token 后抛出第一个异常。
+    hooks 中的对象在每个阶段开始、结束时于阶段线程中调用 stage_started(name)、stage_finished(name)
+    """
+
+    def __init__(self, token=None, hooks=()):
+        self.token = token
+        self.hooks = list(hooks)
+        self.stages = {}
+        self.results = {}
+        # 已完成阶段的耗时(秒)
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, func, deps=()):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"阶段 {name} 依赖的阶段 {dep} 不存在")
+        self.stages[name] = Stage(name, func, deps)
+        return self
+
+    def _run_stage(self, stage):
+        logs.set_context(stage=stage.name)
+        if self.token:
+            self.token.check()
+            # 记录阶段开始时间，看门狗按阶段时限检查
+            self.token.enter_stage(stage.name)
+        for hook in self.hooks:
+            hook.stage_started(stage.name)
+        with self._lock:
+            results = dict(self.results)
+        started = time.monotonic()
+        try:
+            result = stage.func(results)
+        finally:
+            for hook in self.hooks:
+                hook.stage_finished(stage.name)
+            if self.token:
+                self.token.leave_stage(stage.name)
+        with self._lock:
+            self.durations[stage.name] = time.monotonic() - started
+        return result
+
+    def run(self):
+        pending = dict(self.stages)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stages)), thread_name_prefix='stage') as executor:
+            while pending or running:
+                if error is None:
+                    ready = [s for s in pending.values() if all(d in self.results for d in s.deps)]
+                    for stage in ready:
+                        del pending[stage.name]
+                        # 复制当前上下文，阶段线程中的日志同样带有 taskId
+                        context = contextvars.copy_context()
+                        running[executor.submit(context.run, self._run_stage, stage)] = stage.name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+                            if self.token and running:
+                                self.token.abort()
+                        continue
+                    with self._lock:
+                        self.results[name] = result
+        if self.token:
+            self.token.resume()
+        if error is not None:
+            raise error
+        return self.results
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：按比例抽样对任务做 CPU 与内存分析，结果写入任务目录下的 profile/<时间>/：
+#           stacks.json   任务各阶段线程的调用栈采样（墙钟时间，包含等待 LLM/TTS 的时间）
+#           cpu_*.prof    进程池中页面解析、音频合并调用的 cProfile 结果
+#           memory.json   阶段开始、结束时的 tracemalloc 内存占用与各阶段新增内存最多的代码行
+#           <阶段>.snap    阶段结束时的 tracemalloc 快照
+#           tracemalloc 统计整个进程的分配，期间有其他任务执行时数值包含其他任务的内存：
+#           memory.json 的事件记录同时执行的其他任务数，这些阶段不做快照对比，也不计入汇总
+#           python profiling.py summary 汇总所有抽样任务，列出最耗时的函数与分配内存最多的代码行
+import argparse
+import collections
+import contextvars
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import config
+import logs
+import task_control
+
+log = logs.get_log('profiling')
+
+PROFILE_DIR = 'profile'
+# 环境变量优先于 profile_sample_rate 配置，便于临时开启
+SAMPLE_RATE_ENV = 'PROFILE_SAMPLE_RATE'
+MAX_STACK_DEPTH = 64
+# memory.json 中每个阶段记录的新增内存最多的代码行数
+TOP_ALLOCATIONS = 10
+
+SHARED_NOTE = ('tracemalloc 统计整个进程的内存，otherTasks 大于 0 的事件与 sharedStages 中的阶段包含同时执行的其他任务的分配，'
+               '这些阶段没有快照对比，也不计入汇总')
+
+_current = contextvars.ContextVar('profiler', default=None)
+# tracemalloc 是进程级的，同一时间只分析一个任务
+_active = threading.Lock()
+
+
+def sample_rate():
+    value = os.environ.get(SAMPLE_RATE_ENV)
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            log(f"环境变量 {SAMPLE_RATE_ENV} 不是数字: {value}", logging.WARNING)
+    return getattr(config, 'profile_sample_rate', 0)
+
+
+def frame_key(code):
+    # 文件名取最后两级目录，既能区分同名模块又不会过长
+    path = code.co_filename.replace('\\', '/').split('/')
+    return f"{'/'.join(path[-2:])}:{code.co_name}"
+
+
+def fold(stage, frame):
+    # 调用栈转为 "阶段;外层函数;...;内层函数" 形式，可直接用于生成火焰图
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(frame_key(frame.f_code))
+        frame = frame.f_back
+    return ';'.join([stage] + names[::-1])
+
+
+def snapshot():
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+
+
+def other_tasks(task_id):
+    # 同一进程中正在执行的其他任务数
+    return len([t for t in task_control.slots.running() if t != task_id])
+
+
+def top_allocations(new, old, limit=TOP_ALLOCATIONS):
+    return [{'site': str(stat.traceback), 'sizeDiff': stat.size_diff, 'countDiff': stat.count_diff}
+            for stat in new.compare_to(old, 'lineno')[:limit] if stat.size_diff > 0]
+
+
+class TaskProfiler:
+    """单个任务的分析器，作为 Pipeline 的钩子在阶段开始、结束时调用；分析过程出错只记录日志，不影响任务"""
+
+    def __init__(self, task_id, directory):
+        self.task_id = task_id
+        self.directory = directory
+        self.interval = getattr(config, 'profile_interval', 0.01)
+        self.started = time.time()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.memory = []
+        self.stage_memory = {}
+        self._threads = {}
+        self._snapshots = {}
+        self._cpu_calls = 0
+        # 执行期间有其他任务同时运行的阶段，内存数据不能只归于本任务
+        self._shared = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tracemalloc.start(getattr(config, 'profile_trace_frames', 1))
+        self._sampler.start()
+
+    def _sample(self):
+        # 定时读取各阶段线程当前的调用栈，开销与线程数、栈深度有关，与被分析代码的调用次数无关
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for ident, stage in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[fold(stage, frame)] += 1
+            self.samples += 1
+            # 阶段边界之间开始又结束的其他任务同样会影响内存统计
+            if other_tasks(self.task_id):
+                with self._lock:
+                    self._shared.update(stage for _, stage in threads)
+
+    def _memory_event(self, event, stage):
+        current, peak = tracemalloc.get_traced_memory()
+        # 峰值为上一个阶段边界以来的峰值，并发执行的阶段共用
+        tracemalloc.reset_peak()
+        others = other_tasks(self.task_id)
+        if others:
+            self._shared.add(stage)
+        self.memory.append({'time': round(time.time() - self.started, 3), 'event': event, 'stage': stage,
+                            'currentBytes': current, 'peakBytes': peak, 'otherTasks': others})
+
+    def stage_started(self, stage):
+        # 先取快照再登记线程，分析器自身的耗时不计入采样
+        try:
+            self._snapshots[stage] = snapshot()
+            with self._lock:
+                self._memory_event('start', stage)
+                self._threads[threading.get_ident()] = stage
+        except Exception as e:
+            log(f"记录阶段 {stage} 开始时的内存失败: {str(e)}", logging.WARNING)
+
+    def stage_finished(self, stage):
+        try:
+            with self._lock:
+                self._threads.pop(threading.get_ident(), None)
+                self._memory_event('finish', stage)
+                shared = stage in self._shared
+            if shared:
+                # 快照对比会把其他任务的分配算到本阶段，不做对比
+                self._snapshots.pop(stage, None)
+                return
+            end = snapshot()
+            end.dump(os.path.join(self.directory, f"{stage}.snap"))
+            start = self._snapshots.pop(stage, None)
+            if start is not None:
+                # 并发执行的阶段之间互相包含对方的分配
+                self.stage_memory[stage] = top_allocations(end, start)
+        except Exception as e:
+            log(f"记录阶段 {stage} 结束时的内存失败: {str(e)}", logging.WARNING)
+
+    def cpu_profile_path(self, func):
+        with self._lock:
+            self._cpu_calls += 1
+            return os.path.join(self.directory, f"cpu_{self._cpu_calls:02d}_{getattr(func, '__name__', 'call')}.prof")
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        tracemalloc.stop()
+        data = {
+            'taskId': self.task_id,
+            'interval': self.interval,
+            'samples': self.samples,
+            'seconds': round(time.time() - self.started, 3),
+            'stacks': dict(self.stacks.most_common()),
+        }
+        with open(os.path.join(self.directory, 'stacks.json'), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        with open(os.path.join(self.directory, 'memory.json'), 'w', encoding='utf-8') as f:
+            json.dump({'taskId': self.task_id, 'events': self.memory, 'stages': self.stage_memory,
+                       'sharedStages': sorted(self._shared), 'note': SHARED_NOTE},
+                      f, ensure_ascii=False, indent=2)
+
+
+def start(task_id):
+    """
+    任务开始时调用，按 profile_sample_rate 抽样；选中时开始分析并返回分析器，结束时调用 stop()。
+    已有任务正在被分析时不再抽样
+    """
+    rate = sample_rate()
+    if rate <= 0 or random.random() >= rate or not _active.acquire(blocking=False):
+        return None
+    directory = config.get_task_file(task_id, os.path.join(PROFILE_DIR, datetime.now().strftime('%Y%m%d-%H%M%S')))
+    profiler = TaskProfiler(task_id, directory)
+    try:
+        profiler.start()
+    except Exception as e:
+        _active.release()
+        log(f"任务 {task_id} 开始性能分析失败: {str(e)}", logging.WARNING, taskId=task_id)
+        return None
+    _current.set(profiler)
+    log(f"任务 {task_id} 已被抽样进行性能分析，结果目录: {directory}", taskId=task_id)
+    return profiler
+
+
+def stop(profiler):
+    _current.set(None)
+    try:
+        profiler.stop()
+    except Exception as e:
+        log(f"任务 {profiler.task_id} 写入性能分析结果失败: {str(e)}", logging.WARNING, taskId=profiler.task_id)
+    finally:
+        _active.release()
+
+
+def hooks():
+    # 当前任务被抽样时返回 Pipeline 钩子
+    profiler = _current.get()
+    return [profiler] if profiler else []
+
+
+def current():
+    return _current.get()
+
+
+def profiled_call(path, func, *args, **kwargs):
+    # 在进程池子进程中执行，cProfile 结果写入 path，同时记录该次调用的内存峰值
+    tracemalloc.start()
+    profile = cProfile.Profile()
+    started = time.time()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        profile.dump_stats(path)
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'func': getattr(func, '__name__', str(func)), 'seconds': round(time.time() - started, 3),
+                       'peakBytes': peak}, f)
+
+
+# ---------------------------------------------------------------- 汇总
+
+def find_runs(root):
+    # 任务目录按任务ID前两位分片，兼容未分片的旧目录
+    patterns = [os.path.join(root, '*', '*', PROFILE_DIR, '*'), os.path.join(root, '*', PROFILE_DIR, '*')]
+    return sorted({path for pattern in patterns for path in glob.glob(pattern) if os.path.isdir(path)})
+
+
+def summarize(runs, top=20):
+    self_samples = collections.Counter()
+    total_samples = collections.Counter()
+    samples = 0
+    for run in runs:
+        path = os.path.join(run, 'stacks.json')
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            stacks = json.load(f)['stacks']
+        for stack, count in stacks.items():
+            names = stack.split(';')
+            samples += count
+            self_samples[names[-1]] += count
+            # 递归调用在同一个栈中只计一次
+            for name in set(names[1:]):
+                total_samples[name] += count
+
+    cpu_files = [path for run in runs for path in glob.glob(os.path.join(run, 'cpu_*.prof'))]
+    cpu = []
+    if cpu_files:
+        stats = pstats.Stats(*cpu_files)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+        cpu = [{'function': f"{'/'.join(file.replace(os.sep, '/').split('/')[-2:])}:{line}({name})",
+                'calls': nc, 'selfSeconds': round(tt, 4), 'cumulativeSeconds': round(ct, 4)}
+               for (file, line, name), (cc, nc, tt, ct, callers) in rows]
+
+    allocations = {}
+    for run in runs:
+        for path in glob.glob(os.path.join(run, '*.snap')):
+            stage = os.path.splitext(os.path.basename(path))[0]
+            for stat in tracemalloc.Snapshot.load(path).statistics('lineno')[:top * 5]:
+                site = allocations.setdefault(str(stat.traceback), {'maxBytes': 0, 'runs': set(), 'stages': set()})
+                site['maxBytes'] = max(site['maxBytes'], stat.size)
+                site['runs'].add(run)
+                site['stages'].add(stage)
+    allocation_rows = sorted(allocations.items(), key=lambda item: item[1]['maxBytes'], reverse=True)[:top]
+
+    peaks = []
+    for path in (os.path.join(run, name) for run in runs for name in os.listdir(run) if name.endswith('.prof.json')):
+        with open(path, 'r', encoding='utf-8') as f:
+            peaks.append(json.load(f))
+    stage_peaks = collections.defaultdict(int)
+    for run in runs:
+        path = os.path.join(run, 'memory.json')
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                memory = json.load(f)
+            shared = set(memory.get('sharedStages', ()))
+            for event in memory['events']:
+                # 有其他任务同时执行的阶段，峰值包含其他任务的内存
+                if event['event'] == 'finish' and event['stage'] not in shared and not event.get('otherTasks'):
+                    stage_peaks[event['stage']] = max(stage_peaks[event['stage']], event['peakBytes'])
+
+    return {
+        'runs': len(runs),
+        'samples': samples,
+        'hotFunctions': [{'function': name, 'selfShare': round(count / samples, 4),
+                          'totalShare': round(total_samples[name] / samples, 4)}
+                         for name, count in self_samples.most_common(top)] if samples else [],
+        'cpuPool': cpu,
+        'cpuPoolPeakBytes': {item['func']: max(p['peakBytes'] for p in peaks if p['func'] == item['func']) for item in peaks},
+        'allocations': [{'site': site, 'maxBytes': info['maxBytes'], 'runs': len(info['runs']),
+                         'stages': sorted(info['stages'])} for site, info in allocation_rows],
+        'stagePeakBytes': dict(stage_peaks),
+    }
+
+
+def print_summary(summary):
+    print(f"抽样任务数: {summary['runs']}，任务线程采样数: {summary['samples']}")
+    print("\n任务线程耗时（墙钟采样，self 为函数自身，total 包含其调用的函数）:")
+    for row in summary['hotFunctions']:
+        print(f"  {row['selfShare'] * 100:6.2f}%  {row['totalShare'] * 100:6.2f}%  {row['function']}")
+    print("\n进程池调用 CPU 耗时（cProfile，按自身耗时排序）:")
+    for row in summary['cpuPool']:
+        print(f"  {row['selfSeconds']:10.4f}s {row['cumulativeSeconds']:10.4f}s {row['calls']:>8}  {row['function']}")
+    for func, peak in summary['cpuPoolPeakBytes'].items():
+        print(f"  {func} 内存峰值 {peak / 1024 / 1024:.1f} MiB")
+    print("\n各阶段内存峰值（只统计没有其他任务同时执行的阶段）:")
+    for stage, peak in sorted(summary['stagePeakBytes'].items(), key=lambda item: item[1], reverse=True):
+        print(f"  {peak / 1024 / 1024:10.1f} MiB  {stage}")
+    print("\n阶段结束时占用内存最多的代码行（各次抽样中的最大值）:")
+    for row in summary['allocations']:
+        print(f"  {row['maxBytes'] / 1024:10.1f} KiB  {row['site']}  ({', '.join(row['stages'])}，{row['runs']} 次)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='任务性能分析结果汇总')
+    sub = parser.add_subparsers(dest='command', required=True)
+    summary_parser = sub.add_parser('summary', help='汇总所有抽样任务的分析结果')
+    summary_parser.add_argument('--dir', default='output', help='任务输出目录')
+    summary_parser.add_argument('--top', type=int, default=20)
+    summary_parser.add_argument('--json', action='store_true', help='以 JSON 输出')
+    args = parser.parse_args()
+    result = summarize(find_runs(args.dir), args.top)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_summary(result)
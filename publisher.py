@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：小宇宙发布，常驻浏览器会话池 + 独立发布队列（失败重试），不占用合成任务线程
+import argparse
+import contextlib
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.edge.options import Options
+from selenium.webdriver.edge.service import Service
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+import config
+import delivery
+import logs
+import manifest
+import storage
+import task_store
+
+log = logs.get_log('publisher')
+
+# 小宇宙创作者后台页面元素，页面改版时只需修改这里（本地测试页 tools/xiaoyuzhou_standin.html 使用相同的元素）
+SELECTORS = {
+    'home_label': '//span[@class="jsx-3385323943 label active"]',
+    'management_title': '//h2[@class="css-1dlp2vs"]',
+    'upload_button': '//div[@class="css-k4ekfx e1ab6r9u3"]',
+    'title_input': '//input[@class="css-19crfhb css-1r2ttr7 e1ab6r9u7"]',
+    'file_input': '//input[@id="upload"]',
+    'outline_editor': '//div[@class="notranslate public-DraftEditor-content"]',
+    'publish_settings': '//div[@class="css-1079hn7"]//div[@class="css-1i5dn6c"]',
+    'upload_finished': '//div[@class="css-13dmsdw css-11conra e1ab6r9u4"]',
+    'publish_button': '//div[@class="css-1079hn7"]//div[@class="css-k4ekfx e1ab6r9u3"]',
+}
+
+DEFAULT_EPISODES_URL = 'https://podcaster.xiaoyuzhoufm.com/podcasts/66fef2c7f03810fc2f505b0d/contents-management/episodes'
+
+
+class PublishError(Exception):
+    pass
+
+
+class PublishJob:
+    def __init__(self, task_id, outline=None):
+        self.task_id = task_id
+        # 为空时由发布队列在发布前生成
+        self.outline = outline
+        self.attempts = 0
+
+
+class BrowserPool:
+    """
+    常驻的浏览器会话池，驱动只解析一次，浏览器在多次发布之间复用。
+    Edge 的用户数据目录不能被多个浏览器同时使用，会话数大于 1 时第 i 个会话使用 `{profile_dir}-{i}`
+    """
+
+    def __init__(self, size=1, profile_dir=None, headless=False, driver_path=None):
+        self.size = max(1, size)
+        self.profile_dir = profile_dir
+        self.headless = headless
+        self.driver_path = driver_path
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._all = set()
+
+    def _resolve_driver_path(self):
+        with self._lock:
+            if not self.driver_path:
+                from webdriver_manager.microsoft import EdgeChromiumDriverManager
+                self.driver_path = EdgeChromiumDriverManager().install()
+            return self.driver_path
+
+    def _create(self, index):
+        options = Options()
+        if self.profile_dir:
+            profile_dir = self.profile_dir if index == 0 else f"{self.profile_dir}-{index}"
+            options.add_argument(f"user-data-dir={profile_dir}")
+        if self.headless:
+            options.add_argument('--headless=new')
+        driver = webdriver.Edge(service=Service(self._resolve_driver_path()), options=options)
+        driver.index = index
+        log(f"已启动浏览器会话 {index}")
+        return driver
+
+    @staticmethod
+    def _alive(driver):
+        try:
+            driver.window_handles
+            return True
+        except WebDriverException:
+            return False
+
+    def _discard(self, driver):
+        with self._lock:
+            self._all.discard(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _acquire(self, timeout):
+        # 返回空闲的浏览器，或需要启动浏览器的会话序号（int）
+        with self._lock:
+            if self._idle.empty() and self._created < self.size:
+                index = self._created
+                self._created += 1
+                return index
+        return self._idle.get(timeout=timeout)
+
+    @contextlib.contextmanager
+    def session(self, timeout=None):
+        driver = self._acquire(timeout)
+        if isinstance(driver, int):
+            index, driver = driver, None
+        elif not self._alive(driver):
+            log(f"浏览器会话 {driver.index} 已失效，重新启动", logging.WARNING)
+            self._discard(driver)
+            index, driver = driver.index, None
+        if driver is None:
+            try:
+                driver = self._create(index)
+            except BaseException:
+                # 启动失败时把会话序号放回空闲队列，下一个调用方会重新尝试启动，会话池不会缩小
+                self._idle.put(index)
+                raise
+            with self._lock:
+                self._all.add(driver)
+        try:
+            yield driver
+        except BaseException:
+            # 出错后页面状态未知，关闭浏览器，下次使用时重新启动
+            self._discard(driver)
+            self._idle.put(driver.index)
+            raise
+        else:
+            self._idle.put(driver)
+
+    def close(self):
+        with self._lock:
+            drivers = list(self._all)
+            self._all.clear()
+            self._created = 0
+            self._idle = queue.Queue()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+class XiaoyuzhouPublisher:
+    def __init__(self, episodes_url=DEFAULT_EPISODES_URL, page_timeout=60, step_timeout=30, upload_timeout=300):
+        self.episodes_url = episodes_url
+        self.page_timeout = page_timeout
+        self.step_timeout = step_timeout
+        self.upload_timeout = upload_timeout
+
+    def _wait(self, driver, condition, timeout, step):
+        try:
+            return WebDriverWait(driver, timeout, poll_frequency=0.5).until(condition)
+        except TimeoutException:
+            raise PublishError(f"等待{step}超时（{timeout}秒）")
+
+    def _wait_logged_in(self, driver):
+        # 等待"主页"或"内容管理"出现，说明已登录；有超时上限，不再无限循环
+        def logged_in(d):
+            for xpath, text in [(SELECTORS['home_label'], '主页'), (SELECTORS['management_title'], '内容管理')]:
+                for element in d.find_elements(By.XPATH, xpath):
+                    if element.text == text:
+                        return True
+            return False
+        self._wait(driver, logged_in, self.page_timeout, '后台页面加载')
+
+    def publish(self, driver, title, audio_file, outline):
+        driver.get(self.episodes_url)
+        self._wait_logged_in(driver)
+        driver.get(self.episodes_url)
+
+        # 点击上传按钮
+        self._wait(driver, EC.element_to_be_clickable((By.XPATH, SELECTORS['upload_button'])), self.step_timeout, '上传按钮').click()
+
+        # 输入标题
+        title_input = self._wait(driver, EC.presence_of_element_located((By.XPATH, SELECTORS['title_input'])), self.step_timeout, '标题输入框')
+        title_input.send_keys(title)
+
+        # 上传音频文件
+        upload_input = self._wait(driver, EC.presence_of_element_located((By.XPATH, SELECTORS['file_input'])), self.step_timeout, '文件上传框')
+        upload_input.send_keys(os.path.abspath(audio_file))
+
+        # 输入内容大纲，失败不影响发布
+        try:
+            editor = self._wait(driver, EC.presence_of_element_located((By.XPATH, SELECTORS['outline_editor'])), self.step_timeout, '大纲编辑器')
+            editor.send_keys(outline)
+        except (PublishError, WebDriverException) as e:
+            log(f"大纲输入有点问题: {e}", logging.WARNING)
+
+        # 点击发布设置
+        self._wait(driver, EC.element_to_be_clickable((By.XPATH, SELECTORS['publish_settings'])), self.step_timeout, '发布设置').click()
+
+        # 等待音频上传完成后点击发布按钮
+        self._wait(driver, EC.presence_of_element_located((By.XPATH, SELECTORS['upload_finished'])), self.upload_timeout, '音频上传完成')
+        self._wait(driver, EC.element_to_be_clickable((By.XPATH, SELECTORS['publish_button'])), self.step_timeout, '发布按钮').click()
+        log("成功点击发布按钮")
+
+
+def set_publish_status(task_id, status, detail=None):
+    with task_store.transaction() as txn:
+        task = txn.find(task_id)
+        if task:
+            task['publishStatus'] = status
+            task['publishDetail'] = detail
+            task['updatedAt'] = datetime.now().isoformat()
+            txn.changed = True
+    return txn.changed
+
+
+def read_title(task_id):
+    return (manifest.read(task_id).get('title') or '').strip()
+
+
+def upload_file(task_id):
+    # 没有压缩格式且 wav 已归档为 flac 时先还原
+    path = delivery.preferred_upload_file(task_id)
+    if not os.path.exists(path):
+        path = storage.ensure_wav(task_id) or path
+    return path
+
+
+class PublishQueue:
+    """独立的发布队列，失败后按指数退避重试，超过重试次数标记为发布失败"""
+
+    def __init__(self, pool, publisher, outline_func=None, max_attempts=3, backoff=30):
+        self.pool = pool
+        self.publisher = publisher
+        self.outline_func = outline_func
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.pool.size):
+            thread = threading.Thread(target=self._worker, name=f"publisher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        log(f"发布队列已启动，浏览器会话数: {self.pool.size}")
+
+    def enqueue(self, job):
+        set_publish_status(job.task_id, 'queued')
+        self._queue.put(job)
+        log(f"任务 {job.task_id} 已加入发布队列，当前排队 {self._queue.qsize()} 个")
+
+    def _retry_later(self, job, delay):
+        timer = threading.Timer(delay, self._queue.put, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            logs.set_context(taskId=job.task_id, stage='publish')
+            try:
+                self.run(job)
+            finally:
+                logs.clear_context()
+
+    def run(self, job):
+        if task_store.get_task(job.task_id) is None:
+            log(f"任务 {job.task_id} 已被删除，跳过发布")
+            return
+        job.attempts += 1
+        set_publish_status(job.task_id, 'publishing', f"第 {job.attempts} 次尝试")
+        try:
+            title = read_title(job.task_id)
+            if job.outline is None and self.outline_func:
+                job.outline = self.outline_func(storage.read_text(config.get_task_file(job.task_id, 'content.txt')) or '')
+            with self.pool.session(timeout=self.publisher.page_timeout) as driver:
+                self.publisher.publish(driver, title, upload_file(job.task_id), job.outline or ' ')
+        except Exception as e:
+            if job.attempts >= self.max_attempts:
+                log(f"任务 {job.task_id} 发布失败，已达最大重试次数: {e}", logging.ERROR)
+                set_publish_status(job.task_id, 'failed', str(e))
+                return
+            delay = self.backoff * (2 ** (job.attempts - 1))
+            log(f"任务 {job.task_id} 发布失败 (尝试 {job.attempts}/{self.max_attempts})，{delay} 秒后重试: {e}", logging.WARNING)
+            set_publish_status(job.task_id, 'retrying', str(e))
+            self._retry_later(job, delay)
+            return
+        set_publish_status(job.task_id, 'published')
+        log(f"完成上传任务 {job.task_id} 到小宇宙")
+
+
+def create_publish_queue(outline_func=None):
+    pool = BrowserPool(
+        size=getattr(config, 'xiaoyuzhou_browser_count', 1),
+        profile_dir=getattr(config, 'xiaoyuzhou_profile_dir', 'C:\\edge'),
+        headless=getattr(config, 'xiaoyuzhou_headless', False),
+        driver_path=getattr(config, 'xiaoyuzhou_driver_path', None),
+    )
+    publisher = XiaoyuzhouPublisher(
+        episodes_url=getattr(config, 'xiaoyuzhou_episodes_url', DEFAULT_EPISODES_URL),
+        page_timeout=getattr(config, 'xiaoyuzhou_page_timeout', 60),
+    )
+    return PublishQueue(pool, publisher, outline_func, max_attempts=getattr(config, 'xiaoyuzhou_publish_retries', 3))
+
+
+if __name__ == '__main__':
+    # 对单个任务执行一次发布，可配合本地测试页验证流程：
+    # python publisher.py <taskId> --url file:///path/to/tools/xiaoyuzhou_standin.html --headless
+    parser = argparse.ArgumentParser(description='发布单个任务到小宇宙')
+    parser.add_argument('task_id')
+    parser.add_argument('--url', default=getattr(config, 'xiaoyuzhou_episodes_url', DEFAULT_EPISODES_URL))
+    parser.add_argument('--outline', default=' ')
+    parser.add_argument('--headless', action='store_true')
+    args = parser.parse_args()
+    pool = BrowserPool(profile_dir=getattr(config, 'xiaoyuzhou_profile_dir', None), headless=args.headless,
+                       driver_path=getattr(config, 'xiaoyuzhou_driver_path', None))
+    try:
+        with pool.session() as driver:
+            XiaoyuzhouPublisher(episodes_url=args.url, page_timeout=10, step_timeout=10, upload_timeout=30).publish(
+                driver, read_title(args.task_id), upload_file(args.task_id), args.outline)
+    finally:
+        pool.close()
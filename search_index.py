@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：节目全文检索，标题与对话按中文二元字组、英文单词切分后写入 SQLite FTS5 倒排索引；
+#           任务完成或删除时增量更新，查询只读索引文件，不读取任务目录
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from contextlib import closing
+
+import config
+import logs
+import task_store
+
+log = logs.get_log('search')
+
+# 中日韩统一表意文字按二元字组切分，字母数字按单词切分
+CJK_RANGES = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+TOKEN = re.compile(f'[{CJK_RANGES}]+|[a-z0-9]+')
+CJK = re.compile(f'[{CJK_RANGES}]')
+# bm25 中标题与对话的权重
+TITLE_WEIGHT = 3.0
+BODY_WEIGHT = 1.0
+SNIPPET_RADIUS = 40
+MAX_SNIPPETS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    task_id TEXT UNIQUE NOT NULL,
+    title TEXT,
+    created_at TEXT,
+    lines TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(title, body, tokenize='unicode61');
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def index_tokens(text):
+    # 每段连续的汉字输出全部二元字组，再补上末尾的单字，单字查询按前缀匹配即可覆盖所有出现位置
+    tokens = []
+    for match in TOKEN.finditer(normalize(text)):
+        run = match.group()
+        if CJK.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+
+def match_expression(query):
+    # 连续的汉字转为二元字组短语（等价于子串匹配），单个汉字按前缀匹配，多个词之间为 AND
+    terms = []
+    for match in TOKEN.finditer(normalize(query)):
+        run = match.group()
+        if CJK.match(run) and len(run) > 1:
+            terms.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+        elif CJK.match(run):
+            terms.append(f'"{run}"*')
+        else:
+            terms.append(f'"{run}"')
+    return ' AND '.join(terms)
+
+
+def index_file():
+    return getattr(config, 'search_index_file', 'search_index.db')
+
+
+def connect():
+    # api 与任务服务器两个进程同时读写，使用 WAL 模式，写入冲突时等待
+    db = sqlite3.connect(index_file(), timeout=30)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(SCHEMA)
+    return db
+
+
+def make_lines(dialogue):
+    return [{'role': item.get('role'), 'content': item.get('content', '')}
+            for item in dialogue or [] if isinstance(item, dict)]
+
+
+def _delete(db, task_id):
+    row = db.execute('SELECT id FROM docs WHERE task_id = ?', (task_id,)).fetchone()
+    if row:
+        db.execute('DELETE FROM terms WHERE rowid = ?', row)
+        db.execute('DELETE FROM docs WHERE id = ?', row)
+
+
+def _insert(db, task_id, title, lines, created_at):
+    _delete(db, task_id)
+    cursor = db.execute('INSERT INTO docs (task_id, title, created_at, lines) VALUES (?, ?, ?, ?)',
+                        (task_id, title or '', created_at, json.dumps(lines, ensure_ascii=False)))
+    body = ' '.join(index_tokens(line['content']) for line in lines)
+    db.execute('INSERT INTO terms (rowid, title, body) VALUES (?, ?, ?)',
+               (cursor.lastrowid, index_tokens(title), body))
+
+
+def add_task(task_id, title, dialogue, created_at=None):
+    # 任务完成时调用，同一任务重复加入时覆盖；失败只记录日志，不影响任务状态
+    try:
+        with closing(connect()) as db, db:
+            _insert(db, task_id, title, make_lines(dialogue), created_at)
+    except sqlite3.Error as e:
+        log(f"任务 {task_id} 加入检索索引失败: {str(e)}", logging.ERROR, taskId=task_id)
+
+
+def remove_task(task_id):
+    if not os.path.exists(index_file()):
+        return
+    with closing(connect()) as db, db:
+        _delete(db, task_id)
+
+
+def rebuild():
+    # 根据任务列表与各任务的 manifest 重建索引，用于首次启用或索引损坏时
+    import manifest
+    manifests = manifest.ManifestCache()
+    count = 0
+    with closing(connect()) as db, db:
+        db.execute('DELETE FROM terms')
+        db.execute('DELETE FROM docs')
+        for task in task_store.read_tasks():
+            if task.get('status') != 'completed':
+                continue
+            data = manifests.get(task['taskId'])
+            _insert(db, task['taskId'], data.get('title'), make_lines(data.get('dialogue')), task.get('createdAt'))
+            count += 1
+        db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('builtAt', ?)", (str(time.time()),))
+    log(f"检索索引重建完成，共 {count} 个节目")
+    return count
+
+
+def snippets(lines, query):
+    # 返回包含查询词最多的几行对话，截取匹配位置前后的文字
+    normalized_query = normalize(query).strip()
+    terms = set(TOKEN.findall(normalized_query))
+    ranked = []
+    for index, line in enumerate(lines):
+        text = normalize(line['content'])
+        hits = sum(1 for term in terms if term in text)
+        if normalized_query in text:
+            hits += len(terms) + 1
+        if hits:
+            ranked.append((-hits, index))
+    result = []
+    for _, index in sorted(ranked)[:MAX_SNIPPETS]:
+        content = lines[index]['content']
+        text = normalize(content)
+        if normalized_query in text:
+            position, length = text.find(normalized_query), len(normalized_query)
+        else:
+            position, length = min((text.find(term), len(term)) for term in terms if term in text)
+        # 中文归一化前后长度一致，直接按位置截取原文
+        start = max(0, position - SNIPPET_RADIUS)
+        end = position + length + SNIPPET_RADIUS
+        result.append({
+            'line': index,
+            'role': lines[index]['role'],
+            'text': ('…' if start > 0 else '') + content[start:end] + ('…' if end < len(content) else ''),
+        })
+    return result
+
+
+def search(query, page=1, size=10):
+    # 按 bm25 相关度排序分页返回，命中结果包含匹配片段与节目创建时间
+    started = time.time()
+    expression = match_expression(query)
+    result = {'query': query, 'total': 0, 'page': page, 'size': size, 'hits': []}
+    if expression:
+        with closing(connect()) as db:
+            if db.execute("SELECT 1 FROM meta WHERE key = 'builtAt'").fetchone() is None:
+                # 首次启用时根据已完成的任务建立索引
+                rebuild()
+            result['total'] = db.execute('SELECT count(*) FROM terms WHERE terms MATCH ?', (expression,)).fetchone()[0]
+            rows = db.execute(
+                'SELECT d.task_id, d.title, d.created_at, d.lines, bm25(terms, ?, ?) AS rank '
+                'FROM terms JOIN docs d ON d.id = terms.rowid '
+                'WHERE terms MATCH ? ORDER BY rank LIMIT ? OFFSET ?',
+                (TITLE_WEIGHT, BODY_WEIGHT, expression, size, (page - 1) * size)).fetchall()
+        for task_id, title, created_at, lines, rank in rows:
+            result['hits'].append({
+                'taskId': task_id,
+                'title': title,
+                'createdAt': created_at,
+                'score': round(-rank, 4),
+                'snippets': snippets(json.loads(lines), query),
+            })
+    result['tookMs'] = round((time.time() - started) * 1000, 2)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='节目全文检索索引')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='根据已完成的任务重建索引')
+    query = sub.add_parser('search', help='查询')
+    query.add_argument('query')
+    query.add_argument('--page', type=int, default=1)
+    query.add_argument('--size', type=int, default=10)
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        rebuild()
+    else:
+        print(json.dumps(search(args.query, args.page, args.size), ensure_ascii=False, indent=2))
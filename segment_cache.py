@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：TTS 片段缓存。合成的片段按说话人与文本的哈希保存在任务目录的 tts_cache/ 下，与片段文件硬链接，
+#           delete_original_audio 删除片段文件后缓存仍在；修改对话重新合成时内容未变的片段直接复用，只请求变化的片段
+import hashlib
+import os
+import shutil
+import uuid
+
+import config
+
+CACHE_DIR = 'tts_cache'
+
+
+def enabled():
+    return getattr(config, 'tts_segment_cache', True)
+
+
+def cache_dir(task_id):
+    return config.get_task_file(task_id, CACHE_DIR)
+
+
+def cache_file(task_id, anchor_type, content):
+    key = hashlib.sha1(f"{anchor_type}\n{content}".encode('utf-8')).hexdigest()[:20]
+    return os.path.join(cache_dir(task_id), f"{key}.wav")
+
+
+def temp_path(path):
+    return f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+def link(source, target):
+    # 优先硬链接，不额外占用磁盘；缓存文件按内容命名，写入后不再修改，共享同一份数据是安全的。
+    # target 可能也是硬链接（旧文本的缓存、内容去重的源任务），先链接到临时文件再替换，不能写穿原有数据
+    temp = temp_path(target)
+    try:
+        os.link(source, temp)
+    except OSError:
+        shutil.copy2(source, temp)
+    os.replace(temp, target)
+
+
+def write(target, data):
+    # 新合成的片段写入临时文件后替换，原因同 link
+    temp = temp_path(target)
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, target)
+
+
+def fetch(task_id, anchor_type, content, target):
+    # 缓存中有相同说话人、相同文本的片段时放到 target 并返回 True
+    if not enabled():
+        return False
+    cached = cache_file(task_id, anchor_type, content)
+    if not os.path.exists(cached):
+        return False
+    link(cached, target)
+    return True
+
+
+def store(task_id, anchor_type, content, source):
+    if not enabled():
+        return
+    cached = cache_file(task_id, anchor_type, content)
+    if not os.path.exists(cached):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        link(source, cached)
+
+
+def link_all(source_id, task_id):
+    # 内容去重复用其他任务时一并复用其片段缓存，之后修改对话也只需合成变化的片段
+    source = cache_dir(source_id)
+    if not enabled() or not os.path.isdir(source):
+        return
+    target = cache_dir(task_id)
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(source):
+        link(os.path.join(source, name), os.path.join(target, name))
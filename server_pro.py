@@ -1,19 +1,47 @@
 import tempfile
 import time
 import json
+import logging
 import os
 import ffmpeg
-import requests
 import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from bs4 import BeautifulSoup
-import re
+import shutil
+import glob
+import admission
 import config
-
-def log(message):
-    print(f"[{datetime.now().isoformat()}] {message}")
-
-def fetch_url_content(url, task_id):
+import cpu_pool
+import logs
+import manifest
+import page_fetch
+import profiling
+import search_index
+import segment_cache
+import storage
+import dedup
+import feed
+import delivery
+import llm_client
+import task_store
+import task_watchdog
+import tts_client
+import tts_segment
+from publisher import PublishJob, create_publish_queue
+from pipeline import Pipeline, StageFailed
+from task_control import TaskCancelled, read_task, slots
+try:
+    import audio_post
+except ImportError:  # 未安装 numpy 时跳过音频后处理，直接用 ffmpeg 拼接
+    audio_post = None
+# 小宇宙发布队列，在启动服务时创建
+publish_queue = None
+
+logger = logs.get_logger('server_pro')
+log = logs.get_log('server_pro')
+
+def fetch_url_content(url, task_id, token=None):
     try:
         content_file = config.get_task_file(task_id, 'content.txt')
         if os.path.exists(content_file) and os.path.getsize(content_file) > 0:
@@ -22,49 +50,26 @@ def fetch_url_content(url, task_id):
                 text_content = f.read()
             log(f"已从现有文件加载内容，长度: {len(text_content)} 字符")
             
-            # 从已存在的文件中读取标题
-            title_file = config.get_task_file(task_id, 'title.txt')
-            if os.path.exists(title_file):
-                with open(title_file, 'r', encoding='utf-8') as f:
-                    title = f.read().strip()
-            else:
-                title = "无标题"
+            # 标题保存在 manifest 中，旧任务从 title.txt 读取
+            title = manifest.writer(task_id).data.get('title') or ""
         else:
             log(f"正在获取页面内容: {url}")
-            response = requests.get(url)
-            response.raise_for_status()
-            
-            # 保存原始HTML到old.html文件
-            with open(config.get_task_file(task_id, 'old.html'), 'w', encoding='utf-8') as f:
-                f.write(response.text)
+            # 原始HTML流式保存到old.html文件，限制大小与耗时
+            html_file = config.get_task_file(task_id, 'old.html')
+            content_type = page_fetch.download(
+                url, html_file, token,
+                timeout=getattr(config, 'fetch_timeout', 30),
+                max_bytes=getattr(config, 'fetch_max_bytes', 10 * 1024 * 1024),
+            )
             log("原始HTML已保存到old.html文件")
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-        
-            text_content = soup.get_text()
-            # 删除text_content中的换行符
-            text_content = text_content.replace('\n', ' ').replace('\r', '')
         
-            # 保存纯文本内容到content.txt文件
-            with open(content_file, 'w', encoding='utf-8') as f:
-                f.write(text_content)
+            # 从old.html增量解析，纯文本内容保存到content.txt文件；页面标题取自<head>，为空时由标题阶段调用LLM生成
+            # 解析是纯 Python 的 CPU 密集操作，放到进程池中执行，避免占用 GIL 拖慢其他任务的网络请求
+            title = cpu_pool.run(page_fetch.extract, html_file, cpu_pool.staged(content_file), content_type,
+                                 token=token, outputs=[content_file])
             log("纯文本内容已保存到content.txt文件")
-        
-            # 提取并保存标题到title.txt文件
-            title_match = re.search(r'<title>(.*?)</title>', response.text, re.IGNORECASE | re.DOTALL)
-            title = title_match.group(1) if title_match else ""
-        
-            if not title:
-                if len(text_content) < 4:
-                    log("获取页面内容失败或内容为空，请重新提交")
-                    title = "获取页面内容失败或内容为空，请重新提交"
-                else:
-                    log("标题为空，正在调用LLM生成播客标题")
-                    title = generate_podcast_title(text_content)
-        
-            with open(config.get_task_file(task_id, 'title.txt'), 'w', encoding='utf-8') as f:
-                f.write(title)
-            log("标题已保存到title.txt文件")
+            with open(content_file, 'r', encoding='utf-8') as f:
+                text_content = f.read()
         
         log(f"成功获取页面内容，长度: {len(text_content)} 字符")
         return text_content, title
@@ -73,29 +78,20 @@ def fetch_url_content(url, task_id):
         return '',''
         raise
 
-def generate_podcast_title(content):
+def resolve_title(task_id, text_content, title, token=None):
+    # 页面没有标题时调用LLM生成播客标题，由标题阶段保存到 manifest
+    if not title:
+        log("标题为空，正在调用LLM生成播客标题")
+        title = generate_podcast_title(text_content, token)
+    return title
+
+def generate_podcast_title(content, token=None):
     def llm_request():
-        api_url = config.api_url
-        api_key = config.api_key
-        model = config.model
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
-        data = {
-            'model': model,
-            'messages': [
-                {'role': 'system', 'content': '你是一个播客标题生成器，请根据给定的内容生成一个吸引人的播客标题，标题需要有内涵一点。不要输出任何emoji符号，严禁输出《》：等符号，严禁输出《》：等符号，严禁输出《》：等符号。'},
-                {'role': 'user', 'content': f"请为以下内容生成一个播客标题:\n{content}"} 
-            ]
-        }
-        response = requests.post(api_url, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
-        if 'choices' in result and len(result['choices']) > 0:
-            return result['choices'][0]['message']['content'].strip()
-        else:
-            raise ValueError('API返回的数据格式不正确')
+        messages = [
+            {'role': 'system', 'content': '你是一个播客标题生成器，请根据给定的内容生成一个吸引人的播客标题，标题需要有内涵一点。不要输出任何emoji符号，严禁输出《》：等符号，严禁输出《》：等符号，严禁输出《》：等符号。'},
+            {'role': 'user', 'content': f"请为以下内容生成一个播客标题:\n{content}"} 
+        ]
+        return llm_client.chat(messages, token).strip()
 
     for attempt in range(2):
         try:
@@ -110,202 +106,205 @@ def generate_podcast_title(content):
 
     return "无标题"  # 这行代码实际上永远不会执行，因为上面的循环会处理所有情况
 
-def execute_task(task):
+def execute_task(task, token):
+    task_id = task['taskId']
+    # 该线程后续输出的日志都带上任务ID
+    logs.set_context(taskId=task_id)
+    # 按 profile_sample_rate 抽样分析任务的 CPU 与内存
+    profiler = profiling.start(task_id)
+    try:
+        run_task(task, token)
+    except TaskCancelled as e:
+        log(f"任务 {task_id} 已中止: {e.reason}")
+        if token.reclaimed:
+            # 已被看门狗放回等待队列，任务可能已重新开始执行，保留中间文件
+            return
+        cleanup_cancelled_task(task_id, token)
+    except Exception as e:
+        # 未预料的异常不能让任务一直停留在执行中，放回等待队列按退避时间重试
+        logger.exception(f"任务 {task_id} 执行出错: {str(e)}")
+        task_watchdog.requeue(task_id, '执行出错')
+    finally:
+        if profiler:
+            profiling.stop(profiler)
+        # 写入尚未落盘的进度，释放任务槽位，让排队中的任务可以开始执行；
+        # 被看门狗回收的任务槽位已经释放，不能再关闭重新执行的任务的 manifest
+        if slots.owns(task_id, token):
+            manifest.close(task_id)
+            slots.release(task_id, token)
+            log(f"任务 {task_id} 已释放执行槽位")
+
+def set_task_stage(token, status, progress):
+    # 每个阶段开始前检查取消状态；任务已被删除或取消时状态更新会失败，直接中止任务
+    token.check()
+    if not update_task_status(token.task_id, status, progress):
+        token.cancel('任务已删除' if read_task(token.task_id) is None else '任务已取消')
+        token.check()
+
+def cleanup_cancelled_task(task_id, token):
+    task_dir = config.get_task_file(task_id)
+    if token.deleted:
+        # 任务已被删除，执行期间可能重新生成了部分文件，这里整体清理
+        shutil.rmtree(task_dir, ignore_errors=True)
+        log(f"已清理被删除任务的目录: {task_dir}")
+        return
+    for audio_file in glob.glob(os.path.join(task_dir, '[0-9][0-9][0-9][0-9]_*.wav')):
+        os.remove(audio_file)
+    temp_file_name = os.path.join(task_dir, '.temp_file_list.txt')
+    if os.path.exists(temp_file_name):
+        os.remove(temp_file_name)
+    log(f"已清理被取消任务的中间文件: {task_dir}")
+
+def run_task(task, token):
     task_id = task['taskId']
     url = task['url']
     
-    log(f"开始执行任务 {task_id}")
+    # 已完成的任务修改对话后重新合成，只执行切分、合成与合并阶段
+    resynthesize = task.get('resynthesize', False)
+    log(f"开始{'重新合成' if resynthesize else '执行'}任务 {task_id}")
+    started = time.monotonic()
+    # 标题、对话、进度与产物汇总到 manifest.json，api 查询任务时只读这一个文件
+    task_manifest = manifest.writer(task_id)
     
-    # 更新任务状态
-    update_task_status(task_id, 'processing', '正在获取页面内容')
+    def fetch(results):
+        # 获取页面内容
+        set_task_stage(token, 'processing', '正在获取页面内容')
+        text_content, title = fetch_url_content(url, task_id, token)
+        if len(text_content) < 4:
+            log(f"获取页面内容失败或内容为空，URL: {url}")
+            raise StageFailed('获取页面内容失败或内容为空，请重新提交')
+        if "当前环境异常，完成验证后即可继续访问" in text_content:
+            log(f"检测到页面需要验证，URL: {url}")
+            raise StageFailed('请求URL失败，请重试')
+        log(f"成功获取页面内容，长度: {len(text_content)} 字符")
+        # 内容与已完成的任务重复时直接复用其对话和音频
+        dedup.check(text_content, task_id)
+        set_task_stage(token, 'processing', '正在生成对话内容')
+        return text_content, title
     
-    # 获取页面内容
-    text_content, title = fetch_url_content(url, task_id)
-    if len(text_content) < 4:
-        log(f"获取页面内容失败或内容为空，URL: {url}")
-        update_task_status(task_id, 'failed', '获取页面内容失败或内容为空，请重新提交')
-        return
-    if "当前环境异常，完成验证后即可继续访问" in text_content:
-        log(f"检测到页面需要验证，URL: {url}")
-        update_task_status(task_id, 'failed', '请求URL失败，请重试')
-        return
-    log(f"成功获取页面内容，长度: {len(text_content)} 字符")
+    def title(results):
+        text_content, page_title = results['fetch']
+        title = resolve_title(task_id, text_content, page_title, token)
+        task_manifest.update(title=title)
+        return title
+    
+    def first_dialogue(results):
+        log("正在调用 LLM 接口生成对话内容")
+        first = generate_first_dialogue(results['fetch'][0], token)
+        if not first[0]:
+            # 第一轮对话失败时不再请求第二轮，其他仍在运行的阶段也随之中止
+            raise StageFailed('生成对话内容失败，请重新提交')
+        return first
+    
+    def second_dialogue(results):
+        if not config.need_second_dialogue:
+            return []
+        return generate_second_dialogue(results['fetch'][0], results['first_dialogue'][1], token)
+    
+    def dialogue(results):
+        first = results['first_dialogue'][0]
+        dialogue = combine_dialogue(first, results['second_dialogue']) if first else []
+        log(f"成功生成对话内容，共 {len(dialogue)} 条对话")
+        
+        # 保存对话内容
+        task_manifest.update(dialogue=dialogue)
+        log("对话内容保存成功")
+        return dialogue
+    
+    def edited_dialogue(results):
+        # 标题与修改后的对话沿用 manifest 中的内容，不再抓取页面和请求 LLM
+        set_task_stage(token, 'processing', '正在重新合成修改的对话')
+        dialogue = task_manifest.data.get('dialogue')
+        if not dialogue:
+            raise StageFailed('没有可重新合成的对话')
+        return dialogue
     
-    # 调用 LLM 接口生成对话内容
-    update_task_status(task_id, 'processing', '正在生成对话内容')
-    log("正在调用 LLM 接口生成对话内容")
-    dialogue = generate_dialogue(text_content)
-    log(f"成功生成对话内容，共 {len(dialogue)} 条对话")
+    def tts(results):
+        # 调用 TTS 接口合成音频
+        set_task_stage(token, 'processing', '正在合成音频')
+        log("正在调用 TTS 接口合成音频")
+        audio_files = generate_audio(results['segment'], task_id, len(results['dialogue']), token)
+        if not audio_files:
+            raise StageFailed('TTS音频生成失败')
+        log(f"成功生成 {len(audio_files)} 个音频文件")
+        return audio_files
     
-    # 保存对话内容
-    dialogue_file = config.get_task_file(task_id, 'dialogue.json')
-    log(f"正在保存对话内容到文件: {dialogue_file}")
-    with open(dialogue_file, 'w') as f:
-        json.dump(dialogue, f, indent=4)
-    log("对话内容保存成功")
+    def merge(results):
+        # 合并音频文件
+        set_task_stage(token, 'processing', '正在合并音频文件')
+        log("开始合并音频文件")
+        starts = merge_audio_files(results['tts'], task_id, token)
+        if starts:
+            # 每条对话在合并音频中的起始时间，客户端可据此按对话跳转
+            task_manifest.update(chapters=tts_segment.chapters(results['segment'], starts))
+        if resynthesize and os.path.exists(storage.flac_file(task_id)):
+            # 已归档任务的旧音频，新音频为 wav
+            os.remove(storage.flac_file(task_id))
+        task_manifest.refresh_artifacts()
+        log("音频文件合并完成")
     
-    # 调用 TTS 接口合成音频
-    update_task_status(task_id, 'processing', '正在合成音频')
-    log("正在调用 TTS 接口合成音频")
-    audio_files = generate_audio(dialogue, task_id)
-    if not audio_files:
-        update_task_status(task_id, 'failed', 'TTS音频生成失败')
+    # 标题、大纲与第一轮对话只依赖页面内容，并发执行；第二轮对话在第一轮成功后才请求，TTS、合并依次等待各自的输入就绪
+    pipeline = Pipeline(token, hooks=profiling.hooks())
+    if resynthesize:
+        pipeline.add('title', lambda results: task_manifest.data.get('title'))
+        pipeline.add('dialogue', edited_dialogue)
+    else:
+        pipeline.add('fetch', fetch)
+        pipeline.add('title', title, deps=['fetch'])
+        pipeline.add('first_dialogue', first_dialogue, deps=['fetch'])
+        pipeline.add('second_dialogue', second_dialogue, deps=['first_dialogue'])
+        pipeline.add('dialogue', dialogue, deps=['first_dialogue', 'second_dialogue'])
+        pipeline.add('outline', lambda results: generate_outline(results['fetch'][0], token), deps=['fetch'])
+    pipeline.add('segment', lambda results: segment_dialogue(results['dialogue']), deps=['dialogue'])
+    pipeline.add('tts', tts, deps=['dialogue', 'segment'])
+    pipeline.add('merge', merge, deps=['tts', 'title'])
+    try:
+        results = pipeline.run()
+    except StageFailed as e:
+        set_task_stage(token, 'failed', e.progress)
+        return
+    except dedup.DuplicateContent as e:
+        # 标题、对话与章节取自被复用任务的 manifest，音频等产物已链接到本任务目录
+        source = manifest.read(e.source_id)
+        task_manifest.update(title=source.get('title'), dialogue=source.get('dialogue'),
+                             chapters=source.get('chapters'))
+        task_manifest.refresh_artifacts()
+        set_task_stage(token, 'completed', f'任务完成（内容与任务 {e.source_id} 重复，已复用音频）')
+        search_index.add_task(task_id, task_manifest.data.get('title'), task_manifest.data.get('dialogue'), task.get('createdAt'))
+        feed.add_episode(task)
+        log(f"任务 {task_id} 执行完成")
         return
-    log(f"成功生成 {len(audio_files)} 个音频文件")
     
-    # 合并音频文件
-    update_task_status(task_id, 'processing', '正在合并音频文件')
-    log("开始合并音频文件")
-    merge_audio_files(audio_files, task_id)
-    log("音频文件合并完成")
+    if resynthesize:
+        set_task_stage(token, 'completed', '任务完成（已按修改后的对话重新合成）')
+        search_index.add_task(task_id, results['title'], results['dialogue'], task.get('createdAt'))
+        feed.add_episode(task)
+        # 已发布的单集不会自动替换，避免在小宇宙重复发布
+        log(f"任务 {task_id} 重新合成完成，耗时 {time.monotonic() - started:.1f} 秒；已发布到小宇宙的音频需手动更新")
+        return
     
     # 更新任务状态为完成
-    update_task_status(task_id, 'completed', '任务完成')
+    set_task_stage(token, 'completed', '任务完成')
+    # 只记录完整执行的任务，复用音频的重复任务不计入，api 据此预估排队任务的完成时间
+    admission.record(task_id, pipeline.durations, time.monotonic() - started)
+    dedup.register(task_id, results['fetch'][0])
+    search_index.add_task(task_id, results['title'], results['dialogue'], task.get('createdAt'))
+    feed.add_episode(task)
     log(f"任务 {task_id} 执行完成")
     
-    # 调用新函数上传到小宇宙
-    upload_to_xiaoyuzhou(task_id)
-
-def upload_to_xiaoyuzhou(task_id):
-    from selenium import webdriver
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.webdriver.edge.options import Options
-    import time
-    import os
-    log(f"开始上传任务 {task_id} 到小宇宙")
-
-    # 自动下载并设置Edge驱动
-    from selenium import webdriver
-    from selenium.webdriver.edge.service import Service
-    from webdriver_manager.microsoft import EdgeChromiumDriverManager
-
-    # 设置Edge浏览器选项
-    edge_options = Options()
-    edge_options.add_argument(f"user-data-dir=C:\\edge")
-
-    # 使用EdgeChromiumDriverManager自动下载并设置驱动
-    service = Service(EdgeChromiumDriverManager().install())
-
-    # 初始化Edge浏览器
-    driver = webdriver.Edge(service=service, options=edge_options)
-
-    try:
-        # 打开小宇宙页面
-        driver.get("https://podcaster.xiaoyuzhoufm.com/podcasts/66fef2c7f03810fc2f505b0d/contents-management/episodes")
-
-        # 等待"主页"元素出现
-        while True:
-            try:
-                element = driver.find_element(By.XPATH, '//span[@class="jsx-3385323943 label active"]')
-                if element.text == "主页":
-                    driver.get("https://podcaster.xiaoyuzhoufm.com/podcasts/66fef2c7f03810fc2f505b0d/contents-management/episodes")
-                    break
-                
-                element = driver.find_element(By.XPATH, '//h2[@class="css-1dlp2vs"]')
-                if element.text == "内容管理":
-                    driver.get("https://podcaster.xiaoyuzhoufm.com/podcasts/66fef2c7f03810fc2f505b0d/contents-management/episodes")
-                    break
-            except:
-                pass
-
-        time.sleep(2)
-        # 点击上传按钮
-        driver.find_element(By.XPATH, '//div[@class="css-k4ekfx e1ab6r9u3"]').click()
-        time.sleep(2)
-
-        # 等待标题输入框出现
-        try:
-            title_input = WebDriverWait(driver, 30).until(
-                EC.presence_of_element_located((By.XPATH, '//input[@class="css-19crfhb css-1r2ttr7 e1ab6r9u7"]'))
-            )
-        except Exception as e:
-            log(f"小宇宙有点小问题 {str(e)}")
-            return
-
-        # 输入标题
-        with open(config.get_task_file(task_id, 'title.txt'), 'r', encoding='utf-8') as f:
-            title = f.read().strip()
-        title_input.send_keys(title)
-        time.sleep(2)
-
-        # 上传音频文件
-        upload_input = driver.find_element(By.XPATH, '//input[@id="upload"]')
-        upload_input.send_keys(os.path.abspath(config.get_task_file(task_id, f"{task_id}.wav")))
-        time.sleep(2)
-
-        # 生成内容大纲
-        with open(config.get_task_file(task_id, 'content.txt'), 'r', encoding='utf-8') as f:
-            content = f.read()
-        outline = generate_outline(content)
-        print('outline',outline)
-        time.sleep(2)
-
-        # 输入内容大纲
-        try:
-            editor = driver.find_element(By.XPATH, '//div[@class="notranslate public-DraftEditor-content"]')
-            editor.send_keys(outline)
-            time.sleep(2)
-        except Exception as e:
-            log(f"大纲输入有点问题")
-
-        time.sleep(2)
-        # 点击发布设置
-        driver.find_element(By.XPATH, '//div[@class="css-1079hn7"]//div[@class="css-1i5dn6c"]').click()
-        time.sleep(2)
-        # 等待发布按钮可点击并点击
-        start_time = time.time()
-        while time.time() - start_time < 90:
-            try:
-                # 等待"发布成功"元素出现
-                WebDriverWait(driver, 5).until(
-                    EC.presence_of_element_located((By.XPATH, '//div[@class="css-13dmsdw css-11conra e1ab6r9u4"]'))
-                )
-                # 点击发布按钮
-                publish_button = driver.find_element(By.XPATH, '//div[@class="css-1079hn7"]//div[@class="css-k4ekfx e1ab6r9u3"]')
-                publish_button.click()
-                log("成功点击发布按钮")
-                break
-            except:
-                time.sleep(2)
-        else:
-            log("等待60秒后仍未能成功发布，结束任务")
-
-    except Exception as e:
-        log(f"上传到小宇宙过程中出错: {str(e)}")
-    finally:
-        # 关闭浏览器
-        driver.quit()
-        pass
-    
-    log(f"完成上传任务 {task_id} 到小宇宙")
+    # 加入独立的发布队列上传到小宇宙，不占用合成任务槽位
+    if publish_queue:
+        publish_queue.enqueue(PublishJob(task_id, results['outline']))
 
-def generate_outline(content):
+def generate_outline(content, token=None):
     log("开始生成内容大纲")
     
     def llm_request(prompt):
-        api_url = config.api_url
-        api_key = config.api_key
-        model = config.model
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
-        data = {
-            'model': model,
-            'messages': [
-                {'role': 'system', 'content': '你是一个专业的播客内容编辑，请根据给定的内容生成一个简洁的播客内容大纲。'},
-                {'role': 'user', 'content': prompt}
-            ]
-        }
-        response = requests.post(api_url, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
-        if 'choices' in result and len(result['choices']) > 0:
-            return result['choices'][0]['message']['content'].strip()
-        else:
-            raise ValueError('API返回的数据格式不正确')
+        messages = [
+            {'role': 'system', 'content': '你是一个专业的播客内容编辑，请根据给定的内容生成一个简洁的播客内容大纲。'},
+            {'role': 'user', 'content': prompt}
+        ]
+        return llm_client.chat(messages, token).strip()
 
     prompt = f"请为以下内容生成一个简洁的播客内容大纲，包括3-5个主要点：\n\n{content}"
 
@@ -324,196 +323,272 @@ def generate_outline(content):
 
     return " "  # 这行代码实际上永远不会执行，因为上面的循环会处理所有情况
 
-def tts_request(text, anchor_type):
-    url = config.get_tts_url(text, anchor_type)
-    for _ in range(3):
-        try:
-            response = requests.get(url, timeout=120, headers=config.get_tts_headers())
-            response.raise_for_status()
-            return response.content
-        except requests.RequestException as e:
-            log(f"TTS请求失败: {str(e)}，正在重试...")
-    log("TTS请求失败3次，放弃尝试")
-    return None
-
-def generate_audio(dialogue, task_id):
+def segment_dialogue(dialogue):
+    # 把对话整理成 TTS 请求片段：超长的对话按句子切分，同一角色连续的短句合并为一次请求
+    for i, item in enumerate(dialogue):
+        if not isinstance(item, dict):  # 检查item是否为字典
+            log(f"第 {i+1} 条对话内容不是字典类型: {item}")
+    segments = tts_segment.plan_segments(
+        dialogue,
+        max_chars=getattr(config, 'tts_max_chars', 200),
+        min_chars=getattr(config, 'tts_min_chars', 12),
+        coalesce=getattr(config, 'tts_coalesce_short_turns', True),
+    )
+    log(f"对话共 {len(dialogue)} 条，整理为 {len(segments)} 个TTS请求片段")
+    return segments
+
+
+def generate_audio(segments, task_id, total_lines, token=None):
     log(f"开始为任务 {task_id} 生成音频")
-    audio_files = []
     temp_dir = task_id
-    status_file = config.get_task_file(temp_dir, 'status.json')
-    total_lines = len(dialogue)
-    
-    for i, item in enumerate(dialogue):
-        anchor_type = config.host_speaker if item['role'] == 'host' else config.guest_speaker
-        log(f"正在为第 {i+1} 条对话生成音频，角色: {anchor_type}")
+    task_manifest = manifest.writer(task_id)
+    failed = threading.Event()
+    reused = []
+
+    def synthesize(i, segment):
+        anchor_type = config.host_speaker if segment['role'] == 'host' else config.guest_speaker
+        # 每一段合成前检查任务是否已被取消，其他片段已失败时不再继续
+        if token:
+            token.check()
+        if failed.is_set():
+            return None
+        audio_file = config.get_task_file(temp_dir, f"{i:04d}_{segment['role']}.wav")
+        # 说话人与文本都没有变化的片段（修改对话后重新合成、任务重试）直接复用已合成的音频
+        if segment_cache.fetch(task_id, anchor_type, segment['content'], audio_file):
+            reused.append(i)
+            return audio_file
+        # 状态中仍按对话句数展示进度
+        line = segment['lines'][0] + 1
+        log(f"正在为第 {i+1}/{len(segments)} 段（第 {line} 条对话）生成音频，角色: {anchor_type}")
         
-        # 更新状态文件
-        status = {
-            "current_line": i + 1,
+        # 更新合成进度，写入频率由 manifest 限制
+        task_manifest.set_progress({
+            "current_line": line,
             "total_lines": total_lines,
-            "content": item['content']
-        }
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump(status, f, ensure_ascii=False, indent=4)
+            "content": segment['content']
+        })
         
-        audio_content = tts_request(item['content'], anchor_type)
+        audio_content = tts_client.tts_request(segment['content'], anchor_type, token)
         if audio_content is None:
-            log(f"第 {i+1} 条对话音频生成失败")
+            log(f"第 {i+1} 段（第 {line} 条对话）音频生成失败")
+            failed.set()
             return None
         
-        audio_file = config.get_task_file(temp_dir, f"{i:04d}_{item['role']}.wav")
-        with open(audio_file, 'wb') as f:
-            f.write(audio_content)
-        audio_files.append(audio_file)
-        log(f"第 {i+1} 条对话音频生成完成: {audio_file}")
+        segment_cache.write(audio_file, audio_content)
+        segment_cache.store(task_id, anchor_type, segment['content'], audio_file)
+        log(f"第 {i+1} 段音频生成完成: {audio_file}")
+        return audio_file
+
+    # 配置了多个TTS后端时可并发合成多段，片段文件按序号命名，合并顺序与完成顺序无关
+    workers = max(1, getattr(config, 'tts_parallel_requests', 1))
+    if workers == 1:
+        audio_files = []
+        for i, segment in enumerate(segments):
+            audio_file = synthesize(i, segment)
+            if audio_file is None:
+                return None
+            audio_files.append(audio_file)
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts') as executor:
+            futures = [executor.submit(contextvars.copy_context().run, synthesize, i, segment)
+                       for i, segment in enumerate(segments)]
+            try:
+                audio_files = [future.result() for future in futures]
+            except BaseException:
+                # 出错或取消时让尚未开始的片段直接跳过
+                failed.set()
+                raise
+        if None in audio_files:
+            return None
     
-    log(f"所有音频生成完成，共 {len(audio_files)} 个文件")
+    task_manifest.flush()
+    log(f"所有音频生成完成，共 {len(audio_files)} 个文件，其中 {len(reused)} 个复用已合成的片段")
+    tts_client.log_stats()
     return audio_files
 
 def update_task_status(task_id, status, progress):
     log(f"更新任务 {task_id} 状态: {status}, 进度: {progress}")
-    with open(config.task_list_file, 'r+') as f:
-        tasks = json.load(f)
-        for task in tasks:
-            if task['taskId'] == task_id:
-                task['status'] = status
-                task['progress'] = progress
-                task['updatedAt'] = datetime.now().isoformat()
-                break
-        f.seek(0)
-        json.dump(tasks, f, indent=4)
-        f.truncate()
+    with task_store.transaction() as txn:
+        task = txn.find(task_id)
+        # 已取消的任务不允许再被执行线程改写状态
+        if task and (task['status'] != 'cancelled' or status == 'cancelled'):
+            task['status'] = status
+            task['progress'] = progress
+            task['updatedAt'] = datetime.now().isoformat()
+            if status == 'processing' and not task.get('startedAt'):
+                # 开始执行的时间，api 据此估计执行中任务的剩余耗时
+                task['startedAt'] = task['updatedAt']
+            elif status == 'pending':
+                task.pop('startedAt', None)
+            if status in ('completed', 'failed'):
+                task.pop('resynthesize', None)
+            txn.changed = True
+    if not txn.changed:
+        log(f"任务 {task_id} 不存在或已取消，忽略状态更新")
+        return False
     log(f"任务 {task_id} 状态更新完成")
+    return True
 
-def generate_dialogue(text_content):
-    api_url = config.api_url
-    api_key = config.api_key
-    model = config.model
-    log("开始生成对话内容")
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_key}'
-    }
-    all_content = []
-
-    # 第一次 LLM 请求
-    if config.need_second_dialogue:
-        data = {
-            'model': model,
-            'messages': [
-                {'role': 'system', 'content': f'你是一个播客对话内容生成器,你需要将我给你的内容转换为自然的对话,主持人叫{config.host_speaker}。'+'对话以探讨交流形式,不要问答形式,正式对话开始前需要有引入主题的对话,需要欢迎大家收听本期播客,对话需要更口语化一点日常交流,你输出的内容不要结束对话,后面我还会补充更多对话,一定不能有任何结束性对话,直接结束就行,后面我还会补充内容。总内容字数需要大于10000字。在保证完整性的同时你还需要给我增加补充相关内容,一定要延伸补充,对话不是简单的一问一答,需要在每个发言中都抛出更多的观点和内容知识,需要补充更多的内容,不要使用提问形式使用交流探讨形式。以JSON格式输出,除了json内容不要输出任何提示性内容,直接json输出,不要提示性内容以及任何格式内容,严禁输出 ```json 此类格式性内容,直接输出json即可,格式严格参考 [{"role": "host", "content": "你好"}, {"role": "guest", "content": "你好"}]'},
-                {'role': 'user', 'content': f"请将以下内容转换成播客对话,对话内容content不要加身份前缀直接出对话内容即可,内容如下:\n{text_content}"}
-            ]
-        }
-        log("正在发送第一次请求到 LLM API")
-        response = requests.post(api_url, headers=headers, json=data)
-        if response.status_code == 200:
-            log("成功接收第一次 LLM API 响应")
-            result = response.json()
-            if 'choices' in result and len(result['choices']) > 0:
-                content = result['choices'][0]['message']['content']
-                log(f"API 返回的原始内容: {content}")
-                try:
-                    content = content.replace('```json', '').replace('```', '')
-                    dialogue = json.loads(content)
-                    all_content.extend(dialogue)
-                    log(f"成功解析第一次对话内容，共 {len(dialogue)} 条对话")
-                except json.JSONDecodeError as e:
-                    log(f"JSON 解析错误: {str(e)}")
-                    log("尝试修复 JSON 格式")
-                    fixed_content = content.replace("'", '"').replace('\n', '\\n')
-                    try:
-                        dialogue = json.loads(fixed_content)
-                        all_content.extend(dialogue)
-                        log(f"修复后成功解析对话内容，共 {len(dialogue)} 条对话")
-                    except json.JSONDecodeError as e:
-                        log(f"修复后仍然无法解析 JSON: {str(e)}")
-                        return []
-        else:
-            log(f"第一次生成对话内容失败，状态码: {response.status_code}")
-            return []
-
-        # 第二次 LLM 请求
-        data = {
-            'model': model,
-            'messages': [
-                {'role': 'system', 'content': '你是一位播客内容编辑,我会给你一些参考内容以及你之前生成的播客内容,在这些内容基础上补充对话内容,补充的内容不要跟前的内容产生冲突,并且你只需要输出补充的内容即可,对话需要更口语化一点日常交流,对话不能是简单的一问一答,需要是探讨交流形式,结束总结性需要有总结性对话,总内容字数需要大于10000字。保持内容的完整性,在保证完整性的同时你还需要给我增加补充相关内容,一定要延伸补充,对话不是简单的一问一答应该在每个发言中都抛出更多的观点和内容知识,你需要补充更多的内容,不要使用提问对话的形式,并以JSON格式输出。注意,输出json格式,除了json内容不要输出任何提示性内容,直接json输出,不要提示性内容以及任何格式内容,严禁输出 ```json 此类格式性内容,直接输出json即可,格式参考 [{"role": "host", "content": "你好"}, {"role": "guest", "content": "你好"}]'},
-                {'role': 'user', 'content': f"参考内容如下:\n{text_content}。\n你之前的生成的内容：{content}"}
-            ]
-        }
-        log("正在发送第二次请求到 LLM API")
-        response = requests.post(api_url, headers=headers, json=data)
-        if response.status_code == 200:
-            log("成功接收第二次 LLM API 响应")
-            result = response.json()
-            if 'choices' in result and len(result['choices']) > 0:
-                content = result['choices'][0]['message']['content'] or ""
-                log(f"API 返回的原始内容: {content}")
-                try:
-                    content = content.replace('```json', '').replace('```', '')
-                    dialogue = json.loads(content)
-                    all_content.extend(dialogue)
-                    log(f"成功解析第二次对话内容，共 {len(dialogue)} 条对话")
-                except json.JSONDecodeError as e:
-                    log(f"JSON 解析错误: {str(e)}")
-                    log("尝试修复 JSON 格式")
-                    fixed_content = content.replace("'", '"').replace('\n', '\\n')
-                    try:
-                        dialogue = json.loads(fixed_content)
-                        all_content.extend(dialogue)
-                        log(f"修复后成功解析对话内容，共 {len(dialogue)} 条对话")
-                    except json.JSONDecodeError as e:
-                        log(f"修复后仍然无法解析 JSON: {str(e)}")
-        else:
-            log(f"第二次生成对话内容失败，状态码: {response.status_code}")
+def parse_dialogue(content):
+    # 解析 LLM 返回的对话 JSON，解析失败时尝试修复格式，仍然失败返回 None
+    content = content.replace('```json', '').replace('```', '').strip()
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError as e:
+        log(f"JSON 解析错误: {str(e)}")
+        log("尝试修复 JSON 格式")
+        fixed_content = content.replace("'", '"').replace('\n', '\\n')
+        try:
+            dialogue = json.loads(fixed_content)
+            log(f"修复后成功解析对话内容，共 {len(dialogue)} 条对话")
+            return dialogue
+        except json.JSONDecodeError as e:
+            log(f"修复后仍然无法解析 JSON: {str(e)}")
+            return None
 
+def request_dialogue(messages, name, token=None):
+    # 返回 (对话列表, 原始内容)，请求或解析失败时对话列表为 None
+    log(f"正在发送{name}请求到 LLM API")
+    try:
+        content = llm_client.chat(messages, token)
+    except llm_client.LLMError as e:
+        log(f"{name}生成对话内容失败: {str(e)}")
+        return None, ''
+    log(f"成功接收{name} LLM API 响应")
+    if logger.isEnabledFor(logging.DEBUG):
+        # 原始内容可能很长，未开启 DEBUG 时不格式化
+        log(f"API 返回的原始内容: {content}", logging.DEBUG)
+    dialogue = parse_dialogue(content)
+    if dialogue is not None:
+        log(f"成功解析{name}对话内容，共 {len(dialogue)} 条对话")
+    return dialogue, content
+
+def generate_first_dialogue(text_content, token=None):
+    # 第一次 LLM 请求，返回 (对话列表, 原始内容)
+    messages = [
+        {'role': 'system', 'content': f'你是一个播客对话内容生成器,你需要将我给你的内容转换为自然的对话,主持人叫{config.host_speaker}。'+'对话以探讨交流形式,不要问答形式,正式对话开始前需要有引入主题的对话,需要欢迎大家收听本期播客,对话需要更口语化一点日常交流,你输出的内容不要结束对话,后面我还会补充更多对话,一定不能有任何结束性对话,直接结束就行,后面我还会补充内容。总内容字数需要大于10000字。在保证完整性的同时你还需要给我增加补充相关内容,一定要延伸补充,对话不是简单的一问一答,需要在每个发言中都抛出更多的观点和内容知识,需要补充更多的内容,不要使用提问形式使用交流探讨形式。以JSON格式输出,除了json内容不要输出任何提示性内容,直接json输出,不要提示性内容以及任何格式内容,严禁输出 ```json 此类格式性内容,直接输出json即可,格式严格参考 [{"role": "host", "content": "你好"}, {"role": "guest", "content": "你好"}]'},
+        {'role': 'user', 'content': f"请将以下内容转换成播客对话,对话内容content不要加身份前缀直接出对话内容即可,内容如下:\n{text_content}"}
+    ]
+    dialogue, content = request_dialogue(messages, '第一次', token)
+    return dialogue or [], content
+
+def generate_second_dialogue(text_content, content, token=None):
+    # 第二次 LLM 请求，补充总结性对话，content 为第一次生成的原始内容
+    messages = [
+        {'role': 'system', 'content': '你是一位播客内容编辑,我会给你一些参考内容以及你之前生成的播客内容,在这些内容基础上补充对话内容,补充的内容不要跟前的内容产生冲突,并且你只需要输出补充的内容即可,对话需要更口语化一点日常交流,对话不能是简单的一问一答,需要是探讨交流形式,结束总结性需要有总结性对话,总内容字数需要大于10000字。保持内容的完整性,在保证完整性的同时你还需要给我增加补充相关内容,一定要延伸补充,对话不是简单的一问一答应该在每个发言中都抛出更多的观点和内容知识,你需要补充更多的内容,不要使用提问对话的形式,并以JSON格式输出。注意,输出json格式,除了json内容不要输出任何提示性内容,直接json输出,不要提示性内容以及任何格式内容,严禁输出 ```json 此类格式性内容,直接输出json即可,格式参考 [{"role": "host", "content": "你好"}, {"role": "guest", "content": "你好"}]'},
+        {'role': 'user', 'content': f"参考内容如下:\n{text_content}。\n你之前的生成的内容：{content}"}
+    ]
+    dialogue, _ = request_dialogue(messages, '第二次', token)
+    return dialogue or []
+
+def combine_dialogue(*parts):
+    all_content = [item for part in parts for item in part]
     log(f"总共生成对话内容 {len(all_content)} 条")
     if config.truncate_dialogue_count > 0:
         log(f"截取前 {config.truncate_dialogue_count} 条")
         all_content = all_content[:config.truncate_dialogue_count]
     return all_content
 
+def generate_dialogue(text_content, token=None):
+    log("开始生成对话内容")
+    first, content = generate_first_dialogue(text_content, token)
+    if not first:
+        return []
+    second = generate_second_dialogue(text_content, content, token) if config.need_second_dialogue else []
+    return combine_dialogue(first, second)
+
+def post_process_audio_files(audio_files, output_file, peaks_file, token=None):
+    # 在进程池中合并，波形峰值直接写入任务目录；返回时长与各片段起始时间，未处理时返回 None
+    if audio_post is None or not getattr(config, 'audio_post_process', False):
+        return None
+    # 片段文件名格式为 {序号}_{角色}.wav，角色用于决定轮次间停顿
+    roles = [os.path.splitext(os.path.basename(f))[0].split('_', 1)[-1] for f in audio_files]
+    try:
+        # 先写入临时文件，任务在合并期间被取消时子进程的结果不会覆盖原有音频
+        result = cpu_pool.run(audio_post.merge_to_files, audio_files, cpu_pool.staged(output_file),
+                              cpu_pool.staged(peaks_file), roles, getattr(config, 'audio_post_options', None),
+                              token=token, outputs=[output_file, peaks_file])
+    except audio_post.UnsupportedAudio as e:
+        log(f"音频片段不支持后处理，回退到 ffmpeg 拼接: {e}")
+        return None
+    log(f"音频后处理完成，共处理 {len(audio_files)} 个片段")
+    return result
+
+def segment_starts(audio_files):
+    # ffmpeg 直接拼接时各片段首尾相接，按 wav 头中的时长累加得到起始时间，无法读取时返回 None
+    starts = []
+    position = 0
+    for audio_file in audio_files:
+        duration = manifest.wav_duration(audio_file)
+        if duration is None:
+            return None
+        starts.append(round(position, 3))
+        position += duration
+    return starts
 
-def merge_audio_files(audio_files, task_id):
+def merge_audio_files(audio_files, task_id, token=None):
+    # 返回各片段在合并音频中的起始时间（秒），无法得到时返回 None
     log(f"开始合并任务 {task_id} 的音频文件")
     temp_dir = task_id
     output_file = config.get_task_file(temp_dir, f"{task_id}.wav")
+    peaks_file = config.get_task_file(task_id, manifest.PEAKS_FILE)
+    # 合并结果原地写入，内容去重复用的任务重新合成时，先断开与被复用任务共享的文件
+    dedup.detach([output_file, peaks_file] + [config.get_task_file(task_id, f"{task_id}.{ext}") for ext in delivery.FORMATS])
     
+    # 优先由 audio_post 完成后处理与合并（波形峰值在同一遍中得到，无需再解码），不满足条件时回退到 ffmpeg 直接拼接
+    result = post_process_audio_files(audio_files, output_file, peaks_file, token)
+    if result:
+        if config.delete_original_audio:
+            for audio_file in audio_files:
+                os.remove(audio_file)
+        try:
+            count = delivery.encode_renditions(output_file, task_id, token)
+            log(f"已生成 {count} 种压缩格式音频")
+        except ffmpeg.Error as e:
+            log(f"生成压缩格式音频时出错: {e}")
+        log(f"音频文件合并完成，输出文件为 {output_file}")
+        return result['starts']
+    
+    starts = segment_starts(audio_files)
     # 创建一个临时文件记录音频文件列表
-    temp_file_name = '.temp_file_list.txt'
+    temp_file_name = config.get_task_file(temp_dir, '.temp_file_list.txt')
     with open(temp_file_name, 'w') as f:
         for audio_file in audio_files:
             f.write(f"file '{audio_file}'\n")
     try:
-        ffmpeg.input(temp_file_name, format='concat', safe=0).output(output_file).overwrite_output().run()
-        print(f"音频文件合并完成，输出文件：{output_file}")
+        # 同一条 ffmpeg 命令同时输出 wav 和配置的压缩格式，只解码一次
+        stream = ffmpeg.input(temp_file_name, format='concat', safe=0).audio
+        outputs = [stream.output(delivery.temp_file(output_file), format='wav')] + delivery.rendition_outputs(stream, task_id)
+        delivery.run_ffmpeg(ffmpeg.merge_outputs(*outputs), token, [output_file] + delivery.rendition_files(task_id))
+        log(f"音频文件合并完成，输出文件：{output_file}")
     except ffmpeg.Error as e:
-        print(f"合并音频文件时出错: {e}")
+        log(f"合并音频文件时出错: {e}", logging.ERROR)
     finally:
         os.remove(temp_file_name)
-        if config.delete_original_audio:
+        if config.delete_original_audio and not (token and token.is_cancelled()):
             for audio_file in audio_files:
                 os.remove(audio_file)
         
     log(f"音频文件合并完成，输出文件为 {output_file}")
+    return starts
+
+def start_task(task):
+    # 占用一个执行槽位并启动任务线程，没有空闲槽位或任务已在执行时返回 False
+    token = slots.acquire(task['taskId'])
+    if token is None:
+        return False
+    threading.Thread(target=execute_task, args=(task, token)).start()
+    return True
 
 def check_and_execute_incomplete_tasks():
     log("检查未完成的任务")
     try:
-        with open(config.task_list_file, 'r') as f:
-            tasks = json.load(f)
-        
-        incomplete_tasks = [task for task in tasks if task['status'] not in ['completed', 'failed']]
-        
-        if incomplete_tasks:
-            log(f"发现 {len(incomplete_tasks)} 个未完成的任务")
-            for task in incomplete_tasks:
-                log(f"重新执行任务: {task['taskId']}")
-                threading.Thread(target=execute_task, args=(task,)).start()
+        # 服务重启前执行中的任务放回等待队列，计入重试次数但不延后，由 check_new_tasks 按槽位依次执行
+        count = task_watchdog.reclaim_orphans(backoff=False)
+        if count:
+            log(f"发现 {count} 个未完成的任务，已放回等待队列")
         else:
             log("没有发现未完成的任务")
-    except FileNotFoundError:
-        log(f"{config.task_list_file} 文件不存在")
     except json.JSONDecodeError:
         log(f"{config.task_list_file} 文件格式错误")
     except Exception as e:
@@ -523,20 +598,34 @@ def check_new_tasks():
     log("开始检查新任务")
     while True:
         try:
-            with open(config.task_list_file, 'r') as f:
-                tasks = json.load(f)
+            tasks = task_store.read_tasks(strict=True)
             
             for task in tasks:
-                if task['status'] == 'pending':
+                if task['status'] == 'pending' and not slots.is_running(task['taskId']):
+                    if not task_watchdog.ready(task):
+                        continue  # 等待退避时间结束后再重试
+                    if not start_task(task):
+                        break  # 槽位已满，剩余任务保持等待状态
                     log(f"发现新任务: {task['taskId']}")
-                    threading.Thread(target=execute_task, args=(task,)).start()
             
             time.sleep(2)
         except Exception as e:
             log(f"检查新任务时发生错误: {e}")
             time.sleep(5)  # 如果发生错误，等待一段时间后重试
 
+def requeue_unpublished_tasks():
+    # 服务重启前还未完成发布的任务重新加入发布队列
+    for task in task_store.read_tasks():
+        if task['status'] == 'completed' and task.get('publishStatus') in ['queued', 'publishing', 'retrying']:
+            log(f"重新发布任务: {task['taskId']}")
+            publish_queue.enqueue(PublishJob(task['taskId']))
+
 if __name__ == '__main__':
     log("启动任务处理服务器...")
+    storage.start_compactor(slots.is_running)  # 后台按保留策略、归档与容量上限整理任务产物
+    publish_queue = create_publish_queue(generate_outline)
+    publish_queue.start()
+    requeue_unpublished_tasks()
     check_and_execute_incomplete_tasks()  # 在启动时检查并执行未完成的任务
+    task_watchdog.start()  # 回收卡住或执行线程已退出的任务
     check_new_tasks()  # 继续检查新任务
\ No newline at end of file
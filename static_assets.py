@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：静态资源内存缓存，启动时加载页面与 resources 目录，预压缩 gzip/brotli，提供 ETag 与缓存头；
+#           其他进程生成的文件（订阅源）在变化后重新加载，额外提供 Last-Modified
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只提供 gzip
+    brotli = None
+
+# 值得压缩的媒体类型，图片等已压缩格式直接返回原文件
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/rss+xml', 'image/svg+xml')
+# 带指纹的资源内容不会变化，可以让浏览器永久缓存
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# 页面及不带指纹的资源每次都需要用 ETag 协商
+REVALIDATE_CACHE = 'no-cache'
+
+
+class StaticAsset:
+    def __init__(self, body, media_type, cache_control):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha1(body).hexdigest()
+        self.variants = {'identity': body}
+        if media_type.startswith(COMPRESSIBLE_TYPES):
+            self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli:
+                self.variants['br'] = brotli.compress(body, quality=11)
+        # 压缩后没有变小的变体不返回
+        self.variants = {k: v for k, v in self.variants.items() if k == 'identity' or len(v) < len(body)}
+
+    def etag(self, encoding):
+        suffix = '' if encoding == 'identity' else f"-{encoding}"
+        return f'"{self.digest[:16]}{suffix}"'
+
+    def not_modified(self, if_none_match):
+        # 不同编码的 ETag 共用同一内容摘要，比较时忽略编码后缀
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag.strip('"').split('-')[0] == self.digest[:16]:
+                return True
+        return False
+
+
+def accepted_encodings(accept_encoding):
+    encodings = set()
+    for part in (accept_encoding or '').split(','):
+        fields = [f.strip() for f in part.split(';')]
+        if fields[0] and not any(f in ('q=0', 'q=0.0') for f in fields[1:]):
+            encodings.add(fields[0].lower())
+    return encodings
+
+
+class StaticAssets:
+    """
+    pages: 路由 -> 页面文件，例如 {"/": "index.html"}
+    resource_dir: 资源目录，通过 /resources/<路径> 访问，同时提供带内容指纹的地址 /resources/<名称>.<指纹>.<扩展名>
+    """
+
+    def __init__(self, pages, resource_dir='resources', prefix='/resources'):
+        self.pages = pages
+        self.resource_dir = resource_dir
+        self.prefix = prefix
+        self.assets = {}
+        self.fingerprinted = {}
+
+    def load(self):
+        assets = {}
+        fingerprinted = {}
+        for root, _, files in os.walk(self.resource_dir):
+            for name in files:
+                full_path = os.path.join(root, name)
+                rel = os.path.relpath(full_path, self.resource_dir).replace(os.sep, '/')
+                with open(full_path, 'rb') as f:
+                    body = f.read()
+                media_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                assets[f"{self.prefix}/{rel}"] = StaticAsset(body, media_type, REVALIDATE_CACHE)
+                base, ext = os.path.splitext(rel)
+                fingerprint_url = f"{self.prefix}/{base}.{hashlib.sha1(body).hexdigest()[:10]}{ext}"
+                assets[fingerprint_url] = StaticAsset(body, media_type, IMMUTABLE_CACHE)
+                fingerprinted[f"{self.prefix}/{rel}"] = fingerprint_url
+
+        for route, page_file in self.pages.items():
+            with open(page_file, 'r', encoding='utf-8') as f:
+                html = f.read()
+            # 页面中引用的资源替换为带指纹的地址，资源更新后指纹变化，浏览器自然取到新文件
+            for url, fingerprint_url in fingerprinted.items():
+                html = re.sub(r'(?<=["\'(])' + re.escape(url) + r'(?=["\')?#])', fingerprint_url, html)
+            assets[route] = StaticAsset(html.encode('utf-8'), 'text/html; charset=utf-8', REVALIDATE_CACHE)
+
+        self.assets = assets
+        self.fingerprinted = fingerprinted
+        return len(assets)
+
+    def response(self, path, request: Request):
+        asset = self.assets.get(path)
+        if asset is None:
+            return None
+        accepted = accepted_encodings(request.headers.get('accept-encoding'))
+        encoding = next((e for e in ('br', 'gzip') if e in accepted and e in asset.variants), 'identity')
+        headers = {
+            'ETag': asset.etag(encoding),
+            'Cache-Control': asset.cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if asset.not_modified(request.headers.get('if-none-match')):
+            return Response(status_code=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(content=asset.variants[encoding], media_type=asset.media_type, headers=headers)
+
+
+class FileAsset:
+    """
+    由其他进程生成并原子替换的文件，例如订阅源 feed.xml。
+    refresh() 只 stat 一次，文件变化时才重新读取与压缩；prepare 在第一次加载前调用，用于生成缺失的文件
+    """
+
+    def __init__(self, path, media_type, prepare=None, cache_control=REVALIDATE_CACHE):
+        self.path = path
+        self.media_type = media_type
+        self.prepare = prepare
+        self.cache_control = cache_control
+        self.asset = None
+        self.mtime = None
+        self._key = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        # 文件读写较慢，需在线程池中调用
+        with self._lock:
+            if self._key is None and self.prepare:
+                self.prepare()
+            stat = os.stat(self.path)
+            key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if key != self._key:
+                with open(self.path, 'rb') as f:
+                    self.asset = StaticAsset(f.read(), self.media_type, self.cache_control)
+                self.mtime = int(stat.st_mtime)
+                self._key = key
+
+    def not_modified(self, request: Request):
+        # 有 If-None-Match 时只比较 ETag，否则比较 If-Modified-Since
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match:
+            return self.asset.not_modified(if_none_match)
+        if_modified_since = request.headers.get('if-modified-since')
+        if not if_modified_since:
+            return False
+        try:
+            return self.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    def response(self, request: Request):
+        accepted = accepted_encodings(request.headers.get('accept-encoding'))
+        encoding = next((e for e in ('br', 'gzip') if e in accepted and e in self.asset.variants), 'identity')
+        headers = {
+            'ETag': self.asset.etag(encoding),
+            'Last-Modified': formatdate(self.mtime, usegmt=True),
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if self.not_modified(request):
+            return Response(status_code=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(content=self.asset.variants[encoding], media_type=self.media_type, headers=headers)
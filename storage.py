@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：任务产物生命周期管理：按产物类型的保留策略、冷数据归档（wav 无损压缩为 flac，文本 gzip，访问时自动还原）、
+#           output 总容量上限下按最近访问时间清理；由任务服务器中的后台线程定期执行，也可通过命令行手动执行
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import ffmpeg
+
+import config
+import delivery
+import logs
+import task_store
+
+log = logs.get_log('storage')
+
+OUTPUT_DIR = 'output'
+# 记录最近访问时间的标记文件
+ACCESS_MARKER = '.accessed'
+SEGMENT_FILE = re.compile(r'^\d{4}_\w+\.wav$')
+# TTS 片段缓存目录（segment_cache.CACHE_DIR）
+TTS_CACHE_DIR = 'tts_cache'
+# 归档时 gzip 压缩的文本文件
+TEXT_FILES = ('content.txt', 'dialogue.json')
+# 同一任务在进程内最多每隔多少秒更新一次访问时间
+TOUCH_INTERVAL = 600
+
+_touched = {}
+_restore_lock = threading.Lock()
+
+
+def task_dir(task_id):
+    # 与 config.get_task_file 的目录规则相同，但不创建目录，任务目录不存在时返回 None；
+    # 按请求中的 taskId 查找时使用，避免为不存在的任务创建目录
+    for path in (os.path.join(OUTPUT_DIR, task_id), os.path.join(OUTPUT_DIR, task_id[:2], task_id)):
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def wav_file(task_id):
+    return config.get_task_file(task_id, f"{task_id}.wav")
+
+
+def flac_file(task_id):
+    return config.get_task_file(task_id, f"{task_id}.flac")
+
+
+def has_audio(task_id):
+    # 合并后的音频存在（包括已归档为 flac 的情况）
+    return os.path.exists(wav_file(task_id)) or os.path.exists(flac_file(task_id))
+
+
+def read_text(path):
+    # 读取文本文件，已归档为 .gz 时透明解压，都不存在返回 None
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    if os.path.exists(path + '.gz'):
+        with gzip.open(path + '.gz', 'rt', encoding='utf-8') as f:
+            return f.read()
+    return None
+
+
+def ensure_wav(task_id):
+    # 已归档的音频在访问时还原为 wav，任务重新变为热数据；返回 wav 路径，没有音频时返回 None
+    wav = wav_file(task_id)
+    flac = flac_file(task_id)
+    with _restore_lock:
+        if os.path.exists(wav):
+            return wav
+        if not os.path.exists(flac):
+            return None
+        log(f"正在还原已归档的音频: {flac}", taskId=task_id)
+        temp = wav + '.tmp'
+        try:
+            ffmpeg.input(flac).output(temp, format='wav').overwrite_output().run(quiet=True)
+            os.replace(temp, wav)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        os.remove(flac)
+        refresh_manifest(task_id)
+    touch(task_id)
+    return wav
+
+
+def touch(task_id):
+    # 记录任务最近一次被访问（播放、下载）的时间，用于冷数据判断与容量清理
+    now = time.time()
+    if now - _touched.get(task_id, 0) < TOUCH_INTERVAL:
+        return
+    directory = task_dir(task_id)
+    if directory is None:
+        return
+    _touched[task_id] = now
+    marker = os.path.join(directory, ACCESS_MARKER)
+    with open(marker, 'a'):
+        pass
+    os.utime(marker, (now, now))
+
+
+def parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def finished_at(task):
+    finished = parse_time(task.get('updatedAt'))
+    if finished is None:
+        directory = task_dir(task['taskId'])
+        finished = os.path.getmtime(directory) if directory else 0
+    return finished
+
+
+def last_access(task):
+    directory = task_dir(task['taskId'])
+    marker = os.path.join(directory, ACCESS_MARKER) if directory else None
+    if marker and os.path.exists(marker):
+        return max(os.path.getmtime(marker), finished_at(task))
+    return finished_at(task)
+
+
+def artifact_kind(task_id, name):
+    if name == 'old.html':
+        return 'old.html'
+    if name == 'status.json':
+        return 'status.json'
+    if SEGMENT_FILE.match(name):
+        return 'segments'
+    if name.startswith(f"{task_id}.") and name[len(task_id) + 1:] in delivery.FORMATS:
+        return 'renditions'
+    return None
+
+
+def remove_files(task_id, kinds):
+    # 删除指定类型的产物，返回释放的字节数
+    task_dir = config.get_task_file(task_id)
+    freed = 0
+    for entry in os.scandir(task_dir):
+        if entry.is_file() and artifact_kind(task_id, entry.name) in kinds:
+            freed += entry.stat().st_size
+            os.remove(entry.path)
+        elif entry.is_dir() and entry.name == TTS_CACHE_DIR and 'tts_cache' in kinds:
+            # TTS 片段缓存删除后，修改对话重新合成时需要重新合成全部片段
+            freed += dir_size(entry.path)
+            shutil.rmtree(entry.path)
+    return freed
+
+
+def refresh_manifest(task_id):
+    # manifest 与订阅源依赖本模块，这里延迟导入避免循环导入
+    import feed
+    import manifest
+    manifest.refresh_artifacts(task_id)
+    feed.refresh_episode(task_id)
+
+
+def is_archived(task_id):
+    return not os.path.exists(wav_file(task_id)) and os.path.exists(flac_file(task_id))
+
+
+def archive(task_id):
+    # wav 无损压缩为 flac，文本文件 gzip 压缩，返回释放的字节数
+    freed = 0
+    wav = wav_file(task_id)
+    if os.path.exists(wav):
+        flac = flac_file(task_id)
+        temp = flac + '.tmp'
+        try:
+            ffmpeg.input(wav).output(temp, format='flac').overwrite_output().run(quiet=True)
+            os.replace(temp, flac)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        freed += os.path.getsize(wav) - os.path.getsize(flac)
+        os.remove(wav)
+    for name in TEXT_FILES:
+        path = config.get_task_file(task_id, name)
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            freed += size - os.path.getsize(path + '.gz')
+            os.remove(path)
+    log(f"任务 {task_id} 已归档，释放 {freed} 字节", taskId=task_id)
+    return freed
+
+
+def dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            total += dir_size(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            total += entry.stat().st_size
+    return total
+
+
+def usage():
+    return dir_size(OUTPUT_DIR) if os.path.isdir(OUTPUT_DIR) else 0
+
+
+class Compactor:
+    """
+    整理已结束的任务（完成、失败、已取消，且不在执行中）：
+      1. 按 storage_retention_days 删除过期的产物
+      2. 超过 storage_archive_days 未访问的已完成任务归档
+      3. 总大小超过 storage_quota_bytes 时，按最近访问时间从旧到新依次删除可再生的产物、归档、删除压缩格式音频
+    合并后的音频（wav 或 flac）与对话、标题始终保留
+    """
+
+    QUOTA_STEPS = (
+        ('retention', ('old.html', 'segments', 'status.json', 'tts_cache')),
+        ('archive', None),
+        ('renditions', ('renditions',)),
+    )
+
+    def __init__(self, is_running=None, dry_run=False):
+        self.is_running = is_running or (lambda task_id: False)
+        self.dry_run = dry_run
+        self.retention_days = getattr(config, 'storage_retention_days', None) or {}
+        self.archive_days = getattr(config, 'storage_archive_days', 0)
+        self.quota = getattr(config, 'storage_quota_bytes', 0)
+        # 产物有变化的任务，整理结束后更新其 manifest
+        self.touched = set()
+
+    def idle_tasks(self):
+        # 没有任务目录的任务（例如失败前还没有生成任何文件）无需整理
+        return [t for t in task_store.read_tasks()
+                if t.get('status') in ('completed', 'failed', 'cancelled') and not self.is_running(t['taskId'])
+                and task_dir(t['taskId'])]
+
+    def _remove(self, task_id, kinds):
+        if self.dry_run:
+            log(f"[dry-run] 将删除任务 {task_id} 的 {', '.join(kinds)}")
+            return 0
+        freed = remove_files(task_id, kinds)
+        if freed:
+            self.touched.add(task_id)
+        return freed
+
+    def _archive(self, task_id):
+        if self.dry_run:
+            log(f"[dry-run] 将归档任务 {task_id}")
+            return 0
+        self.touched.add(task_id)
+        try:
+            return archive(task_id)
+        except (ffmpeg.Error, OSError) as e:
+            # 单个任务归档失败不影响其他任务
+            log(f"任务 {task_id} 归档失败: {str(e)}", logging.ERROR, taskId=task_id)
+            return 0
+
+    def run_once(self):
+        now = time.time()
+        freed = 0
+        tasks = self.idle_tasks()
+        for task in tasks:
+            task_id = task['taskId']
+            age_days = (now - finished_at(task)) / 86400
+            expired = [kind for kind, days in self.retention_days.items() if days and age_days >= days]
+            if expired:
+                freed += self._remove(task_id, expired)
+            idle_days = (now - last_access(task)) / 86400
+            if (self.archive_days and idle_days >= self.archive_days and task['status'] == 'completed'
+                    and not is_archived(task_id)):
+                freed += self._archive(task_id)
+        if self.quota:
+            freed += self.enforce_quota(tasks)
+        if not self.dry_run:
+            for task_id in self.touched:
+                refresh_manifest(task_id)
+            self.touched.clear()
+        if freed:
+            log(f"存储整理完成，共释放 {freed} 字节")
+        return freed
+
+    def enforce_quota(self, tasks):
+        total = usage()
+        if total <= self.quota:
+            return 0
+        log(f"output 目录 {total} 字节超出上限 {self.quota} 字节，开始按最近访问时间清理", logging.WARNING)
+        freed = 0
+        ordered = sorted(tasks, key=last_access)
+        for step, kinds in self.QUOTA_STEPS:
+            for task in ordered:
+                if total - freed <= self.quota:
+                    return freed
+                task_id = task['taskId']
+                if step == 'archive':
+                    if task['status'] == 'completed' and not is_archived(task_id):
+                        freed += self._archive(task_id)
+                else:
+                    freed += self._remove(task_id, kinds)
+        if total - freed > self.quota:
+            log(f"清理后 output 目录仍超出上限 {total - freed - self.quota} 字节", logging.WARNING)
+        return freed
+
+    def run_forever(self, interval):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                log(f"存储整理失败: {str(e)}", logging.ERROR)
+            time.sleep(interval)
+
+
+def start_compactor(is_running=None):
+    # 在任务服务器中以低频后台线程运行，不影响 api 服务
+    interval = getattr(config, 'storage_compact_interval', 3600)
+    if interval <= 0:
+        return None
+    thread = threading.Thread(target=Compactor(is_running).run_forever, args=(interval,), name='storage-compactor', daemon=True)
+    thread.start()
+    log(f"存储整理线程已启动，间隔 {interval} 秒")
+    return thread
+
+
+def migrate():
+    # 把旧版本 output/<taskId>/ 目录移动到按任务ID前两位分片的目录下，执行前请先停止 api 与任务服务器
+    moved = 0
+    for entry in os.scandir(OUTPUT_DIR):
+        if entry.is_dir() and len(entry.name) > 2:
+            target = os.path.join(OUTPUT_DIR, entry.name[:2], entry.name)
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(entry.path, target)
+            moved += 1
+    log(f"已迁移 {moved} 个任务目录")
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='任务产物生命周期管理')
+    sub = parser.add_subparsers(dest='command', required=True)
+    compact = sub.add_parser('compact', help='按保留策略、归档与容量上限整理一次')
+    compact.add_argument('--dry-run', action='store_true', help='只输出将执行的操作')
+    sub.add_parser('usage', help='输出 output 目录占用')
+    sub.add_parser('migrate', help='把旧的 output/<taskId>/ 目录迁移为分片目录')
+    args = parser.parse_args()
+    if args.command == 'compact':
+        Compactor(dry_run=args.dry_run).run_once()
+    elif args.command == 'usage':
+        print(json.dumps({'bytes': usage(), 'quota': getattr(config, 'storage_quota_bytes', 0)}))
+    elif args.command == 'migrate':
+        migrate()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：任务取消与并发槽位控制
+import json
+import socket
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import task_store
+
+
+class TaskCancelled(BaseException):
+    # 继承 BaseException 而不是 Exception，避免被各处 `except Exception` 吞掉（与 asyncio.CancelledError 一致）
+    def __init__(self, task_id, reason='任务已取消'):
+        super().__init__(f"{task_id}: {reason}")
+        self.task_id = task_id
+        self.reason = reason
+
+
+def read_task(task_id):
+    # 读取任务列表中的单个任务，文件损坏等异常情况返回 ...（Ellipsis），表示状态未知
+    try:
+        tasks = task_store.read_tasks(strict=True)
+    except (json.JSONDecodeError, OSError):
+        return ...
+    return task_store.find_task(tasks, task_id)
+
+
+class AbortableAdapter(HTTPAdapter):
+    """
+    记录请求正在使用的连接。Session.close() 只关闭连接池中空闲的连接，
+    取消时需要直接关闭进行中连接的 socket，阻塞在发送或读取响应上的请求线程才会立即出错退出，服务端也会看到连接断开
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._connections = []
+        self._conn_lock = threading.Lock()
+        self.aborted = False
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        track = self._track
+
+        def tracked(base):
+            class Pool(base):
+                def _get_conn(self, timeout=None):
+                    conn = super()._get_conn(timeout)
+                    track(conn)
+                    return conn
+            return Pool
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: tracked(cls) for scheme, cls in self.poolmanager.pool_classes_by_scheme.items()}
+
+    def _track(self, conn):
+        with self._conn_lock:
+            self._connections.append(conn)
+
+    def abort(self):
+        # 尚未建立的连接没有 socket，最多等到连接超时
+        self.aborted = True
+        with self._conn_lock:
+            connections = list(self._connections)
+        for conn in connections:
+            sock = getattr(conn, 'sock', None)
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class AbortableSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.adapter = AbortableAdapter()
+        self.mount('http://', self.adapter)
+        self.mount('https://', self.adapter)
+
+    def abort(self):
+        self.adapter.abort()
+        self.close()
+
+
+class CancelToken:
+    """单个任务的取消令牌：在阶段之间、TTS 每一行之间以及 HTTP 请求进行中检查任务是否已被取消或删除"""
+
+    def __init__(self, task_id, poll_interval=1.0):
+        self.task_id = task_id
+        self.poll_interval = poll_interval
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self._last_poll = 0
+        # 最近一次检查取消状态的时间与正在执行的阶段，看门狗据此判断任务是否卡住
+        self.heartbeat = time.monotonic()
+        self._stages = {}
+        # 被看门狗回收后置为 True，任务可能已重新开始执行，原执行线程退出时不再清理文件
+        self.reclaimed = False
+        # 由 abort() 中止时为 True，resume() 后恢复
+        self._aborted = False
+
+    def cancel(self, reason='任务已取消'):
+        with self._lock:
+            if self.reason is None or self._aborted:
+                self.reason = reason
+                self._aborted = False
+            self._event.set()
+            sessions = list(self._sessions)
+        self._abort_sessions(sessions)
+
+    def abort(self, reason='其他阶段失败，中止执行'):
+        """
+        任务的某个阶段失败时调用，让同时运行的其他阶段在下一次检查时退出，进行中的请求同样被中断。
+        与 cancel() 不同，阶段全部结束后 resume() 恢复令牌，任务随后仍可更新为失败状态
+        """
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            self._aborted = True
+            self._event.set()
+            sessions = list(self._sessions)
+        self._abort_sessions(sessions)
+
+    def resume(self):
+        # 只恢复 abort() 造成的中止，期间任务被取消或删除时保持取消状态
+        with self._lock:
+            if self._aborted:
+                self._aborted = False
+                self.reason = None
+                self._event.clear()
+
+    @staticmethod
+    def _abort_sessions(sessions):
+        # 关闭进行中请求的连接，让阻塞的请求线程尽快退出
+        for session in sessions:
+            try:
+                session.abort()
+            except Exception:
+                pass
+
+    @property
+    def cancelled(self):
+        # 只查看是否已取消，不读取任务列表，也不更新心跳
+        return self._event.is_set()
+
+    @property
+    def deleted(self):
+        return self.reason == '任务已删除'
+
+    def enter_stage(self, stage):
+        with self._lock:
+            self._stages[stage] = time.monotonic()
+        self.heartbeat = time.monotonic()
+
+    def leave_stage(self, stage):
+        with self._lock:
+            self._stages.pop(stage, None)
+
+    def stages(self):
+        # 正在执行的阶段及其开始时间
+        with self._lock:
+            return dict(self._stages)
+
+    def is_cancelled(self):
+        self.heartbeat = time.monotonic()
+        if self._event.is_set():
+            return True
+        now = time.time()
+        if now - self._last_poll < self.poll_interval:
+            return False
+        self._last_poll = now
+        task = read_task(self.task_id)
+        if task is None:
+            self.cancel('任务已删除')
+        elif task is not ... and task.get('status') == 'cancelled':
+            self.cancel('任务已取消')
+        return self._event.is_set()
+
+    def check(self):
+        if self.is_cancelled():
+            raise TaskCancelled(self.task_id, self.reason)
+
+    def sleep(self, seconds):
+        # 可被取消打断的 sleep
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            self.check()
+            self._event.wait(min(0.5, max(0, deadline - time.time())))
+        self.check()
+
+    def request(self, method, url, **kwargs):
+        # 在后台线程中发起请求，当前线程等待结果并持续检查取消状态；取消时关闭连接的 socket 并立即返回
+        self.check()
+        session = AbortableSession()
+        with self._lock:
+            self._sessions.add(session)
+        done = threading.Event()
+        outcome = {}
+
+        def run():
+            try:
+                outcome['response'] = session.request(method, url, **kwargs)
+            except BaseException as e:
+                outcome['error'] = e
+            finally:
+                done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while not done.wait(0.2):
+                if self.is_cancelled():
+                    raise TaskCancelled(self.task_id, self.reason)
+            self.check()
+            if 'error' in outcome:
+                raise outcome['error']
+            response = outcome['response']
+        except BaseException:
+            session.abort()
+            raise
+        finally:
+            with self._lock:
+                self._sessions.discard(session)
+        if kwargs.get('stream'):
+            # 流式响应由调用方读取，调用方关闭响应时一并关闭会话
+            close_response = response.close
+
+            def close():
+                close_response()
+                session.close()
+            response.close = close
+        else:
+            session.close()
+        return response
+
+
+def http_request(method, url, token=None, **kwargs):
+    # 统一的 HTTP 请求入口，有取消令牌时请求可被中途取消
+    if token is None:
+        return requests.request(method, url, **kwargs)
+    return token.request(method, url, **kwargs)
+
+
+class TaskSlots:
+    """任务并发槽位：限制同时执行的任务数，并记录正在执行的任务，避免同一任务被重复启动"""
+
+    def __init__(self, max_tasks=0):
+        # max_tasks <= 0 表示不限制
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self._running = {}
+
+    def acquire(self, task_id):
+        with self._lock:
+            if task_id in self._running:
+                return None
+            if 0 < self.max_tasks <= len(self._running):
+                return None
+            token = CancelToken(task_id)
+            self._running[task_id] = token
+            return token
+
+    def release(self, task_id, token=None):
+        # 指定 token 时只释放该 token 占用的槽位，被看门狗回收的线程退出时不会释放重新执行的任务的槽位
+        with self._lock:
+            if token is not None and self._running.get(task_id) is not token:
+                return False
+            return self._running.pop(task_id, None) is not None
+
+    def owns(self, task_id, token):
+        with self._lock:
+            return self._running.get(task_id) is token
+
+    def is_running(self, task_id):
+        with self._lock:
+            return task_id in self._running
+
+    def running(self):
+        with self._lock:
+            return list(self._running)
+
+    def tokens(self):
+        with self._lock:
+            return dict(self._running)
+
+    def cancel(self, task_id, reason='任务已取消'):
+        with self._lock:
+            token = self._running.get(task_id)
+        if token:
+            token.cancel(reason)
+        return token is not None
+
+
+slots = TaskSlots(getattr(config, 'max_concurrent_tasks', 0))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：任务列表存储，跨进程文件锁 + 原子替换写入，保证 api 多 worker 与任务服务器并发读写时任务列表不被破坏
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import config
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    # 基于独立锁文件的跨进程互斥锁，同一进程内不同线程各自打开锁文件，同样互斥
+    lock_file = f"{path}.lock"
+    with open(lock_file, 'a+b') as f:
+        if os.name == 'nt':
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write_json(path, data, **kwargs):
+    # 先写临时文件再原子替换，读者永远只会看到完整的旧文件或新文件
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **kwargs)
+        for attempt in range(5):
+            try:
+                os.replace(temp_path, path)
+                break
+            except PermissionError:
+                # Windows 下目标文件正被读取时替换会失败，稍后重试
+                if attempt == 4:
+                    raise
+                time.sleep(0.05)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_tasks(strict=False):
+    # strict=True 时文件损坏直接抛出异常，避免在损坏的数据上继续写入导致任务丢失
+    try:
+        with open(config.task_list_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return []
+    if not content:
+        return []
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        if strict:
+            raise
+        return []
+
+
+_cache = {'key': None, 'tasks': []}
+_cache_lock = threading.Lock()
+
+
+def read_tasks_cached():
+    # 任务列表文件没有变化（mtime、大小、inode 均相同）时返回缓存，调用方不能修改返回的任务
+    try:
+        stat = os.stat(config.task_list_file)
+    except FileNotFoundError:
+        return []
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with _cache_lock:
+        if _cache['key'] == key:
+            return _cache['tasks']
+    tasks = read_tasks(strict=True)
+    with _cache_lock:
+        _cache['key'] = key
+        _cache['tasks'] = tasks
+    return tasks
+
+
+def write_tasks(tasks):
+    with file_lock(config.task_list_file):
+        atomic_write_json(config.task_list_file, tasks, indent=4)
+
+
+class TaskListTransaction:
+    def __init__(self, tasks):
+        self.tasks = tasks
+        # 修改任务列表后置为 True，退出时才会写回文件
+        self.changed = False
+
+    def find(self, task_id):
+        return find_task(self.tasks, task_id)
+
+
+@contextlib.contextmanager
+def transaction():
+    """
+    在文件锁内读取、修改并写回任务列表：
+        with task_store.transaction() as txn:
+            txn.find(task_id)['status'] = 'failed'
+            txn.changed = True
+    """
+    with file_lock(config.task_list_file):
+        txn = TaskListTransaction(read_tasks(strict=True))
+        yield txn
+        if txn.changed:
+            atomic_write_json(config.task_list_file, txn.tasks, indent=4)
+
+
+def find_task(tasks, task_id):
+    return next((t for t in tasks if t.get('taskId') == task_id), None)
+
+
+def get_task(task_id):
+    return find_task(read_tasks(), task_id)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：任务看门狗。执行中的任务在每次检查取消状态时更新心跳，并记录各阶段的开始时间；
+#           心跳停止或阶段超过时限的任务被中止并放回等待队列，状态为执行中却没有执行线程的任务同样放回；
+#           每次放回重试次数加一，按指数退避延后执行，超过重试次数后标记为失败，执行槽位不会被卡死的任务长期占用
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import config
+import logs
+import task_store
+from task_control import slots
+
+log = logs.get_log('watchdog')
+
+# 未在 watchdog_stage_deadlines 中配置的阶段的时限(秒)
+DEFAULT_STAGE_DEADLINES = {
+    'fetch': 300,
+    'title': 900,
+    'first_dialogue': 1800,
+    'second_dialogue': 1800,
+    'dialogue': 300,
+    'segment': 300,
+    'tts': 7200,
+    'merge': 1800,
+}
+DEFAULT_STAGE_DEADLINE = 1800
+# 重试等待时间的上限(秒)
+MAX_BACKOFF = 3600
+
+
+def stage_deadline(stage):
+    deadlines = getattr(config, 'watchdog_stage_deadlines', None) or {}
+    return deadlines.get(stage, DEFAULT_STAGE_DEADLINES.get(stage, DEFAULT_STAGE_DEADLINE))
+
+
+def backoff_seconds(retries):
+    base = getattr(config, 'watchdog_retry_backoff', 60)
+    return min(MAX_BACKOFF, base * 2 ** (retries - 1))
+
+
+def ready(task, now=None):
+    # 等待重试的任务在 retryAt 之前不启动
+    retry_at = task.get('retryAt')
+    if not retry_at:
+        return True
+    try:
+        return datetime.fromisoformat(retry_at) <= (now or datetime.now())
+    except ValueError:
+        return True
+
+
+def requeue(task_id, reason, backoff=True):
+    """
+    任务执行失败或被回收后调用：重试次数加一放回等待队列，超过 watchdog_max_retries 时标记为失败。
+    已被取消、删除或已结束的任务不处理，返回任务的新状态
+    """
+    max_retries = getattr(config, 'watchdog_max_retries', 2)
+    now = datetime.now()
+    with task_store.transaction() as txn:
+        task = txn.find(task_id)
+        if not task or task['status'] not in ('pending', 'processing'):
+            return None
+        # 经 api 创建的任务 retries 为 None
+        retries = (task.get('retries') or 0) + 1
+        task['retries'] = retries
+        task['updatedAt'] = now.isoformat()
+        task.pop('startedAt', None)
+        if retries > max_retries:
+            task['status'] = 'failed'
+            task['progress'] = f'{reason}，已重试 {max_retries} 次，请重新提交'
+            task.pop('retryAt', None)
+        else:
+            delay = backoff_seconds(retries) if backoff else 0
+            task['status'] = 'pending'
+            task['progress'] = f'{reason}，等待第 {retries} 次重试'
+            task['retryAt'] = (now + timedelta(seconds=delay)).isoformat()
+        txn.changed = True
+    log(f"任务 {task_id} {reason}，{'已标记为失败' if task['status'] == 'failed' else f'第 {retries} 次放回等待队列'}",
+        logging.WARNING, taskId=task_id, retries=retries)
+    return task['status']
+
+
+def reclaim(task_id, token, reason):
+    # 中止卡住的任务并释放槽位；执行线程如果仍阻塞在不检查取消状态的调用中，恢复后会在下一次检查时退出
+    token.reclaimed = True
+    token.cancel(reason)
+    slots.release(task_id, token)
+    requeue(task_id, reason)
+
+
+def check_running(now=None):
+    # 心跳超时或有阶段超过时限的任务被回收
+    now = now or time.monotonic()
+    heartbeat_timeout = getattr(config, 'watchdog_heartbeat_timeout', 600)
+    for task_id, token in slots.tokens().items():
+        if token.cancelled:
+            continue
+        silent = now - token.heartbeat
+        if heartbeat_timeout and silent > heartbeat_timeout:
+            reclaim(task_id, token, f'{int(silent)} 秒无响应')
+            continue
+        for stage, started in token.stages().items():
+            if now - started > stage_deadline(stage):
+                reclaim(task_id, token, f'阶段 {stage} 执行超时')
+                break
+
+
+def reclaim_orphans(backoff=True):
+    # 状态为执行中却没有执行线程的任务（线程异常退出或服务重启前未完成）放回等待队列
+    count = 0
+    for task in task_store.read_tasks(strict=True):
+        if task['status'] == 'processing' and not slots.is_running(task['taskId']):
+            if requeue(task['taskId'], '执行中断', backoff):
+                count += 1
+    return count
+
+
+def run(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            check_running()
+            reclaim_orphans()
+        except Exception as e:
+            log(f"看门狗检查任务时发生错误: {str(e)}", logging.ERROR)
+
+
+def start():
+    interval = getattr(config, 'watchdog_interval', 30)
+    if interval <= 0:
+        log("看门狗未启用")
+        return None
+    thread = threading.Thread(target=run, args=(interval,), name='task-watchdog', daemon=True)
+    thread.start()
+    log(f"看门狗已启动，检查间隔 {interval} 秒")
+    return thread
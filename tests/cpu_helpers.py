@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：供 cpu_pool 测试在子进程中调用的函数；子进程不经过 conftest，这里不能导入 config
+import time
+
+
+def slow_write(path, content, delay):
+    time.sleep(delay)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return content
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+import pytest
+
+import admission
+import config
+
+NOW = datetime(2026, 1, 1, 12, 0, 0).timestamp()
+
+
+def task(task_id, status, started=None, client=None):
+    item = {'taskId': task_id, 'status': status, 'client': client}
+    if started is not None:
+        item['startedAt'] = datetime.fromtimestamp(NOW - started).isoformat()
+    return item
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(config, 'max_concurrent_tasks', 2)
+    monkeypatch.setattr(config, 'admission_default_task_seconds', 100, raising=False)
+    for name in ('admission_max_queue', 'admission_max_per_client', 'admission_max_eta_seconds'):
+        monkeypatch.setattr(config, name, 0, raising=False)
+
+
+def test_schedule_fills_earliest_free_slot():
+    tasks = [task('a', 'processing', started=30), task('b', 'processing', started=90),
+             task('c', 'pending'), task('d', 'pending')]
+    plan, next_free = admission.schedule(tasks, 100, NOW)
+    assert plan['a'] == (0.0, 70) and plan['b'] == (0.0, 10)
+    assert plan['c'] == (10, 110) and plan['d'] == (70, 170)
+    assert next_free == 110
+
+
+def test_overdue_task_keeps_minimum_remaining_time():
+    plan, _ = admission.schedule([task('a', 'processing', started=500)], 100, NOW)
+    assert plan['a'] == (0.0, 100 * admission.MIN_REMAINING_RATIO)
+
+
+def test_task_seconds_uses_recorded_median():
+    assert admission.task_seconds(admission.read_stats()) == 100
+    for total in (10, 20, 1000):
+        admission.record('t', {'fetch': total / 2}, total)
+    stats = admission.read_stats_cached()
+    assert admission.task_seconds(stats) == 20
+    assert admission.stage_seconds(stats) == {'fetch': 10.0}
+
+
+def test_admit_returns_queue_position_and_eta():
+    result = admission.admit([task('a', 'processing', started=0), task('b', 'pending')], 'c1', NOW)
+    assert result['queuePosition'] == 2
+    # 第二个槽位空闲，等待中的 b 先占用，新任务等 a 结束
+    assert result['etaSeconds'] == 200
+
+
+def test_full_queue_is_rejected_with_retry_after(monkeypatch):
+    monkeypatch.setattr(config, 'admission_max_queue', 1)
+    tasks = [task('a', 'processing', started=40), task('b', 'processing', started=0), task('c', 'pending')]
+    with pytest.raises(admission.Rejected) as e:
+        admission.admit(tasks, 'c1', NOW)
+    # c 在 a 结束后开始执行，队列随之空出
+    assert e.value.retry_after == 60
+
+
+def test_client_limit_counts_only_unfinished_tasks(monkeypatch):
+    monkeypatch.setattr(config, 'admission_max_per_client', 1)
+    tasks = [task('a', 'completed', client='c1'), task('b', 'processing', started=75, client='c1')]
+    with pytest.raises(admission.Rejected) as e:
+        admission.admit(tasks, 'c1', NOW)
+    assert e.value.retry_after == 25
+    assert admission.admit(tasks, 'c2', NOW)['queuePosition'] == 1
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from fastapi.testclient import TestClient
+
+import api
+import manifest
+import task_store
+
+TASKS = ['task-list-0001', 'task-list-0002', 'task-list-0003']
+
+
+def add_tasks():
+    tasks = []
+    for i, task_id in enumerate(TASKS):
+        status = 'pending' if i == 2 else 'completed'
+        tasks.append({'taskId': task_id, 'url': f'http://example.com/{i}', 'status': status, 'progress': '',
+                      'createdAt': f'2026-01-0{i + 1}T00:00:00', 'updatedAt': f'2026-01-0{i + 1}T00:00:00',
+                      'client': '127.0.0.1'})
+        manifest.ManifestWriter(task_id).update(title=f'标题{i}', dialogue=[{'role': 'host', 'content': '你好'}])
+    task_store.atomic_write_json('task_list.json', tasks)
+
+
+def test_get_list_returns_completed_tasks_without_dialogue():
+    add_tasks()
+    response = TestClient(api.app).get('/get_list')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/json'
+    tasks = response.json()
+    # 新任务在前，只返回已完成的任务，不返回对话内容与内部字段
+    assert [t['taskId'] for t in tasks] == ['task-list-0002', 'task-list-0001']
+    assert [t['title'] for t in tasks] == ['标题1', '标题0']
+    assert all(t['dialogue'] is None for t in tasks)
+    assert all('client' not in t for t in tasks)
+
+
+def test_get_task_still_returns_dialogue():
+    add_tasks()
+    task = TestClient(api.app).get('/get_task', params={'taskId': 'task-list-0001'}).json()
+    assert task['dialogue'] == [{'role': 'host', 'content': '你好'}]
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import wave
+
+import numpy as np
+import pytest
+
+import audio_post
+
+
+def write_wav(path, seconds=0.5, rate=16000, channels=1):
+    t = np.arange(int(seconds * rate)) / rate
+    samples = (np.sin(2 * np.pi * 440 * t) * 8000).astype('<i2')
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.repeat(samples, channels).tobytes())
+    return str(path)
+
+
+def test_merge_writes_output_atomically(workdir):
+    segments = [write_wav(workdir / '0000_host.wav'), write_wav(workdir / '0001_guest.wav')]
+    output = str(workdir / 'merged.wav')
+
+    result = audio_post.merge_segments(segments, output, roles=['host', 'guest'])
+
+    assert result['duration'] > 0.5
+    assert not os.path.exists(output + '.tmp')
+    with wave.open(output, 'rb') as f:
+        assert f.getnframes() > 0
+
+
+def test_failed_merge_keeps_previous_output(workdir):
+    output = write_wav(workdir / 'merged.wav', seconds=1)
+    with open(output, 'rb') as f:
+        previous = f.read()
+    # 第二段的声道数与第一段不同，写到一半时失败
+    segments = [write_wav(workdir / '0000_host.wav'), write_wav(workdir / '0001_guest.wav', channels=2)]
+
+    with pytest.raises(audio_post.UnsupportedAudio):
+        audio_post.merge_segments(segments, output)
+
+    with open(output, 'rb') as f:
+        assert f.read() == previous
+    assert not os.path.exists(output + '.tmp')
+
+
+def test_failed_merge_leaves_no_output(workdir):
+    output = str(workdir / 'merged.wav')
+    segments = [write_wav(workdir / '0000_host.wav'), write_wav(workdir / '0001_guest.wav', rate=8000)]
+
+    with pytest.raises(audio_post.UnsupportedAudio):
+        audio_post.merge_segments(segments, output)
+
+    assert not os.path.exists(output)
+    assert not os.path.exists(output + '.tmp')
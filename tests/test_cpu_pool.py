@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+import pytest
+
+import config
+import cpu_pool
+import task_store
+from cpu_helpers import slow_write
+from task_control import CancelToken, TaskCancelled
+
+TASK = 'task-cpu-0001'
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(config, 'cpu_pool_workers', 1, raising=False)
+    yield
+    if cpu_pool._pool is not None:
+        cpu_pool._reset(cpu_pool._pool)
+
+
+@pytest.fixture
+def token():
+    task_store.atomic_write_json('task_list.json', [{'taskId': TASK, 'status': 'processing'}])
+    return CancelToken(TASK, poll_interval=0.05)
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def test_output_is_published_after_success(pool, token):
+    path = os.path.abspath('content.txt')
+    assert cpu_pool.run(slow_write, cpu_pool.staged(path), '新内容', 0, token=token, outputs=[path]) == '新内容'
+    assert read(path) == '新内容'
+    assert not os.path.exists(cpu_pool.staged(path))
+
+
+def test_cancelled_call_does_not_replace_output(pool, token):
+    path = os.path.abspath('content.txt')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('原内容')
+    # 先启动子进程，避免取消发生在调用开始之前
+    cpu_pool.run(slow_write, os.path.abspath('warmup.txt'), '', 0)
+    threading.Timer(0.3, token.cancel).start()
+
+    with pytest.raises(TaskCancelled):
+        cpu_pool.run(slow_write, cpu_pool.staged(path), '新内容', 1, token=token, outputs=[path])
+
+    # 子进程仍会执行完，结束后只删除它的临时文件
+    time.sleep(1.5)
+    assert read(path) == '原内容'
+    assert not os.path.exists(cpu_pool.staged(path))
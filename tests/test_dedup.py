@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import config
+import dedup
+import task_store
+
+ARTICLE = ('人工智能正在改变播客的制作方式。过去需要数天完成的剪辑与配音，现在几分钟就能生成初稿。'
+           '不过，内容的准确性与观点的深度仍然需要编辑把关，机器只是提高了效率。') * 3
+OTHER = '今天的天气非常好，我们去公园散步，看到很多人在放风筝，孩子们在草地上奔跑，笑声不断。' * 3
+
+
+def completed(task_id):
+    with open(config.get_task_file(task_id, f'{task_id}.wav'), 'wb') as f:
+        f.write(b'wav')
+    tasks = task_store.read_tasks() if os.path.exists('task_list.json') else []
+    task_store.atomic_write_json('task_list.json', tasks + [{'taskId': task_id, 'status': 'completed'}])
+
+
+def test_normalize_ignores_layout_differences():
+    assert dedup.normalize('Hello,  World！\n播客') == dedup.normalize('ｈｅｌｌｏ world 播客。')
+
+
+def test_simhash_distance_separates_similar_and_unrelated_text():
+    base = dedup.simhash(dedup.normalize(ARTICLE))
+    edited = dedup.simhash(dedup.normalize(ARTICLE.replace('几分钟', '几分钟内', 1)))
+    unrelated = dedup.simhash(dedup.normalize(OTHER))
+    assert dedup.hamming(base, edited) <= config.dedup_max_distance
+    assert dedup.hamming(base, unrelated) > 10
+
+
+def test_find_duplicate_matches_exact_and_near_copies():
+    completed('task-source')
+    dedup.register('task-source', ARTICLE)
+    assert dedup.find_duplicate(' ' + ARTICLE.replace('。', '.'), 'task-new') == ('task-source', 0)
+    source_id, distance = dedup.find_duplicate(ARTICLE.replace('几分钟', '几分钟内', 1), 'task-new')
+    assert source_id == 'task-source' and 0 < distance <= config.dedup_max_distance
+    assert dedup.find_duplicate(OTHER, 'task-new') == (None, None)
+    # 任务自己不算重复
+    assert dedup.find_duplicate(ARTICLE, 'task-source') == (None, None)
+
+
+def test_unavailable_source_is_skipped():
+    dedup.register('task-deleted', ARTICLE)
+    assert dedup.find_duplicate(ARTICLE, 'task-new') == (None, None)
+    dedup.unregister('task-deleted')
+    assert dedup.read_index() == []
+
+
+def test_check_links_artifacts_under_new_task_id():
+    completed('task-source')
+    for name in ('content.txt', 'manifest.json', 'peaks.json'):
+        with open(config.get_task_file('task-source', name), 'w') as f:
+            f.write(name)
+    dedup.register('task-source', ARTICLE)
+
+    with pytest.raises(dedup.DuplicateContent) as e:
+        dedup.check(ARTICLE, 'task-new')
+    assert e.value.source_id == 'task-source' and e.value.distance == 0
+    files = sorted(os.listdir(config.get_task_file('task-new')))
+    assert files == ['peaks.json', 'task-new.wav']
+    assert os.path.samefile(config.get_task_file('task-new', 'task-new.wav'),
+                            config.get_task_file('task-source', 'task-source.wav'))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import ffmpeg
+import pytest
+
+import config
+import delivery
+
+TASK = 'task-delivery-0001'
+
+
+class Command:
+    # 代替 ffmpeg 的输出节点：子进程写入临时文件后以 code 退出
+    def __init__(self, paths, code=0):
+        self.paths = paths
+        self.code = code
+
+    def overwrite_output(self):
+        return self
+
+    def run_async(self):
+        script = (f"import sys\nfor path in {[delivery.temp_file(p) for p in self.paths]!r}:\n"
+                  f"    open(path, 'w').write('new')\nsys.exit({self.code})")
+        return subprocess.Popen([sys.executable, '-c', script])
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_explicit_format_wins_over_accept():
+    available = {'mp3': '/a.mp3', 'opus': '/a.opus'}
+    assert delivery.negotiate('audio/ogg', available, 'mp3') == 'mp3'
+    assert delivery.negotiate('audio/mpeg', available, 'm4a') is None
+
+
+def test_accept_picks_highest_quality_available_type():
+    available = {'mp3': '/a.mp3', 'opus': '/a.opus'}
+    assert delivery.negotiate('audio/mpeg;q=0.5, audio/ogg;q=0.9', available) == 'opus'
+    assert delivery.negotiate('audio/mp4, audio/mpeg;q=0.1', available) == 'mp3'
+    # 明确要求 wav 或通配时仍返回原文件
+    assert delivery.negotiate('audio/wav, audio/mpeg;q=0.5', available) is None
+    assert delivery.negotiate('*/*', available) is None
+    assert delivery.negotiate(None, available) is None
+
+
+def test_parse_accept_handles_bad_q():
+    assert delivery.parse_accept('audio/MPEG;q=abc, , audio/ogg') == [('audio/mpeg', 0.0), ('audio/ogg', 1.0)]
+
+
+def test_list_renditions_and_configured_formats(monkeypatch):
+    monkeypatch.setattr(config, 'delivery_formats', {'mp3': '64k', 'flac': '0'}, raising=False)
+    assert delivery.get_delivery_formats() == {'mp3': '64k'}
+    assert delivery.list_renditions(TASK) == {}
+    with open(delivery.rendition_file(TASK, 'mp3'), 'w') as f:
+        f.write('mp3')
+    assert delivery.list_renditions(TASK) == {'mp3': f'/audio/{TASK}/{TASK}.mp3'}
+    assert delivery.preferred_upload_file(TASK) == delivery.rendition_file(TASK, 'mp3')
+
+
+def test_run_ffmpeg_replaces_outputs_only_on_success():
+    path = config.get_task_file(TASK, f'{TASK}.mp3')
+    with open(path, 'w') as f:
+        f.write('old')
+
+    with pytest.raises(ffmpeg.Error):
+        delivery.run_ffmpeg(Command([path], code=1), files=[path])
+    assert read(path) == 'old' and not os.path.exists(delivery.temp_file(path))
+
+    delivery.run_ffmpeg(Command([path]), files=[path])
+    assert read(path) == 'new' and not os.path.exists(delivery.temp_file(path))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+
+from fastapi.testclient import TestClient
+
+import api
+import config
+import feed
+import storage
+import task_store
+
+TASK = 'task-feed-0001'
+
+
+def write(name, size):
+    with open(config.get_task_file(TASK, name), 'wb') as f:
+        f.write(b'\0' * size)
+
+
+def enclosure():
+    with open(feed.feed_file(), 'r', encoding='utf-8') as f:
+        match = re.search(r'<enclosure url="([^"]+)" length="(\d+)" type="([^"]+)"/>', f.read())
+    return match.group(1)[len(feed.base_url()):], int(match.group(2)), match.group(3)
+
+
+def test_enclosure_points_at_rendition_file():
+    write(f'{TASK}.wav', 1000)
+    write(f'{TASK}.mp3', 100)
+    feed.add_episode({'taskId': TASK})
+
+    url, length, media_type = enclosure()
+    assert (url, length, media_type) == (f'/audio/{TASK}/{TASK}.mp3', 100, 'audio/mpeg')
+    # 订阅客户端按 enclosure 地址下载到的就是 length 字节的 mp3
+    response = TestClient(api.app).get(url)
+    assert response.status_code == 200 and len(response.content) == length
+
+
+def test_removed_rendition_falls_back_to_wav():
+    task_store.atomic_write_json('task_list.json', [{'taskId': TASK, 'status': 'completed'}])
+    write(f'{TASK}.wav', 1000)
+    write(f'{TASK}.mp3', 100)
+    feed.add_episode({'taskId': TASK})
+
+    os.remove(config.get_task_file(TASK, f'{TASK}.mp3'))
+    storage.refresh_manifest(TASK)
+
+    assert enclosure() == (f'/audio/{TASK}/{TASK}.wav', 1000, 'audio/wav')
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import importlib.util
+import json
+import os
+
+from conftest import ROOT
+
+spec = importlib.util.spec_from_file_location('loadtest', os.path.join(ROOT, 'tools', 'loadtest.py'))
+loadtest = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(loadtest)
+
+
+def test_synthetic_manifest_progress_matches_server():
+    dialogue = [{'role': 'host', 'content': '你好'}, {'role': 'guest', 'content': '欢迎收听'}]
+    loadtest.write_task_files('.', 'task-load-0001', '标题', dialogue, b'\0' * 44, '2026-01-01T00:00:00')
+    with open(os.path.join(loadtest.task_dir('.', 'task-load-0001'), 'manifest.json'), encoding='utf-8') as f:
+        progress = json.load(f)['progress']
+    # 与 server.generate_audio 中 set_progress 的字段一致
+    assert progress == {'current_line': 2, 'total_lines': 2, 'content': '欢迎收听'}
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging
+
+import logs
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_get_log_attaches_fields():
+    log = logs.get_log('test_logs')
+    capture = Capture()
+    logger = logs.get_logger('test_logs')
+    logger.addHandler(capture)
+    try:
+        log('任务完成', taskId='task-0001')
+        log('调试信息', logging.DEBUG)
+    finally:
+        logger.removeHandler(capture)
+
+    # 默认级别为 INFO，DEBUG 日志不输出
+    assert [r.getMessage() for r in capture.records] == ['任务完成']
+    assert capture.records[0].levelno == logging.INFO
+    assert capture.records[0].fields == {'taskId': 'task-0001'}
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+
+import config
+import manifest
+
+TASK = 'task-manifest-0001'
+
+
+def write(name, content):
+    with open(config.get_task_file(TASK, name), 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_legacy_build_is_cached_until_files_change(monkeypatch):
+    write('title.txt', '旧标题')
+    write('dialogue.json', '[{"role": "host", "content": "你好"}]')
+    calls = []
+    build = manifest.build_legacy
+    monkeypatch.setattr(manifest, 'build_legacy', lambda task_id: calls.append(task_id) or build(task_id))
+    cache = manifest.ManifestCache()
+
+    assert cache.get(TASK)['title'] == '旧标题'
+    assert cache.get(TASK)['dialogue'] == [{'role': 'host', 'content': '你好'}]
+    assert len(calls) == 1
+
+    write('title.txt', '修改后的标题')
+    os.utime(config.get_task_file(TASK, 'title.txt'), ns=(0, 0))
+    assert cache.get(TASK)['title'] == '修改后的标题'
+    assert len(calls) == 2
+
+
+def test_manifest_replaces_legacy_files():
+    write('title.txt', '旧标题')
+    cache = manifest.ManifestCache()
+    assert cache.get(TASK)['title'] == '旧标题'
+
+    manifest.ManifestWriter(TASK).update(title='新标题')
+    assert cache.get(TASK)['title'] == '新标题'
+
+
+def test_queued_task_creates_no_directory(workdir):
+    data = manifest.ManifestCache().get(TASK)
+    assert data['title'] is None and data['artifacts'] == {}
+    assert not os.path.exists(workdir / 'output')
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+import task_store
+from pipeline import Pipeline, StageFailed
+from task_control import CancelToken, TaskCancelled
+
+TASK = 'task-pipeline-0001'
+
+
+@pytest.fixture
+def token():
+    task_store.atomic_write_json('task_list.json', [{'taskId': TASK, 'status': 'processing'}])
+    return CancelToken(TASK, poll_interval=0.05)
+
+
+def test_stage_order_and_results():
+    pipeline = Pipeline()
+    pipeline.add('fetch', lambda results: 'page')
+    pipeline.add('title', lambda results: results['fetch'] + ':title', deps=['fetch'])
+    pipeline.add('dialogue', lambda results: results['fetch'] + ':dialogue', deps=['fetch'])
+    pipeline.add('merge', lambda results: (results['title'], results['dialogue']), deps=['title', 'dialogue'])
+
+    results = pipeline.run()
+
+    assert results['merge'] == ('page:title', 'page:dialogue')
+    assert set(pipeline.durations) == {'fetch', 'title', 'dialogue', 'merge'}
+
+
+def test_failed_stage_stops_running_siblings(token):
+    sibling = {}
+
+    def slow(results):
+        # 模拟耗时的 LLM 请求：每次检查取消状态之间等待一小段时间
+        started = time.monotonic()
+        try:
+            while time.monotonic() - started < 5:
+                token.check()
+                time.sleep(0.02)
+            sibling['finished'] = True
+        except TaskCancelled:
+            sibling['stopped'] = time.monotonic() - started
+            raise
+
+    def fail(results):
+        time.sleep(0.1)
+        raise StageFailed('生成对话内容失败，请重新提交')
+
+    pipeline = Pipeline(token)
+    pipeline.add('fetch', lambda results: 'page')
+    pipeline.add('title', slow, deps=['fetch'])
+    pipeline.add('first_dialogue', fail, deps=['fetch'])
+    pipeline.add('second_dialogue', lambda results: sibling.setdefault('second', True), deps=['first_dialogue'])
+
+    with pytest.raises(StageFailed):
+        pipeline.run()
+
+    assert 'finished' not in sibling and sibling['stopped'] < 1
+    assert 'second' not in sibling
+    # 阶段失败不是取消：令牌恢复后任务仍可更新为失败状态
+    assert not token.is_cancelled()
+    token.check()
+
+
+def test_cancel_during_abort_is_kept(token):
+    def fail(results):
+        raise StageFailed('失败')
+
+    def cancelled_meanwhile(results):
+        while not token.cancelled:
+            time.sleep(0.01)
+        token.cancel('任务已取消')
+        raise TaskCancelled(TASK, token.reason)
+
+    pipeline = Pipeline(token)
+    pipeline.add('a', cancelled_meanwhile)
+    pipeline.add('b', fail)
+
+    with pytest.raises(StageFailed):
+        pipeline.run()
+    assert token.is_cancelled() and token.reason == '任务已取消'
+
+
+def test_abort_does_not_override_cancel(token):
+    token.cancel('任务已删除')
+    token.abort()
+    token.resume()
+    assert token.cancelled and token.reason == '任务已删除'
+
+
+def test_resume_without_abort_is_noop(token):
+    token.resume()
+    assert not token.cancelled and token.reason is None
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import profiling
+from task_control import slots
+
+TASK = 'task-profile-0001'
+
+
+def run_stage(profiler, stage):
+    profiler.stage_started(stage)
+    data = [bytearray(1024) for _ in range(100)]
+    profiler.stage_finished(stage)
+    return data
+
+
+def test_stage_with_other_tasks_is_not_compared(monkeypatch):
+    monkeypatch.setattr(profiling, 'sample_rate', lambda: 1)
+    profiler = profiling.start(TASK)
+    assert profiler is not None
+    try:
+        run_stage(profiler, 'alone')
+        assert slots.acquire('task-profile-other')
+        try:
+            run_stage(profiler, 'shared')
+        finally:
+            slots.release('task-profile-other')
+    finally:
+        profiling.stop(profiler)
+
+    with open(os.path.join(profiler.directory, 'memory.json'), encoding='utf-8') as f:
+        memory = json.load(f)
+    assert set(memory['stages']) == {'alone'} and memory['sharedStages'] == ['shared']
+    assert {(e['stage'], e['otherTasks']) for e in memory['events']} == {('alone', 0), ('shared', 1)}
+    assert os.path.exists(os.path.join(profiler.directory, 'alone.snap'))
+    assert not os.path.exists(os.path.join(profiler.directory, 'shared.snap'))
+    summary = profiling.summarize([profiler.directory])
+    assert set(summary['stagePeakBytes']) == {'alone'}
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pytest
+
+import search_index
+import task_store
+
+
+@pytest.fixture
+def built():
+    # 空任务列表建立索引，之后只做增量更新
+    task_store.atomic_write_json('task_list.json', [])
+    search_index.rebuild()
+
+
+def test_index_tokens_use_cjk_bigrams_and_words():
+    assert search_index.index_tokens('播客制作 AI Podcast２０２６') == '播客 客制 制作 作 ai podcast2026'
+    assert search_index.index_tokens('好，OK') == '好 ok'
+
+
+def test_match_expression():
+    assert search_index.match_expression('播客制作') == '"播客 客制 制作"'
+    assert search_index.match_expression('播 AI') == '"播"* AND "ai"'
+    assert search_index.match_expression('，。！') == ''
+
+
+def test_search_ranks_title_hits_and_returns_snippets(built):
+    search_index.add_task('task-1', '人工智能播客', [{'role': 'host', 'content': '今天聊聊人工智能。'}], '2026-01-01')
+    search_index.add_task('task-2', '天气预报', [{'role': 'host', 'content': '人工智能也能预测天气。'},
+                                             {'role': 'guest', 'content': '真的吗？'}], '2026-01-02')
+    search_index.add_task('task-3', '体育新闻', [{'role': 'host', 'content': '足球比赛结果。'}], '2026-01-03')
+
+    result = search_index.search('人工智能')
+    assert result['total'] == 2
+    assert [hit['taskId'] for hit in result['hits']] == ['task-1', 'task-2']
+    assert result['hits'][1]['snippets'] == [{'line': 0, 'role': 'host', 'text': '人工智能也能预测天气。'}]
+    # 子串之外的二元字组组合不算命中
+    assert search_index.search('智人')['total'] == 0
+    assert search_index.search('智')['total'] == 2
+
+
+def test_readding_task_replaces_and_remove_deletes(built):
+    search_index.add_task('task-1', '旧标题', [], None)
+    search_index.add_task('task-1', '新标题', [], None)
+    assert search_index.search('旧标题')['total'] == 0
+    assert search_index.search('新标题')['total'] == 1
+    search_index.remove_task('task-1')
+    assert search_index.search('新标题')['total'] == 0
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import config
+import dedup
+import segment_cache
+import server
+import server_pro
+
+SOURCE = 'task-source-0001'
+TASK = 'task-edited-0001'
+
+
+def segments(*texts):
+    return [{'role': role, 'content': text, 'lines': [i]}
+            for i, (role, text) in enumerate(zip(['host', 'guest'], texts))]
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+def cached(task_id, role, text):
+    anchor_type = config.host_speaker if role == 'host' else config.guest_speaker
+    return read(segment_cache.cache_file(task_id, anchor_type, text))
+
+
+@pytest.fixture(params=[server, server_pro], ids=['server', 'server_pro'])
+def worker(request, monkeypatch):
+    # TTS 返回文本本身，片段内容即可说明是哪一句合成的
+    monkeypatch.setattr(request.param.tts_client, 'tts_request', lambda text, anchor_type, token=None: text.encode('utf-8'))
+    monkeypatch.setattr(request.param.tts_client, 'log_stats', lambda: None)
+    monkeypatch.setattr(config, 'tts_parallel_requests', 1, raising=False)
+    return request.param
+
+
+def test_edit_keeps_cache_entry_of_old_text(worker):
+    first = worker.generate_audio(segments('第一句', '第二句'), SOURCE, 2)
+    assert read(first[0]) == '第一句'
+
+    # delete_original_audio=False 或任务重试时片段文件仍在，且与缓存共享同一份数据
+    edited = worker.generate_audio(segments('改过的第一句', '第二句'), SOURCE, 2)
+    assert read(edited[0]) == '改过的第一句'
+    assert cached(SOURCE, 'host', '第一句') == '第一句'
+    assert cached(SOURCE, 'host', '改过的第一句') == '改过的第一句'
+
+
+def test_edit_of_dedup_task_keeps_source_unchanged(worker):
+    first = worker.generate_audio(segments('第一句', '第二句'), SOURCE, 2)
+    config.get_task_file(TASK)
+    dedup.link_artifacts(SOURCE, TASK)
+    assert os.stat(first[0]).st_nlink > 1
+
+    edited = worker.generate_audio(segments('改过的第一句', '第二句'), TASK, 2)
+    assert read(edited[0]) == '改过的第一句'
+    assert read(first[0]) == '第一句'
+    assert read(first[1]) == '第二句'
+    assert cached(SOURCE, 'host', '第一句') == '第一句'
+    assert cached(TASK, 'host', '第一句') == '第一句'
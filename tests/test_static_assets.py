@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import gzip
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import static_assets
+from static_assets import FileAsset, StaticAssets
+
+SCRIPT = 'console.log("播客");\n' * 100
+
+
+def make_client():
+    os.makedirs('resources')
+    with open(os.path.join('resources', 'app.js'), 'w', encoding='utf-8') as f:
+        f.write(SCRIPT)
+    with open('index.html', 'w', encoding='utf-8') as f:
+        f.write('<script src="/resources/app.js"></script>')
+    assets = StaticAssets({'/': 'index.html'})
+    assets.load()
+    feed = FileAsset('feed.xml', 'application/rss+xml; charset=utf-8')
+    app = FastAPI()
+
+    @app.get('/feed.xml')
+    def get_feed(request: Request):
+        feed.refresh()
+        return feed.response(request)
+
+    @app.get('/{path:path}')
+    def get_asset(path: str, request: Request):
+        return assets.response('/' + path, request)
+
+    return TestClient(app), assets
+
+
+def test_page_references_fingerprinted_resource():
+    client, assets = make_client()
+    url = assets.fingerprinted['/resources/app.js']
+    assert url != '/resources/app.js'
+    assert url in client.get('/').text
+    response = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert response.text == SCRIPT
+    assert response.headers['cache-control'] == static_assets.IMMUTABLE_CACHE
+    assert client.get('/resources/app.js').headers['cache-control'] == static_assets.REVALIDATE_CACHE
+
+
+def test_precompressed_variant_and_etag_revalidation():
+    client, _ = make_client()
+    response = client.get('/resources/app.js', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.text == SCRIPT
+    # 不同编码的 ETag 指向同一内容
+    identity = client.get('/resources/app.js', headers={'Accept-Encoding': 'identity'})
+    assert client.get('/resources/app.js', headers={'If-None-Match': identity.headers['etag'],
+                                                    'Accept-Encoding': 'gzip'}).status_code == 304
+
+
+def test_accepted_encodings_ignores_q0():
+    assert static_assets.accepted_encodings('gzip;q=0, br') == {'br'}
+    assert static_assets.accepted_encodings(None) == set()
+
+
+def test_file_asset_reloads_after_change():
+    client, _ = make_client()
+    with open('feed.xml', 'w', encoding='utf-8') as f:
+        f.write('<rss>旧</rss>')
+    first = client.get('/feed.xml', headers={'Accept-Encoding': 'identity'})
+    assert first.text == '<rss>旧</rss>'
+    assert client.get('/feed.xml', headers={'If-Modified-Since': first.headers['last-modified']}).status_code == 304
+
+    with open('feed.xml', 'w', encoding='utf-8') as f:
+        f.write('<rss>新的节目</rss>')
+    second = client.get('/feed.xml', headers={'If-None-Match': first.headers['etag'], 'Accept-Encoding': 'identity'})
+    assert second.status_code == 200 and second.text == '<rss>新的节目</rss>'
+
+
+def test_small_body_keeps_only_identity():
+    asset = static_assets.StaticAsset(b'{}', 'application/json', static_assets.REVALIDATE_CACHE)
+    assert set(asset.variants) == {'identity'}
+    assert gzip.decompress(static_assets.StaticAsset(SCRIPT.encode(), 'text/css', '').variants['gzip']) == SCRIPT.encode()
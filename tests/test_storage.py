@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+
+from fastapi.testclient import TestClient
+
+import api
+import config
+import storage
+
+TASK = 'task-audio-0001'
+
+
+def test_unknown_task_creates_no_directory(workdir):
+    client = TestClient(api.app)
+    for filename in ['zzbogus-task.mp3', 'zzbogus-task.wav', 'peaks.json']:
+        assert client.get(f'/audio/zzbogus-task/{filename}').status_code == 404
+    storage.touch('zzbogus-task')
+    assert storage.last_access({'taskId': 'zzbogus-task', 'updatedAt': '2026-01-01T00:00:00'}) > 0
+    assert storage.finished_at({'taskId': 'zzbogus-task'}) == 0
+    assert not os.path.exists(workdir / 'output')
+
+
+def test_rendition_request_records_access():
+    with open(config.get_task_file(TASK, f'{TASK}.mp3'), 'wb') as f:
+        f.write(b'mp3')
+    with open(config.get_task_file(TASK, 'peaks.json'), 'w') as f:
+        f.write('{}')
+    marker = os.path.join(storage.task_dir(TASK), storage.ACCESS_MARKER)
+    client = TestClient(api.app)
+
+    assert client.get(f'/audio/{TASK}/peaks.json').status_code == 200
+    assert not os.path.exists(marker)
+    assert client.get(f'/audio/{TASK}/{TASK}.opus').status_code == 404
+    assert not os.path.exists(marker)
+    assert client.get(f'/audio/{TASK}/{TASK}.mp3').content == b'mp3'
+    assert os.path.exists(marker)
+
+
+def test_task_dir_follows_config_layout():
+    assert storage.task_dir(TASK) is None
+    path = config.get_task_file(TASK)
+    assert storage.task_dir(TASK) == path
+    # 旧版本未分片的目录同样能找到
+    os.makedirs(os.path.join('output', 'task-legacy-0001'))
+    assert storage.task_dir('task-legacy-0001') == config.get_task_file('task-legacy-0001')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+
+import pytest
+
+import task_store
+from task_control import CancelToken, TaskCancelled
+
+TASK = 'task-cancel-0001'
+
+
+@pytest.fixture
+def hanging_server():
+    # 读取请求后不响应，记录客户端关闭连接（recv 返回 b''）的时间
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    state = {}
+
+    def serve():
+        conn, _ = server.accept()
+        conn.settimeout(10)
+        conn.recv(65536)
+        state['received'] = time.monotonic()
+        try:
+            while conn.recv(65536):
+                pass
+            state['closed'] = time.monotonic()
+        except OSError:
+            pass
+        conn.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.getsockname()[1]}/", state, thread
+    server.close()
+
+
+def test_cancel_closes_in_flight_connection(hanging_server):
+    url, state, thread = hanging_server
+    task_store.atomic_write_json('task_list.json', [{'taskId': TASK, 'status': 'processing'}])
+    token = CancelToken(TASK)
+    threading.Timer(0.5, token.cancel).start()
+
+    started = time.monotonic()
+    with pytest.raises(TaskCancelled):
+        token.request('GET', url, timeout=30)
+    assert time.monotonic() - started < 2
+
+    # 服务端应立即看到连接断开，而不是等到请求超时
+    thread.join(3)
+    assert 'received' in state and 'closed' in state
+    assert state['closed'] - started < 2
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import config
+import api
+import server
+import task_store
+import task_watchdog
+from task_control import slots
+
+
+def crash(task, token):
+    server.update_task_status(task['taskId'], 'processing', '正在抓取页面')
+    raise RuntimeError('boom')
+
+
+def stored(task_id):
+    return task_store.find_task(task_store.read_tasks(strict=True), task_id)
+
+
+def test_crashed_task_is_requeued_then_failed(monkeypatch):
+    monkeypatch.setattr(config, 'watchdog_max_retries', 2, raising=False)
+    monkeypatch.setattr(config, 'watchdog_retry_backoff', 0, raising=False)
+    monkeypatch.setattr(server, 'run_task', crash)
+    # 经 api 创建的任务带有 retries: None
+    task_id, _ = api.create_task('http://127.0.0.1/page')
+    assert stored(task_id)['retries'] is None
+
+    for retries, status in [(1, 'pending'), (2, 'pending'), (3, 'failed')]:
+        task = stored(task_id)
+        assert task_watchdog.ready(task)
+        server.execute_task(task, slots.acquire(task_id))
+        task = stored(task_id)
+        assert (task['retries'], task['status']) == (retries, status)
+        assert not slots.is_running(task_id)
+    assert '已重试 2 次' in stored(task_id)['progress']
+
+
+def test_orphan_created_through_api_is_requeued(monkeypatch):
+    monkeypatch.setattr(config, 'watchdog_retry_backoff', 0, raising=False)
+    task_id, _ = api.create_task('http://127.0.0.1/page')
+    server.update_task_status(task_id, 'processing', '正在抓取页面')
+
+    assert task_watchdog.reclaim_orphans() == 1
+    task = stored(task_id)
+    assert (task['retries'], task['status']) == (1, 'pending')
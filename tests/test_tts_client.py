@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import http.server
+import threading
+import time
+
+import pytest
+
+import tts_client
+from tts_client import Backend, BackendPool, TTSClient
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # /slow 在客户端断开或 5 秒后才返回，/fast 立即返回
+    closed = []
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            self.connection.settimeout(5)
+            try:
+                # 客户端关闭连接时 recv 返回 b''
+                if self.connection.recv(1) == b'':
+                    Handler.closed.append(time.monotonic())
+                    return
+            except OSError:
+                pass
+        self.send_response(200)
+        self.send_header('Content-Length', '5')
+        self.end_headers()
+        self.wfile.write(b'audio')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.closed = []
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_abandoned_hedge_releases_backend(server):
+    slow = Backend(f"{server}/slow?text={{text}}", name='slow', max_concurrency=1)
+    fast = Backend(f"{server}/fast?text={{text}}", name='fast', max_concurrency=1)
+    pool = BackendPool([slow, fast])
+    client = TTSClient(pool, hedge=True, percentile=50, budget=1, timeout=10, min_samples=1)
+    # 负载相同时选择列表中靠前的后端，主请求落在慢后端上，并且很快触发对冲
+    client.latency.record('slow', 0.05)
+
+    started = time.monotonic()
+    content = client._attempt('你好', 'leo', {}, None)
+
+    assert content == b'audio'
+    assert client.budget.hedges == 1 and client.budget.hedge_wins == 1
+    # 被放弃的主请求立即归还名额，不等后端处理完
+    assert (slow.outstanding, fast.outstanding) == (0, 0)
+    assert slow.failures == 0
+    # 后端看到连接被关闭
+    deadline = time.monotonic() + 2
+    while not Handler.closed and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert Handler.closed and Handler.closed[0] - started < 2
+    # 主请求线程退出后也不会重复归还
+    time.sleep(0.3)
+    assert (slow.outstanding, fast.outstanding) == (0, 0)
+
+
+def test_failed_start_releases_backend(monkeypatch):
+    backend = Backend('http://127.0.0.1:1/?text={text}', name='b', max_concurrency=1)
+    pool = BackendPool([backend])
+    client = TTSClient(pool)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('无法启动线程')
+    monkeypatch.setattr(tts_client, '_Call', broken)
+
+    with pytest.raises(RuntimeError):
+        client._attempt('你好', 'leo', {}, None)
+    assert backend.outstanding == 0
+    assert pool.acquire(wait=False) is backend
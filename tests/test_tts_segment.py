@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import tts_segment
+from tts_segment import plan_segments, split_text
+
+
+def test_short_text_is_kept():
+    assert split_text('  你好，欢迎收听。 ', 200) == ['你好，欢迎收听。']
+    assert split_text('   ', 200) == []
+    assert split_text('不限制长度' * 100, 0) == ['不限制长度' * 100]
+
+
+def test_chinese_splits_at_sentence_end():
+    text = '今天我们聊聊播客。' * 5
+    chunks = split_text(text, 20)
+    assert all(len(c) <= 20 for c in chunks)
+    assert ''.join(chunks) == text
+    assert all(c.endswith('。') for c in chunks)
+
+
+def test_english_splits_at_sentence_end():
+    text = 'We went to the park. Everyone enjoyed it. The weather was nice.'
+    assert split_text(text, 30) == ['We went to the park.', 'Everyone enjoyed it.', 'The weather was nice.']
+
+
+def test_period_inside_number_is_not_sentence_end():
+    assert split_text('价格是3.14元，比上次便宜。' * 2, 16) == ['价格是3.14元，比上次便宜。'] * 2
+
+
+def test_long_english_sentence_is_cut_between_words():
+    text = 'It was a sunny day and the kids played football in the park until dark'
+    chunks = split_text(text, 20)
+    assert all(len(c) <= 20 for c in chunks)
+    assert ' '.join(chunks) == text
+
+
+def test_long_word_is_cut_by_length():
+    assert split_text('a' * 25, 10) == ['a' * 10, 'a' * 10, 'a' * 5]
+
+
+def test_join_adds_space_unless_both_sides_cjk():
+    assert tts_segment.join('Yes.', 'Right.') == 'Yes. Right.'
+    assert tts_segment.join('好的。', '我们开始。') == '好的。我们开始。'
+    assert tts_segment.join('好的', 'OK') == '好的 OK'
+    assert tts_segment.join('', 'OK') == 'OK'
+
+
+def test_plan_coalesces_short_turns_of_same_role():
+    dialogue = [
+        {'role': 'host', 'content': 'Yes.'},
+        {'role': 'host', 'content': 'Right, so let us begin today.'},
+        {'role': 'guest', 'content': '好的。'},
+        {'role': 'guest', 'content': '我们开始吧。'},
+    ]
+    segments = plan_segments(dialogue, max_chars=200, min_chars=12)
+    assert segments == [
+        {'role': 'host', 'content': 'Yes. Right, so let us begin today.', 'lines': [0, 1]},
+        {'role': 'guest', 'content': '好的。我们开始吧。', 'lines': [2, 3]},
+    ]
+
+
+def test_plan_keeps_order_and_skips_invalid_items():
+    dialogue = ['不是字典', {'role': 'host', 'content': ''}, {'role': 'host', 'content': '第一句话比较长，不需要合并。'},
+                {'role': 'guest', 'content': '第二句话同样比较长，不需要合并。'}]
+    segments = plan_segments(dialogue, max_chars=200, min_chars=5)
+    assert [(s['role'], s['lines']) for s in segments] == [('host', [2]), ('guest', [3])]
+
+
+def test_plan_respects_max_chars_and_coalesce_flag():
+    dialogue = [{'role': 'host', 'content': '短句。'}, {'role': 'host', 'content': '又一句。'}]
+    assert len(plan_segments(dialogue, coalesce=False)) == 2
+    assert len(plan_segments(dialogue, max_chars=5)) == 2
+    long = [{'role': 'host', 'content': 'One sentence here. ' * 20}]
+    assert all(len(s['content']) <= 50 for s in plan_segments(long, max_chars=50))
+
+
+def test_chapters_map_segments_back_to_lines():
+    segments = [{'role': 'host', 'content': 'a', 'lines': [0, 1]}, {'role': 'guest', 'content': 'b', 'lines': [2]},
+                {'role': 'guest', 'content': 'c', 'lines': [2]}]
+    assert tts_segment.chapters(segments, [0.0, 1.5, 3.0]) == [
+        {'line': 0, 'role': 'host', 'start': 0.0},
+        {'line': 1, 'role': 'host', 'start': 0.0},
+        {'line': 2, 'role': 'guest', 'start': 1.5},
+    ]
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：api.py 压测工具。生成指定规模的模拟任务列表与任务目录，按目标 RPS 发出 get_task/get_list/post_task
+#           混合请求，统计各接口的延迟分位数、吞吐与错误率，并可对比两次压测结果，用于上线前发现存储与接口性能退化
+#
+#   python tools/loadtest.py generate bench --tasks 100000
+#   python tools/loadtest.py run --serve bench --rps 50 --duration 60 --out after.json
+#   python tools/loadtest.py compare before.json after.json
+#
+# run --serve 在数据目录中启动 api（工作目录为数据目录），数据目录中放置 config.py 时优先于项目根目录的配置，
+# 可用于关闭准入限制或修改 api_workers；不加 --serve 时通过 --url 压测已启动的服务，--dir 指定其任务数据用于抽取任务ID
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# api 启动时从工作目录加载的页面与静态资源
+STATIC_FILES = ['index.html', 'list.html', 'del.html', 'resources']
+DEFAULT_MIX = 'get_task=80,get_list=5,post_task=15'
+PERCENTILES = (50, 90, 95, 99)
+ROLES = ['leo', 'kunkun']
+# 模拟对话使用的字符
+CHARS = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经'
+SAMPLE_RATE = 16000
+
+
+def log(message):
+    print(f"[{datetime.now().isoformat(timespec='seconds')}] {message}", flush=True)
+
+
+# ---------------------------------------------------------------- 生成数据
+
+def silent_wav(frames):
+    # 16 位单声道 PCM wav，manifest 中的时长按帧数计算
+    data = b'\x00\x00' * frames
+    header = b'RIFF' + struct.pack('<I', 36 + len(data)) + b'WAVE'
+    header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16)
+    header += b'data' + struct.pack('<I', len(data))
+    return header + data
+
+
+def make_dialogue(rng, lines, chars):
+    return [{'role': ROLES[i % 2], 'content': ''.join(rng.choice(CHARS) for _ in range(rng.randint(chars // 2, chars)))}
+            for i in range(lines)]
+
+
+def task_dir(data_dir, task_id):
+    # 与 config.get_task_file 相同的分片目录
+    return os.path.join(data_dir, 'output', task_id[:2], task_id)
+
+
+def write_task_files(data_dir, task_id, title, dialogue, audio, created_at):
+    directory = task_dir(data_dir, task_id)
+    os.makedirs(directory, exist_ok=True)
+    wav_path = os.path.join(directory, f"{task_id}.wav")
+    with open(wav_path, 'wb') as f:
+        f.write(audio)
+    stat = os.stat(wav_path)
+    duration = round((len(audio) - 44) / 2 / SAMPLE_RATE, 3)
+    data = {
+        'version': 1,
+        'taskId': task_id,
+        'title': title,
+        'dialogue': dialogue,
+        # 与任务服务器合成结束时写入的进度结构相同
+        'progress': {'current_line': len(dialogue), 'total_lines': len(dialogue), 'content': dialogue[-1]['content']},
+        'artifacts': {
+            f"{task_id}.wav": {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': None, 'duration': duration},
+        },
+        'duration': duration,
+        'chapters': [{'line': i, 'role': item['role'], 'start': round(duration * i / len(dialogue), 3)}
+                     for i, item in enumerate(dialogue)],
+        'updatedAt': created_at,
+    }
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    data_dir = args.dir
+    if os.path.exists(os.path.join(data_dir, 'task_list.json')) and not args.force:
+        sys.exit(f"{data_dir} 中已有 task_list.json，使用 --force 覆盖")
+    shutil.rmtree(os.path.join(data_dir, 'output'), ignore_errors=True)
+    os.makedirs(data_dir, exist_ok=True)
+    for name in STATIC_FILES:
+        target = os.path.join(data_dir, name)
+        if not os.path.lexists(target):
+            os.symlink(os.path.join(ROOT, name), target)
+
+    audio = silent_wav(args.audio_frames)
+    now = datetime.now()
+    tasks = []
+    started = time.time()
+    for i in range(args.tasks):
+        task_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        created = now - timedelta(seconds=rng.randint(0, args.days * 86400))
+        roll = rng.random()
+        if roll < args.completed:
+            status, progress = 'completed', '任务完成'
+        elif roll < args.completed + args.failed:
+            status, progress = 'failed', 'TTS音频生成失败'
+        else:
+            status, progress = 'cancelled', '任务已取消'
+        task = {
+            'taskId': task_id,
+            'url': f"https://example.com/articles/{i}",
+            'status': status,
+            'progress': progress,
+            'createdAt': created.isoformat(),
+            'updatedAt': (created + timedelta(minutes=5)).isoformat(),
+        }
+        tasks.append(task)
+        if status == 'completed':
+            title = ''.join(rng.choice(CHARS) for _ in range(12))
+            write_task_files(data_dir, task_id, title, make_dialogue(rng, args.lines, args.line_chars),
+                             audio, task['updatedAt'])
+        if (i + 1) % 10000 == 0:
+            log(f"已生成 {i + 1}/{args.tasks} 个任务")
+    tasks.sort(key=lambda t: t['createdAt'])
+    with open(os.path.join(data_dir, 'task_list.json'), 'w', encoding='utf-8') as f:
+        json.dump(tasks, f, indent=4)
+    log(f"生成完成：{args.tasks} 个任务，耗时 {time.time() - started:.1f} 秒，目录 {data_dir}")
+
+
+# ---------------------------------------------------------------- 压测
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('get_task', 'get_list', 'post_task'):
+            sys.exit(f"未知的接口: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def load_task_ids(data_dir):
+    if not data_dir:
+        return []
+    with open(os.path.join(data_dir, 'task_list.json'), 'r', encoding='utf-8') as f:
+        return [task['taskId'] for task in json.load(f)]
+
+
+def serve(data_dir, port):
+    # 工作目录为数据目录，任务列表、output 与静态资源都从这里读取；数据目录在前，其中的 config.py 优先
+    # api 的日志写入数据目录中的 api.log，不与压测结果混在一起
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.abspath(data_dir), ROOT]))
+    with open(os.path.join(data_dir, 'api.log'), 'ab') as output:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+            cwd=data_dir, env=env, stdout=output, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"api 启动失败，退出码 {process.returncode}")
+        try:
+            requests.get(url + '/get_task', params={'taskId': '-'}, timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit('等待 api 启动超时')
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, latency, status):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((latency, status))
+
+
+class Workload:
+    def __init__(self, url, mix, task_ids, timeout):
+        self.url = url.rstrip('/')
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.task_ids = task_ids
+        self.timeout = timeout
+        self.local = threading.local()
+        self._lock = threading.Lock()
+
+    def session(self):
+        # 每个线程一个连接池，复用 keep-alive 连接
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def request(self, endpoint, rng):
+        session = self.session()
+        if endpoint == 'get_task':
+            with self._lock:
+                task_id = rng.choice(self.task_ids) if self.task_ids else str(uuid.uuid4())
+            return session.get(f"{self.url}/get_task", params={'taskId': task_id}, timeout=self.timeout)
+        if endpoint == 'get_list':
+            return session.get(f"{self.url}/get_list", timeout=self.timeout)
+        response = session.post(f"{self.url}/post_task", json={'url': f"https://example.com/load/{uuid.uuid4()}"},
+                                timeout=self.timeout)
+        if response.status_code == 200:
+            with self._lock:
+                self.task_ids.append(response.json()['taskId'])
+        return response
+
+
+def run_load(workload, rps, duration, warmup, concurrency, seed):
+    """
+    开环压测：请求按目标 RPS 的固定间隔发出，不等待前一个请求返回。延迟从计划发出的时间开始计算，
+    服务变慢导致请求在本地排队时，排队时间同样计入延迟，不会因为发送变慢而低估延迟
+    """
+    rng = random.Random(seed)
+    recorder = Recorder()
+    interval = 1.0 / rps
+    total = int((warmup + duration) * rps)
+    begin = time.perf_counter() + 0.1
+
+    def fire(endpoint, scheduled, measured):
+        try:
+            status = workload.request(endpoint, rng).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        if measured:
+            recorder.add(endpoint, time.perf_counter() - scheduled, status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i in range(total):
+            scheduled = begin + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = rng.choices(workload.names, workload.weights)[0]
+            executor.submit(fire, endpoint, scheduled, i * interval >= warmup)
+    elapsed = time.perf_counter() - begin - warmup
+    return recorder.samples, elapsed
+
+
+def percentile(values, p):
+    # 最近秩法，values 已排序
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(samples, elapsed):
+    # 5xx 与连接失败计为错误，429 为准入控制拒绝，单独统计
+    report = {}
+    for endpoint, items in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in items)
+        statuses = {}
+        for _, status in items:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        errors = sum(count for status, count in statuses.items() if not status.isdigit() or status.startswith('5'))
+        entry = {
+            'requests': len(items),
+            'throughput': round(len(items) / elapsed, 2),
+            'errorRate': round(errors / len(items), 4),
+            'rejected': statuses.get('429', 0),
+            'statuses': statuses,
+            'maxMs': round(latencies[-1] * 1000, 2),
+        }
+        for p in PERCENTILES:
+            entry[f'p{p}Ms'] = round(percentile(latencies, p) * 1000, 2)
+        report[endpoint] = entry
+    return report
+
+
+def print_report(report):
+    columns = ['requests', 'throughput', 'errorRate', 'rejected'] + [f'p{p}Ms' for p in PERCENTILES] + ['maxMs']
+    print(f"{'endpoint':<12}" + ''.join(f"{c:>12}" for c in columns))
+    for endpoint, entry in report['endpoints'].items():
+        print(f"{endpoint:<12}" + ''.join(f"{entry[c]:>12}" for c in columns))
+
+
+def run(args):
+    process = None
+    if args.serve:
+        process, url = serve(args.serve, args.port)
+        data_dir = args.serve
+    else:
+        url, data_dir = args.url, args.dir
+    try:
+        task_ids = load_task_ids(data_dir)
+        workload = Workload(url, parse_mix(args.mix), task_ids, args.timeout)
+        log(f"开始压测 {url}：{args.rps} RPS，持续 {args.duration} 秒（预热 {args.warmup} 秒），任务数 {len(task_ids)}")
+        samples, elapsed = run_load(workload, args.rps, args.duration, args.warmup, args.concurrency, args.seed)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+    report = {
+        'startedAt': datetime.now().isoformat(timespec='seconds'),
+        'url': url,
+        'tasks': len(task_ids),
+        'targetRps': args.rps,
+        'duration': round(elapsed, 2),
+        'mix': args.mix,
+        'endpoints': summarize(samples, elapsed),
+    }
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        log(f"结果已保存到 {args.out}")
+
+
+# ---------------------------------------------------------------- 对比
+
+def compare(args):
+    """
+    对比两次压测结果，延迟分位数或吞吐变差超过 --threshold（百分比）、错误率上升时标记为退化并以退出码 1 结束
+    """
+    with open(args.base, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    regressions = []
+    print(f"{'endpoint':<12}{'metric':<12}{'base':>12}{'new':>12}{'change':>10}")
+    for endpoint in sorted(set(base['endpoints']) | set(new['endpoints'])):
+        old_entry, new_entry = base['endpoints'].get(endpoint), new['endpoints'].get(endpoint)
+        if not old_entry or not new_entry:
+            print(f"{endpoint:<12}只在{'新' if new_entry else '基准'}结果中出现")
+            continue
+        for metric in [f'p{p}Ms' for p in PERCENTILES] + ['throughput', 'errorRate']:
+            old_value, new_value = old_entry[metric], new_entry[metric]
+            change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            if metric == 'errorRate':
+                worse = new_value > old_value + args.error_margin
+            elif metric == 'throughput':
+                worse = change < -args.threshold
+            else:
+                worse = change > args.threshold
+            mark = '  !' if worse else ''
+            print(f"{endpoint:<12}{metric:<12}{old_value:>12}{new_value:>12}{change:>9.1f}%{mark}")
+            if worse:
+                regressions.append(f"{endpoint} {metric}")
+    if base.get('tasks') != new.get('tasks') or base.get('targetRps') != new.get('targetRps'):
+        log(f"注意：两次压测的任务数或目标 RPS 不同（{base.get('tasks')}/{base.get('targetRps')} 与 "
+            f"{new.get('tasks')}/{new.get('targetRps')}）")
+    if regressions:
+        log(f"发现 {len(regressions)} 项退化: {', '.join(regressions)}")
+        sys.exit(1)
+    log('未发现退化')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='api.py 压测工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help='生成模拟任务列表与任务目录')
+    gen.add_argument('dir', help='数据目录')
+    gen.add_argument('--tasks', type=int, default=10000)
+    gen.add_argument('--completed', type=float, default=0.9, help='已完成任务的比例')
+    gen.add_argument('--failed', type=float, default=0.05, help='失败任务的比例，其余为已取消')
+    gen.add_argument('--lines', type=int, default=30, help='每个任务的对话条数')
+    gen.add_argument('--line-chars', type=int, default=80, help='每条对话的最大字数')
+    gen.add_argument('--audio-frames', type=int, default=1600, help='合并音频的帧数（16kHz）')
+    gen.add_argument('--days', type=int, default=365, help='任务创建时间分布的天数')
+    gen.add_argument('--seed', type=int, default=1)
+    gen.add_argument('--force', action='store_true', help='覆盖已有数据')
+
+    load = sub.add_parser('run', help='按目标 RPS 发出混合请求')
+    target = load.add_mutually_exclusive_group(required=True)
+    target.add_argument('--serve', metavar='DIR', help='在数据目录中启动 api 后压测，结束时关闭')
+    target.add_argument('--url', help='已启动的 api 地址')
+    load.add_argument('--dir', help='--url 模式下 api 使用的数据目录，用于抽取任务ID')
+    load.add_argument('--port', type=int, default=18811)
+    load.add_argument('--rps', type=float, default=20)
+    load.add_argument('--duration', type=float, default=30, help='统计时长(秒)')
+    load.add_argument('--warmup', type=float, default=5, help='预热时长(秒)，不计入统计')
+    load.add_argument('--mix', default=DEFAULT_MIX, help=f'接口权重，默认 {DEFAULT_MIX}')
+    load.add_argument('--concurrency', type=int, default=64, help='最大同时进行的请求数')
+    load.add_argument('--timeout', type=float, default=30)
+    load.add_argument('--seed', type=int, default=1)
+    load.add_argument('--out', help='结果保存为 JSON，供 compare 使用')
+
+    cmp = sub.add_parser('compare', help='对比两次压测结果')
+    cmp.add_argument('base')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=10, help='延迟与吞吐允许变差的百分比')
+    cmp.add_argument('--error-margin', type=float, default=0.001, help='错误率允许上升的幅度')
+
+    args = parser.parse_args()
+    {'generate': generate, 'run': run, 'compare': compare}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：TTS 请求客户端，多个TTS后端按负载与健康状态路由；按后端在线统计延迟分位数，请求超过分位数延迟仍未返回时发出对冲请求，先成功者胜出，另一个被取消
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import quote, urlsplit
+
+import requests
+
+import config
+import logs
+from task_control import AbortableSession, TaskCancelled
+
+log = logs.get_log('tts')
+
+
+class LatencyTracker:
+    """按后端记录最近 window 次成功请求的耗时，用于计算对冲延迟"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, backend, seconds):
+        with self._lock:
+            self._samples.setdefault(backend, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, backend, percent):
+        # 样本不足时返回 None，不对冲
+        with self._lock:
+            samples = sorted(self._samples.get(backend, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percent / 100))
+        return samples[index]
+
+
+class HedgeBudget:
+    """对冲预算：对冲请求数不超过主请求数的 ratio 倍，额外负载有上限"""
+
+    def __init__(self, ratio=0.1, burst=2):
+        self.ratio = ratio
+        self.burst = burst
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.requests * self.ratio + self.burst:
+                return False
+            self.hedges += 1
+            return True
+
+    def count_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def rate(self):
+        with self._lock:
+            return self.hedges / self.requests if self.requests else 0.0
+
+
+class Backend:
+    """单个TTS后端，url 为模板（{text} {anchor_type} 会被替换为URL编码后的值），为空时使用 config.get_tts_url"""
+
+    def __init__(self, url=None, weight=1, max_concurrency=0, health_url=None, name=None):
+        self.url = url
+        self.weight = max(weight, 0.01)
+        # max_concurrency <= 0 表示不限制
+        self.max_concurrency = max_concurrency
+        self.health_url = health_url
+        self.name = name or urlsplit(url or config.get_tts_url('', config.host_speaker)).netloc
+        self.outstanding = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0
+
+    def build_url(self, text, anchor_type):
+        if self.url is None:
+            return config.get_tts_url(text, anchor_type)
+        return self.url.format(text=quote(text), anchor_type=quote(anchor_type))
+
+    @property
+    def ejected(self):
+        return time.time() < self.ejected_until
+
+
+class BackendPool:
+    """
+    TTS后端池：按 (进行中请求数+1)/权重 选择最空闲的后端，遵守各后端的并发上限；
+    连续失败的后端被摘除一段时间（多次摘除时时长翻倍），到期或主动健康检查成功后恢复
+    """
+
+    def __init__(self, backends, eject_failures=3, eject_seconds=30, max_eject_seconds=300, health_check_interval=0):
+        self.backends = backends
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        self._health_thread = None
+
+    def _candidates(self, exclude):
+        backends = [b for b in self.backends if b not in exclude]
+        healthy = [b for b in backends if not b.ejected]
+        # 全部被摘除时仍然尝试请求，避免整体不可用
+        return [b for b in (healthy or backends) if b.max_concurrency <= 0 or b.outstanding < b.max_concurrency]
+
+    def acquire(self, token=None, exclude=(), wait=True):
+        # 选择一个后端并占用一个并发名额，wait 为 False 时没有空闲后端直接返回 None
+        self.start_health_checks()
+        while True:
+            with self._cond:
+                candidates = self._candidates(exclude)
+                if candidates:
+                    backend = min(candidates, key=lambda b: (b.outstanding + 1) / b.weight)
+                    backend.outstanding += 1
+                    return backend
+                if not wait:
+                    return None
+                self._cond.wait(0.2)
+            if token:
+                token.check()
+
+    def release(self, backend, ok, abandoned=False):
+        with self._cond:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+                backend.ejections = 0
+            elif not abandoned:
+                # 被对冲放弃的请求不计为后端故障
+                backend.failures += 1
+                if backend.failures >= self.eject_failures and not backend.ejected:
+                    self._eject(backend, f"连续失败 {backend.failures} 次")
+            self._cond.notify_all()
+
+    def _eject(self, backend, reason):
+        seconds = min(self.eject_seconds * 2 ** backend.ejections, self.max_eject_seconds)
+        backend.ejections += 1
+        backend.failures = 0
+        backend.ejected_until = time.time() + seconds
+        log(f"TTS后端 {backend.name} {reason}，摘除 {seconds} 秒", logging.WARNING, backend=backend.name)
+
+    def _readmit(self, backend):
+        backend.ejected_until = 0
+        backend.failures = 0
+        log(f"TTS后端 {backend.name} 健康检查恢复，重新加入", backend=backend.name)
+        self._cond.notify_all()
+
+    def start_health_checks(self):
+        if self.health_check_interval <= 0 or self._health_thread is not None:
+            return
+        with self._cond:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name='tts-health', daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            for backend in self.backends:
+                if backend.health_url:
+                    self.check_health(backend)
+            time.sleep(self.health_check_interval)
+
+    def check_health(self, backend):
+        # 主动健康检查：能连通且没有返回 5xx 即视为健康
+        try:
+            healthy = requests.get(backend.health_url, timeout=5).status_code < 500
+        except requests.RequestException:
+            healthy = False
+        with self._cond:
+            if healthy and backend.ejected:
+                self._readmit(backend)
+            elif not healthy and not backend.ejected:
+                self._eject(backend, "健康检查失败")
+        return healthy
+
+    def capacity(self):
+        # 所有后端的并发上限之和，有不限制并发的后端时返回 0
+        if any(b.max_concurrency <= 0 for b in self.backends):
+            return 0
+        return sum(b.max_concurrency for b in self.backends)
+
+
+def create_pool():
+    backends = []
+    for item in getattr(config, 'tts_backends', None) or []:
+        parts = urlsplit(item['url'])
+        backends.append(Backend(
+            url=item['url'],
+            weight=item.get('weight', 1),
+            max_concurrency=item.get('max_concurrency', 0),
+            # 默认检查后端根路径
+            health_url=item.get('health_url', f"{parts.scheme}://{parts.netloc}/"),
+        ))
+    if not backends:
+        # 未配置后端池时只使用 config.get_tts_url 指向的单个后端
+        return BackendPool([Backend()])
+    return BackendPool(
+        backends,
+        eject_failures=getattr(config, 'tts_eject_failures', 3),
+        eject_seconds=getattr(config, 'tts_eject_seconds', 30),
+        health_check_interval=getattr(config, 'tts_health_check_interval', 10),
+    )
+
+
+class _Call:
+    """
+    在后台线程中执行的单次请求，使用独立的 Session；结束或被放弃时归还后端名额（只归还一次）。
+    放弃时直接关闭连接的 socket，后端随之停止处理，不再计入该后端的进行中请求数
+    """
+    def __init__(self, pool, backend, url, headers, timeout, done):
+        self.pool = pool
+        self.backend = backend
+        self.session = AbortableSession()
+        self.started = time.time()
+        self.finished = None
+        self.content = None
+        self.error = None
+        self.abandoned = False
+        self._released = False
+        self._lock = threading.Lock()
+        self._done = done
+        threading.Thread(target=self._run, args=(url, headers, timeout), daemon=True).start()
+
+    def _run(self, url, headers, timeout):
+        try:
+            response = self.session.get(url, timeout=timeout, headers=headers)
+            response.raise_for_status()
+            self.content = response.content
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.finished = time.time()
+            self._release(self.error is None)
+            self.session.close()
+            self._done.set()
+
+    def _release(self, ok):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.pool.release(self.backend, ok, self.abandoned)
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def abandon(self):
+        self.abandoned = True
+        self._release(False)
+        try:
+            self.session.abort()
+        except Exception:
+            pass
+
+
+class TTSClient:
+    def __init__(self, pool, hedge=False, percentile=95, budget=0.1, timeout=120, retries=3, min_samples=20):
+        self.pool = pool
+        self.hedge = hedge
+        self.percentile = percentile
+        self.timeout = timeout
+        self.retries = retries
+        self.latency = LatencyTracker(min_samples=min_samples)
+        self.budget = HedgeBudget(budget)
+
+    def _hedge_delay(self, backend):
+        if not self.hedge:
+            return None
+        return self.latency.percentile(backend.name, self.percentile)
+
+    def _start(self, backend, text, anchor_type, headers, done):
+        # backend 已被 acquire，请求没能开始时归还名额
+        try:
+            return _Call(self.pool, backend, backend.build_url(text, anchor_type), headers, self.timeout, done)
+        except BaseException:
+            self.pool.release(backend, False, abandoned=True)
+            raise
+
+    def _attempt(self, text, anchor_type, headers, token):
+        # 单次尝试：主请求超过对冲延迟仍未返回时向另一个后端（没有则同一后端）发出对冲请求，返回先成功的结果
+        backend = self.pool.acquire(token)
+        delay = self._hedge_delay(backend)
+        done = threading.Event()
+        calls = [self._start(backend, text, anchor_type, headers, done)]
+        self.budget.count_request()
+        try:
+            while True:
+                done.wait(0.2)
+                done.clear()
+                if token and token.is_cancelled():
+                    raise TaskCancelled(token.task_id, token.reason)
+                for call in calls:
+                    if call.finished and call.error is None:
+                        self.latency.record(call.backend.name, call.elapsed)
+                        if call is not calls[0]:
+                            self.budget.count_win()
+                        return call.content
+                if all(call.finished for call in calls):
+                    raise calls[-1].error
+                if delay is not None and len(calls) == 1 and calls[0].elapsed >= delay:
+                    hedge_backend = None
+                    if self.budget.try_hedge():
+                        hedge_backend = (self.pool.acquire(exclude=[backend], wait=False)
+                                         or self.pool.acquire(wait=False))
+                    if hedge_backend:
+                        log(f"TTS请求超过P{self.percentile}延迟 {delay:.2f}s 仍未返回，向 {hedge_backend.name} 发出对冲请求，当前对冲比例 {self.budget.rate():.1%}",
+                            backend=backend.name)
+                        calls.append(self._start(hedge_backend, text, anchor_type, headers, done))
+                    # 预算用尽或没有空闲后端时，本次不再对冲
+                    delay = None
+        finally:
+            for call in calls:
+                if not call.finished:
+                    call.abandon()
+
+    def request(self, text, anchor_type, token=None):
+        headers = config.get_tts_headers()
+        for _ in range(self.retries):
+            if token:
+                token.check()
+            try:
+                return self._attempt(text, anchor_type, headers, token)
+            except requests.RequestException as e:
+                log(f"TTS请求失败: {str(e)}，正在重试...")
+        log(f"TTS请求失败{self.retries}次，放弃尝试")
+        return None
+
+    def stats(self):
+        return {
+            'requests': self.budget.requests,
+            'hedges': self.budget.hedges,
+            'hedgeWins': self.budget.hedge_wins,
+            'hedgeRate': round(self.budget.rate(), 4),
+        }
+
+
+client = TTSClient(
+    create_pool(),
+    hedge=getattr(config, 'tts_hedge', False),
+    percentile=getattr(config, 'tts_hedge_percentile', 95),
+    budget=getattr(config, 'tts_hedge_budget', 0.1),
+    timeout=getattr(config, 'tts_timeout', 120),
+    retries=getattr(config, 'tts_retries', 3),
+    min_samples=getattr(config, 'tts_hedge_min_samples', 20),
+)
+
+
+def tts_request(text, anchor_type, token=None):
+    return client.request(text, anchor_type, token)
+
+
+def log_stats():
+    # 输出对冲请求统计，便于评估额外负载
+    if client.hedge:
+        stats = client.stats()
+        log(f"TTS对冲统计: 共 {stats['requests']} 次请求，对冲 {stats['hedges']} 次（{stats['hedgeRate']:.1%}），对冲请求胜出 {stats['hedgeWins']} 次", **stats)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# describe：TTS 请求切分，超长对话按句子切分为长度受限的片段，同一角色连续的短句合并为一次请求，保持说话顺序
+import re
+
+# 句末标点（保留在句子末尾）；英文句号只在后面是空白时算句末，避免切开 3.14、e.g. 之类
+SENTENCE_END = re.compile(r'(?<=[。！？!?；;…\n])|(?<=\.)(?=\s)')
+# 句子仍然超长时退而按逗号等次级标点切分
+CLAUSE_END = re.compile(r'(?<=[，,、：:])')
+# 没有标点时按长度切分的最小单位：拉丁字母单词（连同后面的空白）整体保留，其余逐字
+TOKEN = re.compile(r"[0-9A-Za-z\u00C0-\u024F'’_-]+\s*|\s+|.", re.S)
+# 中日韩文字与全角标点，两侧都是时拼接不加空格
+CJK = re.compile(r'[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def _pack(pieces, max_chars):
+    # 把小段依次装入不超过 max_chars 的片段中
+    chunks = []
+    current = ''
+    for piece in pieces:
+        if current and len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ''
+        current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _hard_split(clause, max_chars):
+    # 不在拉丁字母单词中间切断，单个单词本身超长时才按长度硬切
+    pieces = []
+    for token in _pack(TOKEN.findall(clause), max_chars):
+        pieces.extend(token[i:i + max_chars] for i in range(0, len(token), max_chars))
+    return pieces
+
+
+def join(left, right):
+    # 合并两段文本，除非两侧都是中日韩文字，否则中间加空格（英文句子合并后不会粘在一起）
+    if left and right and not (CJK.match(left[-1]) and CJK.match(right[0])):
+        return f"{left} {right}"
+    return left + right
+
+
+def split_text(text, max_chars):
+    text = text.strip()
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text] if text else []
+    pieces = []
+    for sentence in SENTENCE_END.split(text):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in CLAUSE_END.split(sentence):
+            # 没有任何标点的超长内容只能按长度切分
+            pieces.extend(_hard_split(clause, max_chars))
+    return [chunk.strip() for chunk in _pack([p for p in pieces if p], max_chars) if chunk.strip()]
+
+
+def plan_segments(dialogue, max_chars=200, min_chars=12, coalesce=True):
+    """
+    返回 TTS 请求片段列表 [{'role': 角色, 'content': 文本, 'lines': [对应的对话下标]}]。
+    非字典或没有内容的对话项会被跳过
+    """
+    segments = []
+    for index, item in enumerate(dialogue):
+        if not isinstance(item, dict) or not item.get('content'):
+            continue
+        for chunk in split_text(str(item['content']), max_chars):
+            previous = segments[-1] if segments else None
+            joined = join(previous['content'], chunk) if previous else chunk
+            if (coalesce and previous and previous['role'] == item['role']
+                    and (len(chunk) < min_chars or len(previous['content']) < min_chars)
+                    and (max_chars <= 0 or len(joined) <= max_chars)):
+                previous['content'] = joined
+                if previous['lines'][-1] != index:
+                    previous['lines'].append(index)
+                continue
+            segments.append({'role': item['role'], 'content': chunk, 'lines': [index]})
+    return segments
+
+
+def chapters(segments, starts):
+    # 把各片段在合并音频中的起始时间映射回对话序号；一条对话拆成多段时取第一段，合并请求的多条短对话共用同一起始时间
+    result = {}
+    for segment, start in zip(segments, starts):
+        if start is None:
+            continue
+        for line in segment['lines']:
+            result.setdefault(line, {'line': line, 'role': segment['role'], 'start': start})
+    return [result[line] for line in sorted(result)]